@@ -1,24 +1,30 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
-import mysql.connector
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, Response
 import pandas as pd
 import os
 from dotenv import load_dotenv
 from datetime import datetime
 import math
 from io import BytesIO
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email.mime.text import MIMEText
-from email import encoders
-
-# Thử import APScheduler, nếu chưa cài đặt thì bỏ qua tính năng tự động
-try:
-    from apscheduler.schedulers.background import BackgroundScheduler
-    HAS_SCHEDULER = True
-except ImportError:
-    HAS_SCHEDULER = False
-    print("⚠️ Cảnh báo: Chưa cài đặt 'apscheduler'. Tính năng gửi email tự động sẽ không hoạt động.")
+
+import bbr_report
+import catalog
+import db
+import exports
+import inbound_import
+import jobs
+import loadplan
+import masterdata_import
+import pagination
+import pallet_ledger
+import print_docs
+import refdata
+import reports
+import outbound_import
+import scan_import
+import scan_live
+import typeahead
+import versions
+from db import get_db_connection
 
 # 1. Tải biến môi trường
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
@@ -33,27 +39,8 @@ else:
 app = Flask(__name__)
 app.secret_key = 'supersecretkey'  # Cần thiết cho flash messages
 
-# 2. Hàm kết nối Database
-def get_db_connection():
-    host = os.getenv("DB_HOST")
-    if not host:
-        print("❌ Lỗi: Biến môi trường DB_HOST chưa được cấu hình. Vui lòng kiểm tra file .env hoặc cấu hình trên Render.")
-        return None
-
-    try:
-        conn = mysql.connector.connect(
-            host=host,
-            port=int(os.getenv("DB_PORT") or 3306),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            database=os.getenv("DB_NAME"),
-            ssl_ca=os.getenv("DB_SSL_CA"),
-            ssl_disabled=False
-        )
-        return conn
-    except mysql.connector.Error as e:
-        print(f"❌ Lỗi kết nối MySQL ({host}): {e}")
-        return None
+# 2. Kết nối Database qua pool (mỗi request mượn một kết nối, trả lại khi teardown)
+db.init_app(app)
 
 # --- ROUTES ---
 
@@ -61,6 +48,38 @@ def get_db_connection():
 def index():
     return redirect(url_for('supplier'))
 
+# Thống kê pool kết nối (để điều chỉnh DB_POOL_SIZE)
+@app.route('/api/db_pool_stats')
+def db_pool_stats():
+    return jsonify(db.pool.get_stats())
+
+# Hit/miss của cache dữ liệu tham chiếu (masterdata, nhacungcap)
+@app.route('/api/refdata_stats')
+def refdata_stats():
+    return jsonify(refdata.get_stats())
+
+# Trạng thái job import chạy nền (trang upload poll endpoint này)
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    conn = get_db_connection()
+    if not conn: return jsonify({'error': 'DB Error'}), 503
+    cursor = conn.cursor(dictionary=True)
+    job = jobs.get_job(cursor, job_id)
+    conn.close()
+    if not job:
+        return jsonify({'error': 'Không tìm thấy job'}), 404
+    return jsonify(job)
+
+# Lịch sử chạy báo cáo định kỳ của worker.py
+@app.route('/api/report_runs')
+def report_runs():
+    conn = get_db_connection()
+    if not conn: return jsonify({'error': 'DB Error'}), 503
+    cursor = conn.cursor(dictionary=True)
+    runs = reports.recent_runs(cursor)
+    conn.close()
+    return jsonify(runs)
+
 # === SUPPLIER ===
 @app.route('/supplier', methods=['GET', 'POST'])
 def supplier():
@@ -88,27 +107,16 @@ def supplier():
             else:
                 try:
                     cursor.execute("INSERT INTO nhacungcap (MANCC, TENNCC, QG) VALUES (%s, %s, %s)", (mancc, tenncc, qg))
+                    refdata.bump(cursor, 'nhacungcap')
+                    pagination.invalidate(cursor, 'nhacungcap')
                     conn.commit()
                     flash("Thêm mới thành công!", "success")
                 except Exception as e:
                     flash(f"Lỗi: {e}", "danger")
 
-        # Lấy danh sách
+        # Lấy danh sách (tìm theo index, COUNT có cache)
         per_page = 10
-        offset = (page - 1) * per_page
-
-        search = request.args.get('q', '')
-        if search:
-            cursor.execute("SELECT COUNT(*) as total FROM nhacungcap WHERE MANCC LIKE %s OR TENNCC LIKE %s", (f"%{search}%", f"%{search}%"))
-            res = cursor.fetchone()
-            total_records = res['total'] if res else 0
-            cursor.execute("SELECT * FROM nhacungcap WHERE MANCC LIKE %s OR TENNCC LIKE %s LIMIT %s OFFSET %s", (f"%{search}%", f"%{search}%", per_page, offset))
-        else:
-            cursor.execute("SELECT COUNT(*) as total FROM nhacungcap")
-            res = cursor.fetchone()
-            total_records = res['total'] if res else 0
-            cursor.execute("SELECT * FROM nhacungcap LIMIT %s OFFSET %s", (per_page, offset))
-        suppliers = cursor.fetchall()
+        suppliers, total_records = catalog.supplier_page(cursor, request.args.get('q', ''), page, per_page)
         total_pages = math.ceil(total_records / per_page) if total_records > 0 else 1
     except Exception as e:
         flash(f"Lỗi tải dữ liệu: {e}", "danger")
@@ -123,6 +131,8 @@ def delete_supplier(mancc):
     if conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM nhacungcap WHERE MANCC = %s", (mancc,))
+        refdata.bump(cursor, 'nhacungcap')
+        pagination.invalidate(cursor, 'nhacungcap')
         conn.commit()
         conn.close()
         flash(f"Đã xóa NCC: {mancc}", "success")
@@ -138,6 +148,8 @@ def update_supplier():
         qg = request.form.get('qg')
         try:
             cursor.execute("UPDATE nhacungcap SET TENNCC=%s, QG=%s WHERE MANCC=%s", (tenncc, qg, mancc))
+            refdata.bump(cursor, 'nhacungcap')
+            pagination.invalidate(cursor, 'nhacungcap')
             conn.commit()
             flash("Cập nhật thành công!", "success")
         except Exception as e:
@@ -171,7 +183,10 @@ def masterdata():
             sql = """INSERT INTO masterdata (MANCC, sku, description, quantity, weight, length, width, height, cbm, refix, loosecase, kindpallet) 
                      VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
             cursor.execute(sql, (mancc, sku, desc, qty, weight, length, width, height, cbm, refix, loosecase, kindpallet))
+            refdata.bump(cursor, 'masterdata')
+            pagination.invalidate(cursor, 'masterdata')
             conn.commit()
+            typeahead.add('sku', [sku])
             flash("Thêm Master Data thành công!", "success")
         except Exception as e:
             flash(f"Lỗi: {e}", "danger")
@@ -179,49 +194,45 @@ def masterdata():
     # Lấy danh sách + NCC dropdown
     page = request.args.get('page', 1, type=int)
     per_page = 10
-    offset = (page - 1) * per_page
 
-    # Sorting logic
+    # Sorting logic (cột hợp lệ: catalog.MASTERDATA_SORT)
     sort_by = request.args.get('sort_by', 'sku')
     order = request.args.get('order', 'asc')
-    
-    # Map tên tham số URL sang tên cột trong DB để tránh SQL Injection
-    valid_columns = {'sku': 'm.sku', 'TENNCC': 'n.TENNCC', 'quantity': 'm.quantity', 'cbm': 'm.cbm'}
-    sort_col = valid_columns.get(sort_by, 'm.sku')
     if order not in ['asc', 'desc']: order = 'asc'
 
-    search = request.args.get('q', '')
-    if search:
-        count_sql = """SELECT COUNT(*) as total FROM masterdata m LEFT JOIN nhacungcap n ON m.MANCC = n.MANCC 
-                       WHERE m.sku LIKE %s OR m.description LIKE %s"""
-        cursor.execute(count_sql, (f"%{search}%", f"%{search}%"))
-        total_records = cursor.fetchone()['total']
-
-        sql = f"""SELECT m.*, n.TENNCC FROM masterdata m LEFT JOIN nhacungcap n ON m.MANCC = n.MANCC 
-                 WHERE m.sku LIKE %s OR m.description LIKE %s ORDER BY {sort_col} {order.upper()} LIMIT %s OFFSET %s"""
-        cursor.execute(sql, (f"%{search}%", f"%{search}%", per_page, offset))
-    else:
-        cursor.execute("SELECT COUNT(*) as total FROM masterdata")
-        total_records = cursor.fetchone()['total']
-        
-        sql = f"""SELECT m.*, n.TENNCC FROM masterdata m LEFT JOIN nhacungcap n ON m.MANCC = n.MANCC 
-                  ORDER BY {sort_col} {order.upper()} LIMIT %s OFFSET %s"""
-        cursor.execute(sql, (per_page, offset))
-    items = cursor.fetchall()
+    items, total_records = catalog.masterdata_page(cursor, request.args.get('q', ''), sort_by, order, page, per_page)
     total_pages = math.ceil(total_records / per_page)
     
-    cursor.execute("SELECT MANCC, TENNCC FROM nhacungcap")
-    suppliers = cursor.fetchall()
+    suppliers = refdata.supplier_options(cursor)
     
     conn.close()
     return render_template('masterdata.html', items=items, suppliers=suppliers, page=page, total_pages=total_pages, sort_by=sort_by, order=order)
 
+@app.route('/masterdata/import', methods=['POST'])
+def import_masterdata():
+    file = request.files.get('file')
+    if not file or file.filename == '':
+        flash("Vui lòng chọn file để upload", "warning")
+        return redirect(url_for('masterdata'))
+    conn = get_db_connection()
+    if not conn: return "DB Error"
+    try:
+        job_id = jobs.submit(conn, 'masterdata', [file], masterdata_import.import_job)
+        conn.close()
+        return redirect(url_for('masterdata', job=job_id))
+    except Exception as e:
+        flash(f"Lỗi khi import file: {e}", "danger")
+    conn.close()
+    return redirect(url_for('masterdata'))
+
 @app.route('/masterdata/delete/<sku>')
 def delete_masterdata(sku):
     conn = get_db_connection()
     if conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM masterdata WHERE sku = %s", (sku,))
+        refdata.bump(cursor, 'masterdata')
+        pagination.invalidate(cursor, 'masterdata')
         conn.commit()
         conn.close()
         flash(f"Đã xóa SKU: {sku}", "success")
@@ -251,6 +262,8 @@ def update_masterdata():
                      length=%s, width=%s, height=%s, cbm=%s, refix=%s, loosecase=%s, kindpallet=%s, cartonperpallet=%s 
                      WHERE sku=%s"""
             cursor.execute(sql, (mancc, desc, qty, weight, length, width, height, cbm, refix, loosecase, kindpallet, cartonperpallet, sku))
+            refdata.bump(cursor, 'masterdata')
+            pagination.invalidate(cursor, 'masterdata')
             conn.commit()
             flash("Cập nhật Master Data thành công!", "success")
         except Exception as e:
@@ -268,203 +281,51 @@ def bbr():
         file = request.files['file']
         if file:
             try:
-                # Xử lý logic CSV tùy chỉnh
-                df_input = pd.read_csv(file)
-                df_input.columns = df_input.columns.str.strip()
-                
-                cursor = conn.cursor()
-                cursor.execute("SELECT sku, kindpallet FROM masterdata")
-                master_dict = {str(row[0]): row[1] for row in cursor.fetchall()}
-                
-                cursor.execute("SELECT keycheck FROM bbrreport WHERE Status IS NULL")
-                existing_keys = {str(row[0]) for row in cursor.fetchall() if row[0]}
-                
-                updates = []
-                inserts = []
-                
-                for _, row in df_input.iterrows():
-                    def get_str(col):
-                        val = row.get(col)
-                        return str(val).strip() if pd.notna(val) else ''
-
-                    po = get_str('PO Number')
-                    item = get_str('Item No')
-                    parent_po = get_str('Parent PO')
-                    origin = get_str('origin')
-                    vndr = get_str('VNDR CD')
-                    keycheck = f"{po}_{item}_{parent_po}"
-                    
-                    try:
-                        d_dt = pd.to_datetime(row.get('DELIVERY DT'))
-                        add_days = 3 if str(origin).upper() == 'VN' else 14
-                        new_date = d_dt + pd.Timedelta(days=add_days)
-                        new_date_str = new_date.strftime('%Y-%m-%d')
-                        week_num = new_date.isocalendar()[1]
-                    except:
-                        new_date_str = None
-                        week_num = None
-                    
-                    q_pck = pd.to_numeric(row.get('QTY per PCK'), errors='coerce') or 1
-                    qty_val = (pd.to_numeric(row.get('QTY'), errors='coerce') or 0) / q_pck
-                    
-                    if keycheck in existing_keys:
-                        updates.append((new_date_str, week_num, qty_val, keycheck))
-                    else:
-                        cbm = pd.to_numeric(row.get('MC CBM'), errors='coerce') or 0
-                        total_cbm = qty_val * cbm
-                        kind = master_dict.get(item, None)
-                        inserts.append((keycheck, origin, po, item, vndr, parent_po, new_date_str, qty_val, cbm, week_num, kind, total_cbm))
-                
-                if updates:
-                    cursor.executemany("UPDATE bbrreport SET deliverydate=%s, week=%s, qty=%s WHERE keycheck=%s AND Status IS NULL", updates)
-                if inserts:
-                    cursor.executemany("INSERT INTO bbrreport (keycheck, origin, PO, item, supplier, parentpo, deliverydate, qty, cbm, week, kindpallet, total_cbm) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)", inserts)
-                
-                conn.commit()
-                flash(f"Đã xử lý xong! Cập nhật: {len(updates)}, Thêm mới: {len(inserts)}", "success")
+                # Lưu file và xử lý trong nền; trang sẽ poll tiến độ qua /api/jobs/<id>
+                job_id = jobs.submit(conn, 'bbr', [file], bbr_report.import_job)
+                return redirect(url_for('bbr', job=job_id))
             except Exception as e:
                 flash(f"Lỗi xử lý file: {e}", "danger")
 
-    # Hiển thị dữ liệu
-    query = """
-        SELECT b.*, n.TENNCC 
-        FROM bbrreport b 
-        LEFT JOIN nhacungcap n ON b.supplier = n.MANCC
-    """
-    df = pd.read_sql(query, conn)
-    conn.close()
-    
-    # Lấy danh sách tuần (Week) để hiển thị dropdown
-    weeks = []
-    if 'week' in df.columns:
-        # Chuyển đổi dữ liệu cột week sang số để đảm bảo lọc chính xác
-        df['week'] = pd.to_numeric(df['week'], errors='coerce')
-        weeks = sorted(df['week'].dropna().unique().astype(int))
-
-    # Lọc theo tuần nếu có tham số
-    selected_week = request.args.get('week')
-    if selected_week and selected_week.isdigit() and 'week' in df.columns:
-        df = df[df['week'] == int(selected_week)]
+    # Hiển thị dữ liệu: lọc, tìm kiếm, sắp xếp và phân trang đều chạy trong SQL
+    cursor = conn.cursor(dictionary=True)
+    weeks = bbr_report.get_weeks(cursor)
 
-    # Tìm kiếm trên DataFrame
+    selected_week = request.args.get('week')
     search = request.args.get('q', '')
-    if search:
-        mask = df.apply(lambda x: x.astype(str).str.contains(search, case=False, na=False)).any(axis=1)
-        df = df[mask]
-    
-    # --- SORTING ---
+    match = request.args.get('match', 'fulltext')
+    source, params = bbr_report.build_filter(selected_week, search, match)
+
     sort_by = request.args.get('sort_by')
     order = request.args.get('order', 'asc')
-    
-    if sort_by and sort_by in df.columns:
-        ascending = True if order == 'asc' else False
-        df = df.sort_values(by=sort_by, ascending=ascending)
 
-    # Tính toán thống kê đơn giản
-    total_cbm = df['total_cbm'].sum() if 'total_cbm' in df.columns else 0
-    
-    # Thống kê theo Parent PO
-    po_stats = []
-    if not df.empty and 'parentpo' in df.columns:
-        # Tạo bản sao để đảm bảo dữ liệu số cho việc tính toán
-        df_stats = df.copy()
-        df_stats['total_cbm'] = pd.to_numeric(df_stats['total_cbm'], errors='coerce').fillna(0)
-        df_stats['qty'] = pd.to_numeric(df_stats['qty'], errors='coerce').fillna(0)
-        df_stats['TENNCC'] = df_stats['TENNCC'].fillna('')
-        
-        po_grouped = df_stats.groupby(['parentpo', 'TENNCC']).agg({
-            'qty': 'sum',
-            'total_cbm': 'sum'
-        }).reset_index()
-        
-        po_grouped = po_grouped.sort_values(by='total_cbm', ascending=False)
-        po_stats = po_grouped.to_dict(orient='records')
-
-    # Thống kê theo kindpallet
-    pallet_stats = {
-        '1m2': 0,
-        '1m6': 0,
-        '1m9': 0,
-        '1.5': 0
-    }
-    if 'kindpallet' in df.columns and 'total_cbm' in df.columns:
-        stats_grouped = df.groupby('kindpallet')['total_cbm'].sum()
-        cbm_1m2 = stats_grouped.get('1m2', 0)
-        cbm_1m6 = stats_grouped.get('1m6', 0)
-        cbm_1m9 = stats_grouped.get('1m9', 0)
-        
-        pallet_stats['1m2'] = (cbm_1m2 / 3.06) * 1.5 if cbm_1m2 > 0 else 0
-        pallet_stats['1m6'] = (cbm_1m6 / 4.08) * 1.5 if cbm_1m6 > 0 else 0
-        pallet_stats['1m9'] = (cbm_1m9 / 4.85) * 1.5 if cbm_1m9 > 0 else 0
-        pallet_stats['1.5'] = stats_grouped.get('1.5', 0)
-
-    # Thống kê Chipboard
-    chipboard_stats = {
-        '1210': 0,
-        '1610': 0,
-        '1910': 0
-    }
-    if 'item' in df.columns and 'total_cbm' in df.columns:
-        # Tính tổng CBM cho các nhóm SKU Chipboard
-        chipboard_stats['1210'] = df[df['item'].isin(["LLR68948", "LLR68952", "LLR68953"])]['total_cbm'].sum()
-        chipboard_stats['1610'] = df[df['item'].isin(["LLR68947", "LLR68951"])]['total_cbm'].sum()
-        chipboard_stats['1910'] = df[df['item'].isin(["LLR68946", "LLR68950", "LLR68960"])]['total_cbm'].sum()
+    # Thống kê (Tổng CBM, Pallet quy đổi, Chipboard, Parent PO) đọc từ bảng tổng hợp theo tuần
+    total_cbm, pallet_stats, chipboard_stats, po_stats = bbr_report.stats(cursor, selected_week, search, match)
 
-    # Phân trang cho DataFrame
+    # Phân trang
     page = request.args.get('page', 1, type=int)
     per_page = 50
-    total_records = len(df)
+    total_records = bbr_report.count_rows(cursor, source, params)
     total_pages = math.ceil(total_records / per_page)
-    start = (page - 1) * per_page
-    end = start + per_page
-    data_page = df.iloc[start:end].to_dict(orient='records')
+    data_page = bbr_report.fetch_page(cursor, source, params, sort_by, order, page, per_page)
+    conn.close()
 
-    return render_template('bbr.html', data=data_page, total_cbm=total_cbm, page=page, total_pages=total_pages, weeks=weeks, selected_week=selected_week, sort_by=sort_by, order=order, pallet_stats=pallet_stats, po_stats=po_stats, chipboard_stats=chipboard_stats)
+    return render_template('bbr.html', data=data_page, total_cbm=total_cbm, page=page, total_pages=total_pages, weeks=weeks, selected_week=selected_week, sort_by=sort_by, order=order, match=match, pallet_stats=pallet_stats, po_stats=po_stats, chipboard_stats=chipboard_stats)
 
 @app.route('/bbr/export_po_stats')
 def export_po_stats():
     conn = get_db_connection()
     if not conn: return "DB Error"
     
-    # 1. Lấy dữ liệu (Giống logic route bbr)
-    query = """
-        SELECT b.*, n.TENNCC 
-        FROM bbrreport b 
-        LEFT JOIN nhacungcap n ON b.supplier = n.MANCC
-    """
-    df = pd.read_sql(query, conn)
+    # 1. Thống kê theo Parent PO (cùng bộ lọc Tuần & Tìm kiếm với route bbr)
+    cursor = conn.cursor(dictionary=True)
+    po_stats = bbr_report.po_stats(cursor, request.args.get('week'), request.args.get('q', ''), request.args.get('match', 'fulltext'))
     conn.close()
 
-    # 2. Áp dụng bộ lọc (Tuần & Tìm kiếm)
-    if 'week' in df.columns:
-        df['week'] = pd.to_numeric(df['week'], errors='coerce')
-    
-    selected_week = request.args.get('week')
-    if selected_week and selected_week.isdigit() and 'week' in df.columns:
-        df = df[df['week'] == int(selected_week)]
-
-    search = request.args.get('q', '')
-    if search:
-        mask = df.apply(lambda x: x.astype(str).str.contains(search, case=False, na=False)).any(axis=1)
-        df = df[mask]
-
-    # 3. Gom nhóm dữ liệu
-    if not df.empty and 'parentpo' in df.columns:
-        df['total_cbm'] = pd.to_numeric(df['total_cbm'], errors='coerce').fillna(0)
-        df['qty'] = pd.to_numeric(df['qty'], errors='coerce').fillna(0)
-        df['TENNCC'] = df['TENNCC'].fillna('')
-        
-        po_grouped = df.groupby(['parentpo', 'TENNCC']).agg({
-            'qty': 'sum',
-            'total_cbm': 'sum'
-        }).reset_index()
-        
-        po_grouped = po_grouped.sort_values(by='total_cbm', ascending=False)
-        po_grouped.columns = ['Parent PO', 'Supplier', 'Tổng Số Kiện', 'Tổng CBM']
-    else:
-        po_grouped = pd.DataFrame(columns=['Parent PO', 'Supplier', 'Tổng Số Kiện', 'Tổng CBM'])
+    columns = ['Parent PO', 'Supplier', 'Tổng Số Kiện', 'Tổng CBM']
+    po_grouped = pd.DataFrame([(r['parentpo'], r['TENNCC'], r['qty'], r['total_cbm']) for r in po_stats], columns=columns)
 
-    # 4. Xuất ra Excel
+    # 2. Xuất ra Excel
     output = BytesIO()
     with pd.ExcelWriter(output, engine='openpyxl') as writer:
         po_grouped.to_excel(writer, index=False, sheet_name='PO Statistics')
@@ -472,6 +333,17 @@ def export_po_stats():
     
     return send_file(output, download_name="po_statistics.xlsx", as_attachment=True, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
 
+# API tìm keycheck theo từ khóa (FULLTEXT index)
+@app.route('/api/bbr/search')
+def api_bbr_search():
+    conn = get_db_connection()
+    if not conn: return jsonify([])
+    cursor = conn.cursor(dictionary=True)
+    keys = bbr_report.search_keychecks(cursor, request.args.get('q', ''), request.args.get('match', 'fulltext'),
+                                min(request.args.get('limit', 100, type=int), 1000))
+    conn.close()
+    return jsonify(keys)
+
 @app.route('/bbr/delete_week', methods=['POST'])
 def delete_bbr_week():
     conn = get_db_connection()
@@ -480,9 +352,10 @@ def delete_bbr_week():
         if week:
             try:
                 cursor = conn.cursor()
-                cursor.execute("DELETE FROM bbrreport WHERE week = %s", (week,))
-                conn.commit()
+                cursor.execute(bbr_report.DELETE_WEEK_SQL, (week,))
                 deleted_count = cursor.rowcount
+                bbr_report.delete_week_summary(cursor, week)
+                conn.commit()
                 cursor.close()
                 flash(f"Đã xóa {deleted_count} dòng dữ liệu của tuần {week}", "success")
             except Exception as e:
@@ -507,7 +380,7 @@ def inbound():
         labour = request.form.get('labour')
         
         # Lấy thông tin phụ
-        cursor.execute("SELECT supplier, cbm FROM bbrreport WHERE item = %s LIMIT 1", (sku,))
+        cursor.execute(bbr_report.SKU_INFO_SQL, (sku,))
         res = cursor.fetchone()
         mancc = res['supplier'] if res else ''
         unit_cbm = float(res['cbm']) if res and res['cbm'] else 0
@@ -516,84 +389,71 @@ def inbound():
         try:
             sql = "INSERT INTO inbound (MANCC, po, sku, carton, contxe, datercv, cbm, labour, PackinglistNo) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"
             cursor.execute(sql, (mancc, po, sku, qty, cont, date, total_cbm, labour, packing))
+            pagination.invalidate(cursor, 'inbound')
             conn.commit()
+            typeahead.add('inbound_container', [cont])
             flash("Thêm Inbound thành công!", "success")
         except Exception as e:
             flash(f"Lỗi: {e}", "danger")
 
-    # --- TỐI ƯU HÓA TRUY VẤN SQL ---
-    
-    base_query = "FROM inbound i LEFT JOIN nhacungcap n ON i.MANCC = n.MANCC"
-    conditions = []
-    params = []
+    # Danh sách chi tiết (keyset theo (datercv, id)) + thống kê Packing List, lọc trong SQL
+    inbounds, stats = exports.inbound_pages(cursor, request.args)
 
-    search = request.args.get('q', '')
-    if search:
-        conditions.append("(i.po LIKE %s OR i.sku LIKE %s OR i.PackinglistNo LIKE %s)")
-        params.extend([f"%{search}%"] * 3)
-
-    from_date = request.args.get('from_date')
-    if from_date:
-        conditions.append("i.datercv >= %s")
-        params.append(from_date)
-
-    to_date = request.args.get('to_date')
-    if to_date:
-        conditions.append("i.datercv <= %s")
-        params.append(to_date)
-
-    where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
-
-    # 1. Lấy danh sách Inbound chi tiết (Có alias cho Edit Modal)
-    inbounds_sql = f"""
-        SELECT 
-            i.id, i.PackinglistNo, i.PackinglistNo as packing,
-            i.po, i.sku, n.TENNCC as supplier, 
-            i.carton, i.carton as qty,
-            i.cbm, i.contxe, i.contxe as container,
-            i.datercv, i.datercv as date, i.labour
-        {base_query}
-        {where_clause}
-        ORDER BY i.datercv DESC
-    """
-    cursor.execute(inbounds_sql, params)
-    inbounds = cursor.fetchall()
-    
-    # Lấy danh sách PO cho dropdown
-    cursor.execute("SELECT DISTINCT parentpo FROM bbrreport WHERE parentpo IS NOT NULL")
-    pos = [row['parentpo'] for row in cursor.fetchall()]
-    
-    # Lấy danh sách Container cho autocomplete
-    cursor.execute("SELECT DISTINCT contxe FROM inbound WHERE contxe IS NOT NULL AND contxe != '' ORDER BY contxe DESC")
-    containers = [row['contxe'] for row in cursor.fetchall()]
-    
-    # 2. Thống kê Packing List (Tính toán trực tiếp bằng SQL thay vì Pandas)
-    stats_sql = f"""
-        SELECT 
-            i.PackinglistNo as `Packing List`,
-            MAX(i.datercv) as `Ngày nhập hàng`,
-            COALESCE(SUM(i.cbm), 0) as `Tổng CBM`,
-            COALESCE(SUM(i.carton), 0) as `Tổng Số Kiện`,
-            MAX(n.TENNCC) as `Nhà Cung Cấp`
-        {base_query}
-        {where_clause}
-        GROUP BY i.PackinglistNo
-        ORDER BY `Ngày nhập hàng` DESC
-    """
-    cursor.execute(stats_sql, params)
-    stats = cursor.fetchall()
-
-    # Phân trang cho Stats
-    page = request.args.get('page', 1, type=int)
-    per_page = 10
-    total_records = len(stats)
-    total_pages = math.ceil(total_records / per_page)
-    start = (page - 1) * per_page
-    end = start + per_page
-    stats_page = stats[start:end]
+    conn.close()
+    return render_template('inbound.html', inbounds=inbounds, stats=stats, today=datetime.now().strftime('%Y-%m-%d'))
+
+# Xuất toàn bộ dữ liệu Inbound / Outbound theo bộ lọc (q, from_date, to_date), stream CSV hoặc Excel
+@app.route('/<any(inbound, outbound):table>/export_raw')
+def export_raw(table):
+    fmt = request.args.get('format', 'csv')
+    if table == 'inbound':
+        sql, params, headers = exports.inbound_query(request.args)
+    else:
+        sql, params, headers = exports.outbound_query(request.args)
+
+    conn = db.get_dedicated_connection()
+    if not conn: return "DB Error"
 
+    from_date = request.args.get('from_date') or 'All'
+    to_date = request.args.get('to_date') or 'All'
+    filename = f"{table.capitalize()}_Raw_{from_date}_{to_date}"
+    if fmt == 'xlsx':
+        output = exports.write_xlsx(conn, sql, params, headers, table.capitalize())
+        return send_file(output, download_name=filename + '.xlsx', as_attachment=True,
+                         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    response = Response(exports.stream_csv(conn, sql, params, headers), mimetype='text/csv',
+                        headers={'Content-Disposition': f'attachment; filename="{filename}.csv"'})
+    # Trả kết nối về pool cả khi client ngắt trước khi generator được chạy (close lặp lại không sao)
+    response.call_on_close(conn.close)
+    return response
+
+# Gợi ý nhập liệu cho ô PO / SKU / Container (tìm theo tiền tố trong bộ nhớ)
+@app.route('/api/typeahead/<kind>')
+def api_typeahead(kind):
+    if kind not in typeahead.SOURCES:
+        return jsonify({'error': 'Loại không hợp lệ'}), 404
+    return jsonify(typeahead.search(get_db_connection, kind, request.args.get('q', ''),
+                                    request.args.get('limit', typeahead.DEFAULT_LIMIT, type=int)))
+
+# Import Inbound hàng loạt từ file Packing List (chạy trong nền)
+@app.route('/inbound/import', methods=['POST'])
+def import_inbound():
+    file = request.files.get('file')
+    if not file or file.filename == '':
+        flash("Vui lòng chọn file để upload", "warning")
+        return redirect(url_for('inbound'))
+    conn = get_db_connection()
+    if not conn: return "DB Error"
+    try:
+        job_id = jobs.submit(conn, 'inbound', [file], inbound_import.import_job,
+                             packing=request.form.get('packing'), date=request.form.get('date'),
+                             container=request.form.get('container'), labour=request.form.get('labour'))
+        conn.close()
+        return redirect(url_for('inbound', job=job_id))
+    except Exception as e:
+        flash(f"Lỗi khi import file: {e}", "danger")
     conn.close()
-    return render_template('inbound.html', inbounds=inbounds, pos=pos, stats=stats_page, page=page, total_pages=total_pages, containers=containers, today=datetime.now().strftime('%Y-%m-%d'))
+    return redirect(url_for('inbound'))
 
 # API lấy SKU theo PO (cho Inbound form)
 @app.route('/api/get_skus/<po>')
@@ -601,7 +461,7 @@ def get_skus(po):
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
     # Lấy thêm thông tin số lượng (qty)
-    cursor.execute("SELECT item, SUM(qty) as qty FROM bbrreport WHERE parentpo = %s GROUP BY item ORDER BY item", (po,))
+    cursor.execute(bbr_report.PO_SKUS_SQL, (po,))
     skus = cursor.fetchall()
     conn.close()
     # Chuyển đổi Decimal sang float nếu cần để tránh lỗi JSON
@@ -615,7 +475,7 @@ def get_sku_info(sku):
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
     
-    cursor.execute("SELECT supplier, cbm FROM bbrreport WHERE item = %s LIMIT 1", (sku,))
+    cursor.execute(bbr_report.SKU_INFO_SQL, (sku,))
     res = cursor.fetchone()
     
     data = {'supplier': '', 'cbm': 0}
@@ -623,9 +483,8 @@ def get_sku_info(sku):
         data['cbm'] = float(res['cbm']) if res['cbm'] else 0
         supplier_code = res['supplier']
         
-        cursor.execute("SELECT TENNCC FROM nhacungcap WHERE MANCC = %s", (supplier_code,))
-        supp_res = cursor.fetchone()
-        data['supplier'] = supp_res['TENNCC'] if supp_res else supplier_code
+        names = refdata.suppliers(cursor)
+        data['supplier'] = names[supplier_code] if supplier_code in names else supplier_code
         
     conn.close()
     return jsonify(data)
@@ -635,23 +494,45 @@ def get_sku_info(sku):
 def get_po_imported(po):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT SUM(carton) FROM inbound WHERE po = %s", (po,))
+    cursor.execute(inbound_import.PO_IMPORTED_SQL, (po,))
     res = cursor.fetchone()
     total = float(res[0]) if res and res[0] else 0
     conn.close()
     return jsonify({'total_imported': total})
 
+# API gộp cho form Inbound: SKU, SL đặt, CBM, nhà cung cấp và số kiện đã nhập của PO (1 truy vấn)
+@app.route('/api/po_context/<po>')
+def po_context(po):
+    conn = get_db_connection()
+    if not conn: return jsonify({'error': 'DB Error'}), 503
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(inbound_import.PO_CONTEXT_SQL, (po, po, po))
+    rows = cursor.fetchall()
+    conn.close()
+
+    data = {
+        'po': po,
+        'total_imported': float(rows[0]['po_imported']) if rows else 0,
+        'skus': [{
+            'item': r['item'],
+            'qty': float(r['qty'] or 0),
+            'cbm': float(r['cbm'] or 0),
+            'supplier': r['supplier'] or '',
+            'imported': float(r['imported'] or 0),
+        } for r in rows],
+    }
+    # ETag theo nội dung: trình duyệt gửi If-None-Match, nếu không đổi trả 304 (không gửi lại JSON)
+    response = jsonify(data)
+    response.add_etag()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
 # Route In Packing List
 @app.route('/inbound/print/<packinglist_no>')
 def print_packinglist(packinglist_no):
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("""
-        SELECT i.*, n.TENNCC 
-        FROM inbound i 
-        LEFT JOIN nhacungcap n ON i.MANCC = n.MANCC 
-        WHERE i.PackinglistNo = %s
-    """, (packinglist_no,))
+    cursor.execute(inbound_import.PACKINGLIST_SQL, (packinglist_no,))
     items = cursor.fetchall()
     conn.close()
     
@@ -673,6 +554,7 @@ def delete_inbound(id):
         try:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM inbound WHERE id = %s", (id,))
+            pagination.invalidate(cursor, 'inbound')
             conn.commit()
             flash("Đã xóa bản ghi Inbound thành công!", "success")
         except Exception as e:
@@ -697,7 +579,7 @@ def update_inbound():
         labour = request.form.get('labour')
         
         # Tính lại CBM
-        cursor.execute("SELECT cbm FROM bbrreport WHERE item = %s LIMIT 1", (sku,))
+        cursor.execute(bbr_report.SKU_INFO_SQL, (sku,))
         res = cursor.fetchone()
         unit_cbm = float(res['cbm']) if res and res['cbm'] else 0
         total_cbm = unit_cbm * qty
@@ -705,117 +587,23 @@ def update_inbound():
         try:
             sql = "UPDATE inbound SET PackinglistNo=%s, po=%s, sku=%s, carton=%s, contxe=%s, datercv=%s, cbm=%s, labour=%s WHERE id=%s"
             cursor.execute(sql, (packing, po, sku, qty, cont, date, total_cbm, labour, id))
+            pagination.invalidate(cursor, 'inbound')
             conn.commit()
+            typeahead.add('inbound_container', [cont])
             flash("Cập nhật Inbound thành công!", "success")
         except Exception as e:
             flash(f"Lỗi cập nhật: {e}", "danger")
         conn.close()
     return redirect(url_for('inbound'))
 
-def generate_outsource_data():
-    """Hàm hỗ trợ tạo dữ liệu báo cáo Outsource (dùng chung cho Export và Email)"""
-    conn = get_db_connection()
-    if not conn: return None, None
-    
-    # Tính toán khoảng thời gian: 21 tháng trước đến 20 tháng này
-    today = datetime.now()
-    current_month = today.month
-    current_year = today.year
-    
-    # Ngày kết thúc: 20 của tháng hiện tại
-    end_date = datetime(current_year, current_month, 20)
-    
-    # Ngày bắt đầu: 21 của tháng trước
-    if current_month == 1:
-        start_month = 12
-        start_year = current_year - 1
-    else:
-        start_month = current_month - 1
-        start_year = current_year
-        
-    start_date = datetime(start_year, start_month, 21)
-    
-    start_str = start_date.strftime('%Y-%m-%d')
-    end_str = end_date.strftime('%Y-%m-%d')
-    
-    query = """
-        SELECT 
-            i.datercv as `Ngày nhập`,
-            i.contxe as `Cont/Xe`, 
-            SUM(i.carton) as `Tổng Số Carton`, 
-            SUM(i.cbm) as `Tổng CBM`
-        FROM inbound i 
-        WHERE i.labour = 'Outsource' 
-        AND i.datercv >= %s AND i.datercv <= %s
-        GROUP BY i.datercv, i.contxe
-        ORDER BY i.datercv ASC
-    """
-    
-    df = pd.read_sql(query, conn, params=(start_str, end_str))
-    conn.close()
-    
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Outsource Report')
-    output.seek(0)
-    
-    filename = f"Outsource_Report_{start_str}_{end_str}.xlsx"
-    return output, filename
-
 @app.route('/inbound/export_outsource_report')
 def export_outsource_report():
-    output, filename = generate_outsource_data()
+    output, filename = reports.generate_outsource_data()
     if not output:
         return "Lỗi kết nối Database hoặc không có dữ liệu"
         
     return send_file(output, download_name=filename, as_attachment=True, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
 
-def send_outsource_email_task():
-    """Tác vụ gửi email tự động"""
-    # Chỉ chạy vào ngày 20 hàng tháng
-    if datetime.now().day != 20:
-        return
-
-    print("📧 Đang bắt đầu tác vụ gửi email báo cáo Outsource...")
-    excel_file, filename = generate_outsource_data()
-    if not excel_file:
-        print("❌ Không thể tạo file báo cáo.")
-        return
-
-    sender = os.getenv("MAIL_USERNAME")
-    recipients = os.getenv("MAIL_RECIPIENTS", "").split(',')
-    password = os.getenv("MAIL_PASSWORD")
-    smtp_server = os.getenv("MAIL_SERVER", "smtp.gmail.com")
-    smtp_port = int(os.getenv("MAIL_PORT") or 587)
-
-    if not (sender and recipients and password):
-        print("❌ Thiếu cấu hình Email trong .env")
-        return
-
-    msg = MIMEMultipart()
-    msg['From'] = sender
-    msg['To'] = ", ".join(recipients)
-    msg['Subject'] = f"Báo cáo Outsource Định Kỳ - {filename}"
-    
-    body = f"Kính gửi,\n\nĐính kèm là báo cáo Outsource từ ngày 21 tháng trước đến ngày 20 tháng này.\n\nTrân trọng,\nWMS System"
-    msg.attach(MIMEText(body, 'plain'))
-    
-    part = MIMEBase('application', 'octet-stream')
-    part.set_payload(excel_file.read())
-    encoders.encode_base64(part)
-    part.add_header('Content-Disposition', f'attachment; filename= {filename}')
-    msg.attach(part)
-    
-    try:
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(sender, password)
-        server.sendmail(sender, recipients, msg.as_string())
-        server.quit()
-        print(f"✅ Đã gửi email báo cáo thành công đến: {recipients}")
-    except Exception as e:
-        print(f"❌ Lỗi gửi email: {e}")
-
 # === OUTBOUND ===
 @app.route('/outbound', methods=['GET', 'POST'])
 def outbound():
@@ -834,145 +622,22 @@ def outbound():
 
             if file.filename != '':
                 try:
-                    # Đọc file Excel hoặc CSV
-                    if file.filename.endswith('.csv'):
-                        df = pd.read_csv(file, dtype=str)
-                    else:
-                        df = pd.read_excel(file, dtype=str)
-                    
-                    df = df.fillna('')
-                    
-                    # Chuẩn hóa tên cột
-                    df.columns = df.columns.str.strip()
-                    
-                    # Lấy dữ liệu CBM để tính toán nhanh
-                    cursor.execute("SELECT sku, cbm, loosecase, kindpallet FROM masterdata")
-                    master_data = {
-                        row['sku']: {
-                            'cbm': float(row['cbm']) if row['cbm'] else 0,
-                            'loosecase': row['loosecase'],
-                            'kindpallet': row['kindpallet']
-                        } 
-                        for row in cursor.fetchall()
-                    }
-                    
-                    cursor.execute("SELECT item, cbm FROM bbrreport WHERE cbm IS NOT NULL")
-                    bbr_cbm = {row['item']: float(row['cbm']) for row in cursor.fetchall() if row['cbm']}
-                    
-                    inserts = []
-                    for _, row in df.iterrows():
-                        # Hàm lấy giá trị linh hoạt theo nhiều tên cột
-                        def get_col(names):
-                            for name in names:
-                                if name in df.columns:
-                                    return row[name]
-                            return None
-
-                        # Áp dụng Job No và Ngày từ form cho tất cả các dòng
-                        do_no = manual_do_no
-                        date_out = manual_date if manual_date else datetime.now().strftime('%d-%m-%Y')
-                        container = manual_container
-                        remark = 'add_more' if is_add_more else ''
-                        po = get_col(['PPO', 'PO Number', 'po'])
-                        sku = get_col(['SKU', 'Item', 'Mã hàng', 'sku'])
-                        childpo= get_col(['Child PO', 'ChildPO', 'childpo'])
-                        fdc = str(childpo)[:3] if childpo else ''
-                        qty = pd.to_numeric(get_col(['Sum of Carton', 'Quantity', 'Số lượng', 'Carton', 'carton']), errors='coerce') or 0
-                       
-                        
-                        if sku and qty > 0:
-                            # Tính CBM
-                            info = master_data.get(sku)
-                            unit_cbm = 0
-                            loose_carton = ''
-                            kind_pallet = ''
-
-                            if info:
-                                unit_cbm = info['cbm']
-                                loose_carton = info['loosecase']
-                                kind_pallet = info['kindpallet']
-                            else:
-                                unit_cbm = bbr_cbm.get(sku, 0)
-                                
-                            total_cbm = unit_cbm * qty
-                            
-                            inserts.append((do_no, po, sku, qty, date_out, total_cbm,  childpo, fdc, remark, loose_carton, kind_pallet, container))
-                    if inserts:
-                        sql = "INSERT INTO outbound (jobno, po, sku, carton, datercv, cbm, childpo, fdc, remark, loosecarton, kindpallet, container) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-                        cursor.executemany(sql, inserts)
-                        conn.commit()
-                        flash(f"Đã import thành công {len(inserts)} dòng dữ liệu!", "success")
-                    else:
-                        flash("Không tìm thấy dữ liệu hợp lệ trong file.", "warning")
+                    # Lưu file và import trong nền
+                    job_id = jobs.submit(conn, 'outbound', [file], outbound_import.import_job,
+                                         do_no=manual_do_no, date=manual_date, container=manual_container,
+                                         add_more=bool(is_add_more))
+                    return redirect(url_for('outbound', job=job_id))
                 except Exception as e:
                     flash(f"Lỗi khi import file: {e}", "danger")
         else:
             flash("Vui lòng chọn file để upload", "warning")
 
     # --- LỌC VÀ HIỂN THỊ ---
-    conditions = []
-    params = []
-    
-    search = request.args.get('q', '')
-    if search:
-        conditions.append("(jobno LIKE %s OR parentpo LIKE %s OR sku LIKE %s)")
-        params.extend([f"%{search}%"] * 3)
-        
-    from_date = request.args.get('from_date')
-    if from_date:
-        conditions.append("datercv >= %s")
-        params.append(from_date)
-
-    to_date = request.args.get('to_date')
-    if to_date:
-        conditions.append("datercv <= %s")
-        params.append(to_date)
-        
-    where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
-    
-    # Lấy danh sách Outbound
-    sql = f"SELECT * FROM outbound {where_clause} ORDER BY datercv DESC"
-    cursor.execute(sql, params)
-    outbounds = cursor.fetchall()
-    
-    # Thống kê theo DO
-    stats_sql = f"""
-            SELECT 
-                jobno as `DO Number`,
-                container ,
-                seal ,
-                datestuff,
-                MAX(datercv) as `Ngày nhận picking hàng`,
-                COALESCE(SUM(cbm), 0) as `Tổng CBM`,
-                COALESCE(SUM(carton), 0) as `Tổng Số Kiện`
-                
-            FROM outbound
-            {where_clause}
-            GROUP BY jobno, container,seal,datestuff
-            ORDER BY `Ngày nhận picking hàng` DESC
-        
-        """
-    cursor.execute(stats_sql, params)
-    stats = cursor.fetchall()
-    
-    # Dropdowns
-    cursor.execute("SELECT DISTINCT parentpo FROM bbrreport WHERE parentpo IS NOT NULL")
-    pos = [row['parentpo'] for row in cursor.fetchall()]
-    
-    cursor.execute("SELECT DISTINCT container FROM outbound WHERE container IS NOT NULL ORDER BY container DESC")
-    containers = [row['container'] for row in cursor.fetchall()]
+    # Danh sách (keyset theo (datercv, id)) + thống kê theo DO, lọc trong SQL
+    outbounds, stats = exports.outbound_pages(cursor, request.args)
 
-    # Phân trang
-    page = request.args.get('page', 1, type=int)
-    per_page = 10
-    total_records = len(outbounds)
-    total_pages = math.ceil(total_records / per_page)
-    start = (page - 1) * per_page
-    end = start + per_page
-    outbounds_page = outbounds[start:end]
-    
     conn.close()
-    return render_template('outbound.html', outbounds=outbounds_page, pos=pos, stats=stats, page=page, total_pages=total_pages, containers=containers, today=datetime.now().strftime('%Y-%m-%d'))
+    return render_template('outbound.html', outbounds=outbounds, stats=stats, today=datetime.now().strftime('%Y-%m-%d'))
 
 @app.route('/outbound/delete/<int:id>', methods=['POST'])
 def delete_outbound(id):
@@ -980,7 +645,12 @@ def delete_outbound(id):
     if conn:
         try:
             cursor = conn.cursor()
+            cursor.execute("SELECT jobno FROM outbound WHERE id = %s", (id,))
+            row = cursor.fetchone()
             cursor.execute("DELETE FROM outbound WHERE id = %s", (id,))
+            if row:
+                versions.bump(cursor, [versions.outbound_key(row[0])])
+            pagination.invalidate(cursor, 'outbound')
             conn.commit()
             flash("Đã xóa bản ghi Outbound thành công!", "success")
         except Exception as e:
@@ -1005,12 +675,13 @@ def update_outbound():
         
         
         # Tính lại CBM
-        cursor.execute("SELECT cbm FROM masterdata WHERE sku = %s LIMIT 1", (sku,))
-        res = cursor.fetchone()
-        if not res:
-            cursor.execute("SELECT cbm FROM bbrreport WHERE item = %s LIMIT 1", (sku,))
+        info = refdata.masterdata(cursor).get(sku)
+        if info:
+            unit_cbm = info.cbm
+        else:
+            cursor.execute(bbr_report.SKU_INFO_SQL, (sku,))
             res = cursor.fetchone()
-        unit_cbm = float(res['cbm']) if res and res['cbm'] else 0
+            unit_cbm = float(res['cbm']) if res and res['cbm'] else 0
         total_cbm = unit_cbm * qty
         
         try:
@@ -1050,7 +721,10 @@ def update_outbound_info():
                 sql = f"UPDATE outbound SET {', '.join(updates)} WHERE do_no = %s"
                 params.append(do_no)
                 cursor.execute(sql, tuple(params))
+                versions.bump(cursor, [versions.outbound_key(do_no)])
+                pagination.invalidate(cursor, 'outbound')
                 conn.commit()
+                typeahead.add('outbound_container', [cont])
                 flash(f"Đã cập nhật thông tin cho Job No: {do_no}", "success")
             except Exception as e:
                 flash(f"Lỗi cập nhật: {e}", "danger")
@@ -1065,76 +739,63 @@ def print_deliverynote(do_no):
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
     # Lấy thông tin chi tiết của Job No
-    cursor.execute("SELECT * FROM outbound WHERE jobno = %s", (do_no,))
-    items = cursor.fetchall()
+    do_no, groups = print_docs.fetch_job(cursor, do_no)
     conn.close()
     
-    if not items:
+    if not groups:
         return "Không tìm thấy Delivery Note cho Job No này"
         
-    total_qty = sum(item['carton'] for item in items)
-    total_cbm = sum(item['cbm'] for item in items)
-    date_out = items[0]['datercv']
-    container = items[0].get('container') or items[0].get('contxe') or ''
-    seal = items[0].get('seal', '')
-    customer = items[0].get('customer', '')
-    
-    return render_template('print_deliverynote.html', do_no=do_no, items=items, total_qty=total_qty, total_cbm=total_cbm, date=date_out, container=container, seal=seal, customer=customer)
+    items = [item for fdc_items in groups.values() for item in fdc_items]
+    return render_template('print_deliverynote.html', **print_docs.deliverynote_context(do_no, items))
 
 @app.route('/outbound/print_pickinglist/<path:do_no>')
 def print_pickinglist(do_no):
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
     
-    # Lấy dữ liệu và sắp xếp theo FDC, PO, SKU
-    cursor.execute("SELECT * FROM outbound WHERE jobno = %s ORDER BY fdc, parentpo, sku", (do_no,))
-    items = cursor.fetchall()
+    # Lấy dữ liệu theo FDC, PO, SKU (đã gom nhóm theo FDC)
+    do_no, groups = print_docs.fetch_job(cursor, do_no)
     conn.close()
     
-    if not items:
+    if not groups:
         return "Không tìm thấy Picking List cho Job No này"
 
-    # Gom nhóm theo FDC
-    grouped_data = {}
-    for item in items:
-        fdc = item['fdc'] if item['fdc'] else 'Khác'
-        if fdc not in grouped_data:
-            grouped_data[fdc] = {
-                'items': [],
-                'total_cbm': 0,
-                'total_carton': 0,
-                'total_loose_carton': 0
-            }
-        
-        grouped_data[fdc]['items'].append(item)
-        
-        cbm = float(item['cbm']) if item['cbm'] else 0
-        carton = float(item['carton']) if item['carton'] else 0
-        
-        grouped_data[fdc]['total_cbm'] += cbm
-        grouped_data[fdc]['total_carton'] += carton
-        
-        # Tính tổng Loose Carton (nếu cột loosecarton có dữ liệu)
-        if item.get('looscarton') == 'Y':
-            grouped_data[fdc]['total_loose_carton'] += carton
-
-    grand_total_pallet_1m2 = 0
-    grand_total_pallet_1m9 = 0
-
-    # Tính toán số lượng Pallet dự kiến cho từng nhóm FDC
-    for fdc, data in grouped_data.items():
-        cbm = data['total_cbm']
-        p1m2 = cbm / 3.06 if cbm else 0
-        p1m9 = cbm / 4.85 if cbm else 0
-        data['pallet_1m2'] = p1m2
-        data['pallet_1m9'] = p1m9
-        grand_total_pallet_1m2 += p1m2
-        grand_total_pallet_1m9 += p1m9
-
-    date_out = items[0]['datercv']
-    container = items[0].get('container') or items[0].get('contxe') or ''
-    
-    return render_template('print_pickinglist.html', do_no=do_no, grouped_data=grouped_data, date=date_out, container=container, total_pallet_1m2=grand_total_pallet_1m2, total_pallet_1m9=grand_total_pallet_1m9)
+    return render_template('print_pickinglist.html', **print_docs.pickinglist_context(do_no, groups))
+
+# In hàng loạt Picking List / Delivery Note theo ngày, container hoặc danh sách Job No
+@app.route('/outbound/print_batch')
+def print_batch():
+    doc = request.args.get('doc', 'pickinglist')
+    if doc not in print_docs.DOC_TYPES:
+        doc = 'pickinglist'
+    jobnos = [j.strip() for value in request.args.getlist('jobnos') for j in value.replace('\n', ',').split(',') if j.strip()]
+
+    conn = get_db_connection()
+    if not conn: return "DB Error"
+    cursor = conn.cursor(dictionary=True)
+    jobnos = print_docs.find_jobnos(cursor, date=request.args.get('date'), datestuff=request.args.get('datestuff'),
+                                    container=request.args.get('container'), jobnos=jobnos)
+    if not jobnos:
+        conn.close()
+        return "Không tìm thấy Job No nào theo điều kiện đã chọn"
+
+    html = print_docs.cached_render(cursor, doc, jobnos,
+                                    lambda grouped: render_template('print_batch.html', doc=doc,
+                                                                   docs=print_docs.batch_context(doc, grouped)))
+    conn.close()
+    return html
+
+# API load plan (pallet theo SKU/FDC, số container 20'/40'/40HC) cho một Job No
+@app.route('/api/loadplan/<path:do_no>')
+def api_loadplan(do_no):
+    conn = get_db_connection()
+    if not conn: return jsonify({'error': 'DB Error'}), 503
+    cursor = conn.cursor(dictionary=True)
+    plan = loadplan.plan_job(cursor, do_no)
+    conn.close()
+    if not plan:
+        return jsonify({'error': 'Không tìm thấy Job No'}), 404
+    return jsonify(plan)
 
 @app.route('/scanfile', methods=['GET', 'POST'])
 def scanfile():
@@ -1142,7 +803,7 @@ def scanfile():
     if not conn: return "DB Error"
     cursor = conn.cursor(dictionary=True)
 
-    jobno = request.args.get('jobno', '')
+    jobno = request.args.get('jobno', '').strip()
     comparison_data = []
     summary = {'total_ordered': 0, 'total_scanned': 0, 'diff': 0}
 
@@ -1151,130 +812,24 @@ def scanfile():
         jobno = request.form.get('jobno')
         files = request.files.getlist('file')
         is_replace = request.form.get('replace') # Checkbox để xóa dữ liệu cũ
+        all_jobs = request.form.get('all_jobs')  # Checkbox kiểm tra SSCC trùng với mọi Job No
 
         if files and jobno:
             try:
-                if is_replace:
-                    cursor.execute("DELETE FROM scanfile WHERE jobno = %s", (jobno,))
-                
-                # Lấy remark từ Master Data
-                cursor.execute("SELECT sku, remark FROM masterdata")
-                master_remarks = {row['sku']: str(row['remark']).strip() for row in cursor.fetchall() if row['remark']}
-
-                total_inserted = 0
-                file_details = []
-                for file in files:
-                    if file.filename == '': continue
-                    
-                    if file.filename.endswith('.csv'):
-                        df = pd.read_csv(file, dtype=str)
-                        df = pd.read_csv(file, header=None, dtype=str)
-                    else:
-                        df = pd.read_excel(file, dtype=str)
-                    
-                    # Chuẩn hóa cột
-                    df.columns = df.columns.str.strip().str.lower()
-                    
-                    # Tìm cột SKU và Qty
-                    sku_col = next((c for c in df.columns if c in ['sku', 'item', 'barcode', 'mã hàng']), None)
-                    qty_col = next((c for c in df.columns if c in ['qty', 'quantity', 'số lượng', 'sl']), None)
-                    df = pd.read_excel(file, header=None, dtype=str)
-
-                    if sku_col:
-                        inserts = []
-                        for _, row in df.iterrows():
-                            sku = str(row[sku_col]).strip()
-                            qty = float(row[qty_col]) if qty_col and pd.notna(row[qty_col]) else 1.0
-                            if sku:
-                                inserts.append((jobno, sku, qty))
-                    inserts = []
-                    for _, row in df.iterrows():
-                        # Bỏ qua dòng nếu không đủ cột (H là cột thứ 8)
-                        if len(row) < 14: continue
-
-                        # Map cột theo index (A=0, B=1, ...)
-                        # release_key=cột B (1)
-                        # sscc=cột C (2)
-                        # master_delivery=cột D (3)
-                        # qty= cột E (4)
-                        # master_ctl= cột F (5)
-                        # master_st_company= cột G (6)
-                        # master_add1=cột H (7)
-                        
-                        release_key = str(row[1]).strip() if pd.notna(row[1]) else ''
-                        sscc = str(row[2]).strip() if pd.notna(row[2]) else ''
-                        master_delivery = str(row[3]).strip() if pd.notna(row[3]) else ''
-                        
-                        try:
-                            qty = float(row[4]) if pd.notna(row[4]) else 0
-                        except:
-                            qty = 0
-                            
-                        master_ctl = str(row[5]).strip() if pd.notna(row[5]) else ''
-                        master_st_company = str(row[6]).strip() if pd.notna(row[6]) else ''
-                        master_add1 = str(row[7]).strip() if pd.notna(row[7]) else ''
-                        master_add2 = str(row[8]).strip() if pd.notna(row[8]) else ''
-                        master_add3 = str(row[9]).strip() if pd.notna(row[9]) else ''
-                        master_add4 = str(row[10]).strip() if pd.notna(row[10]) else ''
-                        ship_to = str(row[11]).strip() if pd.notna(row[11]) else ''
-                        st_zip = str(row[12]).strip() if pd.notna(row[12]) else ''
-                        barcode = str(row[13]).strip() if pd.notna(row[13]) else ''
-                        sku = str(row[14]).strip() if pd.notna(row[14]) else '' 
-                        jobno = jobno.strip()
-                        master_val = master_remarks.get(sku, '')
-                        tag_label = 'Y' if sku == master_val else 'N'
-                        jobno_type = f"{jobno}_{master_delivery[:3]}"
-                        pallet = ''
-                        pallet_type = ''
-                        jobscan = ''
-                        time_scan = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                        # Kiểm tra dữ liệu cơ bản (ví dụ phải có SSCC hoặc Release Key)
-                        if sscc or release_key:
-                            inserts.append((jobno, release_key, sscc, master_delivery, qty, master_ctl, master_st_company, master_add1, master_add2, master_add3, master_add4, ship_to, st_zip, barcode, sku, tag_label, jobno_type, pallet, pallet_type, time_scan,jobscan))
-                    if inserts:
-                        sql = "INSERT INTO scanfile (jobno, release_key, sscc, master_delivery, qty, master_ctl, master_st_company, master_add1,master_add2,master_add3,master_add4,ship_to,st_zip,barcode,sku,tag_label,jobno_type, pallet, pallet_type, time_scan,jobscan) VALUES (%s, %s, %s, %s, %s, %s, %s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s, %s, %s, %s,%s)"
-                        cursor.executemany(sql, inserts)
-                        total_inserted += len(inserts)
-                        file_details.append(f"{file.filename} ({len(inserts)} dòng)")
-                    else:
-                        file_details.append(f"{file.filename} (0 dòng)")
-                
-                conn.commit()
-                if total_inserted > 0:
-                    flash(f"Đã import tổng cộng {total_inserted} dòng scan cho Job No: {jobno}. Chi tiết: {', '.join(file_details)}", "success")
-                else:
-                    flash("Không tìm thấy dữ liệu hợp lệ trong các file.", "warning")
+                # Lưu các file và import trong nền
+                job_id = jobs.submit(conn, 'scanfile', files, scan_import.import_job,
+                                     jobno=jobno, replace=bool(is_replace), all_jobs=bool(all_jobs))
+                return redirect(url_for('scanfile', jobno=jobno, job=job_id))
             except Exception as e:
                 flash(f"Lỗi xử lý file: {e}", "danger")
             
             return redirect(url_for('scanfile', jobno=jobno))
 
-    # Lấy dữ liệu so sánh nếu có Job No
+    # Lấy dữ liệu so sánh nếu có Job No (bộ đếm trong bộ nhớ, chỉ GROUP BY lại khi dữ liệu đổi)
     if jobno:
-        # Lấy tổng Outbound (Ordered)
-        cursor.execute("SELECT sku, SUM(carton) as ordered_qty FROM outbound WHERE jobno = %s GROUP BY sku", (jobno,))
-        outbound_data = {row['sku']: float(row['ordered_qty']) for row in cursor.fetchall()}
-
-        # Lấy tổng Scan
-        cursor.execute("SELECT sku, COUNT(sscc) as scanned_qty, SUM(CASE WHEN tag_label = 'N' THEN 1 ELSE 0 END) as error_labels, MAX(tag_label) as tag_label FROM scanfile WHERE jobno = %s GROUP BY sku", (jobno,))
-        scan_data = {row['sku']: {'qty': float(row['scanned_qty']), 'error_labels': int(row['error_labels']), 'tag_label': row['tag_label']} for row in cursor.fetchall()}
-
-        # Gộp danh sách SKU
-        all_skus = set(outbound_data.keys()) | set(scan_data.keys())
-
-        for sku in all_skus:
-            ordered = outbound_data.get(sku, 0)
-            scan_info = scan_data.get(sku, {'qty': 0, 'error_labels': 0, 'tag_label': ''})
-            scanned = scan_info['qty']
-            error_labels = scan_info['error_labels']
-            tag_label = scan_info['tag_label']
-            diff = scanned - ordered
-            comparison_data.append({'sku': sku, 'ordered': ordered, 'scanned': scanned, 'diff': diff, 'tag_error': error_labels, 'tag_label': tag_label})
-            
-            summary['total_ordered'] += ordered
-            summary['total_scanned'] += scanned
-
-        summary['diff'] = summary['total_scanned'] - summary['total_ordered']
+        counters = scan_live.get_counters(cursor, jobno)
+        comparison_data = counters.comparison()
+        summary = counters.summary()
 
     conn.close()
     return render_template('import_scanfile.html', jobno=jobno, data=comparison_data, summary=summary)
@@ -1287,14 +842,80 @@ def delete_scan_job():
         if jobno:
             try:
                 cursor = conn.cursor()
-                cursor.execute("DELETE FROM scanfile WHERE jobno = %s", (jobno,))
+                cursor.execute(scan_import.DELETE_JOB_SQL, (jobno,))
+                # Scan máy cầm tay còn trong hàng đợi của mọi worker sẽ bị bỏ khi ghi
+                versions.bump(cursor, [versions.scanfile_key(jobno), versions.scanreset_key(jobno.strip())])
                 conn.commit()
+                scan_live.forget(jobno)
                 flash(f"Đã xóa toàn bộ dữ liệu scan của Job No: {jobno}", "success")
             except Exception as e:
                 flash(f"Lỗi khi xóa: {e}", "danger")
         conn.close()
     return redirect(url_for('scanfile'))
 
+# Máy quét cầm tay gửi scan SSCC: {"jobno": ..., "sscc": ..., "sku": ...} hoặc {"jobno": ..., "scans": [...]}
+@app.route('/api/scan', methods=['POST'])
+def api_scan():
+    payload = request.get_json(silent=True) or {}
+    jobno = str(payload.get('jobno') or '').strip()
+    scans = payload.get('scans')
+    if scans is None:
+        scans = [payload]
+    if not jobno or not isinstance(scans, list) or not scans:
+        return jsonify({'error': 'Thiếu jobno hoặc scans'}), 400
+    if len(jobno) > scan_live.FIELD_LENGTHS['jobno']:
+        return jsonify({'error': f"jobno dài quá {scan_live.FIELD_LENGTHS['jobno']} ký tự"}), 400
+    if len(scans) > scan_live.MAX_BATCH:
+        return jsonify({'error': f"Tối đa {scan_live.MAX_BATCH} scan mỗi lần gửi"}), 400
+    if not all(isinstance(s, dict) for s in scans):
+        return jsonify({'error': 'Mỗi scan phải là một object'}), 400
+
+    conn = get_db_connection()
+    if not conn: return jsonify({'error': 'DB Error'}), 503
+    cursor = conn.cursor(dictionary=True)
+    try:
+        accepted, rejected, duplicates, counters = scan_live.ingest(cursor, jobno, scans, all_jobs=bool(payload.get('all_jobs')))
+    except scan_live.QueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    finally:
+        conn.close()
+    skus = dict.fromkeys(str(s.get('sku') or '').strip() for s in scans)
+    return jsonify({'accepted': accepted, 'rejected': rejected, 'duplicates': duplicates, 'summary': counters.summary(),
+                    'lines': [counters.line(sku) for sku in skus]})
+
+# Trang đối chiếu poll endpoint này trong lúc đang scan
+@app.route('/api/scan_status')
+def api_scan_status():
+    jobno = request.args.get('jobno', '').strip()
+    if not jobno:
+        return jsonify({'error': 'Thiếu jobno'}), 400
+    conn = get_db_connection()
+    if not conn: return jsonify({'error': 'DB Error'}), 503
+    cursor = conn.cursor(dictionary=True)
+    counters = scan_live.get_counters(cursor, jobno)
+    conn.close()
+    result = {'summary': counters.summary()}
+    if request.args.get('lines'):
+        result['lines'] = counters.comparison()
+    return jsonify(result)
+
+# SSCC trùng của một Job No (trong Job và với Job khác)
+@app.route('/api/scan_duplicates')
+def api_scan_duplicates():
+    jobno = request.args.get('jobno', '').strip()
+    if not jobno:
+        return jsonify({'error': 'Thiếu jobno'}), 400
+    conn = get_db_connection()
+    if not conn: return jsonify({'error': 'DB Error'}), 503
+    cursor = conn.cursor(dictionary=True)
+    report = scan_import.duplicate_report(cursor, jobno)
+    conn.close()
+    return jsonify(report)
+
+@app.route('/api/scan_live_stats')
+def scan_live_stats():
+    return jsonify(scan_live.get_stats())
+
 @app.route('/api/scan_details')
 def api_scan_details():
     jobno = request.args.get('jobno')
@@ -1304,14 +925,7 @@ def api_scan_details():
     if not conn: return jsonify([])
     
     cursor = conn.cursor(dictionary=True)
-    query = """
-        SELECT release_key, COUNT(sscc) as sscc_count 
-        FROM scanfile 
-        WHERE jobno = %s AND sku = %s 
-        GROUP BY release_key
-        ORDER BY release_key
-    """
-    cursor.execute(query, (jobno, sku))
+    cursor.execute(scan_import.DETAILS_SQL, (jobno, sku))
     data = cursor.fetchall()
     conn.close()
     
@@ -1334,6 +948,8 @@ def pallet():
         if qty > 0:
             try:
                 cursor.execute("INSERT INTO pallet_management (date, pallet_type, action, quantity, remark) VALUES (%s, %s, %s, %s, %s)", (date, pallet_type, action, qty, remark))
+                pallet_ledger.apply(cursor, date, pallet_type, action, qty)
+                pagination.invalidate(cursor, 'pallet_management')
                 conn.commit()
                 flash("Đã lưu giao dịch pallet thành công!", "success")
             except Exception as e:
@@ -1341,77 +957,24 @@ def pallet():
         else:
             flash("Số lượng phải lớn hơn 0", "warning")
 
-    # 1. Tính tồn kho (ALL TIME - Luôn tính trên toàn bộ dữ liệu để hiển thị đúng tồn kho hiện tại)
-    cursor.execute("SELECT pallet_type, action, SUM(quantity) as total FROM pallet_management GROUP BY pallet_type, action")
-    summary_rows = cursor.fetchall()
-    
-    summary = {
-        '1m2': {'in': 0, 'out': 0, 'stock': 0},
-        '1m6': {'in': 0, 'out': 0, 'stock': 0},
-        '1m9': {'in': 0, 'out': 0, 'stock': 0}
-    }
-    
-    for row in summary_rows:
-        p_type = row['pallet_type']
-        qty = float(row['total'] or 0)
-        if p_type in summary:
-            if row['action'] == 'IN':
-                summary[p_type]['in'] += qty
-                summary[p_type]['stock'] += qty
-            elif row['action'] == 'OUT':
-                summary[p_type]['out'] += qty
-                summary[p_type]['stock'] -= qty
-
-    # 2. Lấy dữ liệu lịch sử (Có lọc theo ngày để hiển thị bảng)
-    from_date = request.args.get('from_date')
-    to_date = request.args.get('to_date')
-    
-    query = "SELECT * FROM pallet_management"
-    params = []
-    conditions = []
-    
-    if from_date:
-        conditions.append("date >= %s")
-        params.append(from_date)
-    if to_date:
-        conditions.append("date <= %s")
-        params.append(to_date)
-        
-    if conditions:
-        query += " WHERE " + " AND ".join(conditions)
-        
-    query += " ORDER BY date DESC, id DESC"
-    
-    cursor.execute(query, tuple(params))
-    history = cursor.fetchall()
+    # 1. Tồn kho hiện tại (hoặc đến hết ngày as_of) đọc từ sổ tồn theo ngày
+    as_of = request.args.get('as_of')
+    summary = pallet_ledger.stock(cursor, as_of)
+
+    # 2. Lấy dữ liệu lịch sử (Có lọc theo ngày để hiển thị bảng), phân trang keyset theo (date, id)
+    history = pallet_ledger.history(cursor, request.args)
+    balances = pallet_ledger.running_balances(cursor, history.items)
 
     conn.close()
-    return render_template('pallet.html', history=history, summary=summary, today=datetime.now().strftime('%Y-%m-%d'), safety_threshold=50)
+    return render_template('pallet.html', history=history, summary=summary, balances=balances, as_of=as_of,
+                           today=datetime.now().strftime('%Y-%m-%d'), safety_threshold=50)
 
 @app.route('/pallet/export')
 def export_pallet():
     conn = get_db_connection()
     if not conn: return "DB Error"
     
-    from_date = request.args.get('from_date')
-    to_date = request.args.get('to_date')
-    
-    query = "SELECT date, pallet_type, action, quantity, remark FROM pallet_management"
-    params = []
-    conditions = []
-    
-    if from_date:
-        conditions.append("date >= %s")
-        params.append(from_date)
-    if to_date:
-        conditions.append("date <= %s")
-        params.append(to_date)
-        
-    if conditions:
-        query += " WHERE " + " AND ".join(conditions)
-        
-    query += " ORDER BY date DESC, id DESC"
-    
+    query, params = pallet_ledger.export_query(request.args)
     df = pd.read_sql(query, conn, params=params)
     conn.close()
     
@@ -1432,7 +995,12 @@ def delete_pallet(id):
     if conn:
         try:
             cursor = conn.cursor()
+            cursor.execute("SELECT date, pallet_type, action, quantity FROM pallet_management WHERE id = %s", (id,))
+            row = cursor.fetchone()
             cursor.execute("DELETE FROM pallet_management WHERE id = %s", (id,))
+            if row:
+                pallet_ledger.apply(cursor, row[0], row[1], row[2], -(row[3] or 0))
+            pagination.invalidate(cursor, 'pallet_management')
             conn.commit()
             flash("Đã xóa giao dịch pallet!", "success")
         except Exception as e:
@@ -1441,11 +1009,5 @@ def delete_pallet(id):
     return redirect(url_for('pallet'))
 
 if __name__ == "__main__":
-    if HAS_SCHEDULER:
-        scheduler = BackgroundScheduler()
-        # Kiểm tra mỗi ngày vào lúc 8:00 sáng
-        scheduler.add_job(func=send_outsource_email_task, trigger="cron", hour=8)
-        scheduler.start()
-        print("⏰ Đã khởi động Scheduler gửi báo cáo tự động.")
-        
+    # Báo cáo định kỳ (email Outsource) chạy bằng worker.py, không chạy trong tiến trình web
     app.run(debug=True)
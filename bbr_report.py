@@ -0,0 +1,425 @@
+"""Xử lý dữ liệu BBR Report (import file CSV)"""
+import numpy as np
+import pandas as pd
+
+import typeahead
+from db import insert_batches
+from loadplan import BBR_PALLET_FACTOR, PALLET_CBM, pallets_by_cbm
+
+# Cột của dữ liệu BBR sau khi xử lý (theo thứ tự cột INSERT vào bbrreport)
+BBR_COLUMNS = ['keycheck', 'origin', 'PO', 'item', 'supplier', 'parentpo', 'deliverydate', 'qty', 'cbm', 'week', 'total_cbm']
+
+# Truy vấn dùng trong route của app.py (migrations.py check EXPLAIN đúng các câu này)
+DELETE_WEEK_SQL = "DELETE FROM bbrreport WHERE week = %s"
+PO_SKUS_SQL = "SELECT item, SUM(qty) as qty FROM bbrreport WHERE parentpo = %s GROUP BY item ORDER BY item"
+SKU_INFO_SQL = "SELECT supplier, cbm FROM bbrreport WHERE item = %s LIMIT 1"
+
+
+def _str_col(df, col):
+    """Cột dạng chuỗi đã strip, ô trống -> '' (giống str(val).strip() từng dòng)"""
+    if col not in df.columns:
+        return pd.Series('', index=df.index, dtype=object)
+    s = df[col]
+    return s.astype(str).str.strip().where(s.notna(), '').astype(object)
+
+
+def _num_col(df, col, default):
+    """Chuyển cột sang số; giá trị 0 hoặc thiếu cột được thay bằng default (giống `pd.to_numeric(x) or default`)"""
+    if col not in df.columns:
+        return pd.Series(default, index=df.index, dtype=float)
+    s = pd.to_numeric(df[col], errors='coerce').astype(float)
+    return s.where(s != 0, default)
+
+
+def parse_bbr_file(df_input):
+    """Tính toàn bộ các cột BBR theo cột (vectorized) thay vì duyệt từng dòng.
+
+    - keycheck = PO_Item_ParentPO
+    - Ngày giao: +3 ngày nếu origin = VN, ngược lại +14 ngày; week = tuần ISO của ngày mới
+    - qty = QTY / QTY per PCK, total_cbm = qty * MC CBM
+    """
+    df_input = df_input.copy()
+    df_input.columns = df_input.columns.str.strip()
+
+    po = _str_col(df_input, 'PO Number')
+    item = _str_col(df_input, 'Item No')
+    parent_po = _str_col(df_input, 'Parent PO')
+    origin = _str_col(df_input, 'origin')
+    vndr = _str_col(df_input, 'VNDR CD')
+
+    out = pd.DataFrame(index=df_input.index)
+    out['keycheck'] = po + '_' + item + '_' + parent_po
+    out['origin'] = origin
+    out['PO'] = po
+    out['item'] = item
+    out['supplier'] = vndr
+    out['parentpo'] = parent_po
+
+    # Ngày giao dự kiến + tuần
+    if 'DELIVERY DT' in df_input.columns:
+        d_dt = pd.to_datetime(df_input['DELIVERY DT'], errors='coerce', format='mixed')
+    else:
+        d_dt = pd.Series(pd.NaT, index=df_input.index, dtype='datetime64[ns]')
+    add_days = np.where(origin.str.upper() == 'VN', 3, 14)
+    new_date = d_dt + pd.to_timedelta(add_days, unit='D')
+    out['deliverydate'] = new_date.dt.strftime('%Y-%m-%d').astype(object).where(new_date.notna(), None)
+    week = new_date.dt.isocalendar().week
+    out['week'] = week.astype(object).where(new_date.notna(), None)
+
+    # Số kiện và CBM (NaN giữ nguyên như cách tính cũ)
+    q_pck = _num_col(df_input, 'QTY per PCK', 1)
+    qty = _num_col(df_input, 'QTY', 0)
+    out['qty'] = qty / q_pck
+    out['cbm'] = _num_col(df_input, 'MC CBM', 0)
+    out['total_cbm'] = out['qty'] * out['cbm']
+    return out[BBR_COLUMNS]
+
+
+def staging_rows(rows):
+    """Tuple (theo BBR_COLUMNS + is_last) để nạp vào bảng tạm; NaN -> NULL"""
+    # Dòng cuối cùng của mỗi keycheck trong file là dòng được dùng để UPDATE (giống executemany cũ)
+    is_last = (~rows['keycheck'].duplicated(keep='last')).astype(int).tolist()
+    qty = rows['qty'].astype(object).where(rows['qty'].notna(), None).tolist()
+    cbm = rows['cbm'].astype(object).where(rows['cbm'].notna(), None).tolist()
+    total_cbm = rows['total_cbm'].astype(object).where(rows['total_cbm'].notna(), None).tolist()
+    return list(zip(range(len(rows)), rows['keycheck'], rows['origin'], rows['PO'], rows['item'], rows['supplier'],
+                    rows['parentpo'], rows['deliverydate'], qty, cbm, _native(rows['week']), total_cbm, is_last))
+
+
+def upsert_bbr(conn, rows):
+    """Nạp dữ liệu vào bảng tạm rồi UPDATE/INSERT bằng câu lệnh tập hợp trong một transaction.
+
+    Trả về (số dòng cập nhật, số dòng thêm mới) tính theo số dòng trong file như trước.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DROP TEMPORARY TABLE IF EXISTS bbr_staging")
+        cursor.execute("""
+            CREATE TEMPORARY TABLE bbr_staging (
+                seq INT NOT NULL PRIMARY KEY,
+                keycheck VARCHAR(255),
+                origin VARCHAR(20),
+                PO VARCHAR(100),
+                item VARCHAR(100),
+                supplier VARCHAR(50),
+                parentpo VARCHAR(100),
+                deliverydate DATE,
+                qty DOUBLE,
+                cbm DOUBLE,
+                week INT,
+                total_cbm DOUBLE,
+                is_last TINYINT NOT NULL DEFAULT 1,
+                is_update TINYINT NOT NULL DEFAULT 0,
+                KEY (keycheck)
+            )
+        """)
+        insert_batches(cursor, """
+            INSERT INTO bbr_staging (seq, keycheck, origin, PO, item, supplier, parentpo, deliverydate, qty, cbm, week, total_cbm, is_last)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, staging_rows(rows))
+
+        # Đánh dấu các dòng có keycheck đang mở (Status IS NULL) trong bbrreport
+        cursor.execute("""
+            UPDATE bbr_staging s
+            SET s.is_update = EXISTS (
+                SELECT 1 FROM bbrreport b WHERE b.keycheck = s.keycheck AND b.Status IS NULL
+            )
+        """)
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(is_update), 0) FROM bbr_staging")
+        total, updated = cursor.fetchone()
+        updated = int(updated)
+
+        # Các tuần bị ảnh hưởng (tuần mới trong file + tuần cũ của các dòng được cập nhật)
+        cursor.execute("SELECT DISTINCT week FROM bbr_staging")
+        weeks = {row[0] for row in cursor.fetchall()}
+        cursor.execute("""
+            SELECT DISTINCT b.week FROM bbrreport b
+            JOIN bbr_staging s ON s.keycheck = b.keycheck AND s.is_update = 1 AND s.is_last = 1
+            WHERE b.Status IS NULL
+        """)
+        weeks |= {row[0] for row in cursor.fetchall()}
+
+        cursor.execute("""
+            UPDATE bbrreport b
+            JOIN bbr_staging s ON s.keycheck = b.keycheck AND s.is_update = 1 AND s.is_last = 1
+            SET b.deliverydate = s.deliverydate, b.week = s.week, b.qty = s.qty
+            WHERE b.Status IS NULL
+        """)
+        cursor.execute("""
+            INSERT INTO bbrreport (keycheck, origin, PO, item, supplier, parentpo, deliverydate, qty, cbm, week, kindpallet, total_cbm)
+            SELECT s.keycheck, s.origin, s.PO, s.item, s.supplier, s.parentpo, s.deliverydate, s.qty, s.cbm, s.week,
+                   (SELECT m.kindpallet FROM masterdata m WHERE m.sku = s.item LIMIT 1), s.total_cbm
+            FROM bbr_staging s
+            WHERE s.is_update = 0
+            ORDER BY s.seq
+        """)
+        refresh_summary(cursor, weeks)
+        conn.commit()
+        return updated, int(total) - updated
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        try:
+            cursor.execute("DROP TEMPORARY TABLE IF EXISTS bbr_staging")
+        finally:
+            cursor.close()
+
+
+def _native(series):
+    """Chuyển kiểu numpy sang kiểu Python để mysql-connector nhận được"""
+    return [None if v is None else int(v) for v in series]
+
+
+# === TRUY VẤN BÁO CÁO ===
+# Cột được phép sắp xếp (tham số URL -> cột SQL) để tránh SQL Injection
+SORT_COLUMNS = {
+    'week': 'b.week', 'deliverydate': 'b.deliverydate', 'parentpo': 'b.parentpo', 'PO': 'b.PO',
+    'item': 'b.item', 'supplier': 'b.supplier', 'TENNCC': 'n.TENNCC', 'qty': 'b.qty', 'cbm': 'b.cbm',
+    'total_cbm': 'b.total_cbm', 'kindpallet': 'b.kindpallet', 'origin': 'b.origin', 'keycheck': 'b.keycheck',
+}
+
+# Cột tìm kiếm (chuỗi con, không phân biệt hoa thường); cột số so khớp theo dạng chuỗi
+SEARCH_COLUMNS = ['CAST(b.id AS CHAR)', 'b.keycheck', 'b.origin', 'b.PO', 'b.item', 'b.supplier', 'b.parentpo',
+                  'b.kindpallet', 'b.Status', 'b.week', 'b.deliverydate', 'CAST(b.qty AS CHAR)',
+                  'CAST(b.cbm AS CHAR)', 'CAST(b.total_cbm AS CHAR)', 'n.TENNCC']
+
+# Nhóm SKU Chipboard
+CHIPBOARD_GROUPS = {
+    '1210': ["LLR68948", "LLR68952", "LLR68953"],
+    '1610': ["LLR68947", "LLR68951"],
+    '1910': ["LLR68946", "LLR68950", "LLR68960"],
+}
+
+# Cột có FULLTEXT index (ngram) dùng cho tìm kiếm nhanh (bảng bbrreport alias x)
+FULLTEXT_COLUMNS = "x.PO, x.item, x.parentpo, x.supplier"
+NGRAM_TOKEN_SIZE = 2  # Giá trị mặc định ngram_token_size của MySQL
+
+
+def _contains(search):
+    """Mẫu LIKE chuỗi con (escape ký tự đại diện của LIKE)"""
+    return '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _fulltext_term(search):
+    """Cụm từ cho MATCH ... IN BOOLEAN MODE: tìm cả chuỗi liên tiếp (tương đương tìm chuỗi con)"""
+    return '"' + search.replace('"', ' ') + '"'
+
+
+def build_filter(week=None, search='', match='fulltext'):
+    """Mệnh đề FROM ... WHERE theo tuần và từ khóa tìm kiếm; trả về (mệnh đề, tham số).
+
+    match='fulltext' dùng FULLTEXT index (PO, item, parentpo, supplier, tên NCC): hai nhánh
+    MATCH (trên bbrreport và trên nhacungcap rồi JOIN theo supplier) gộp bằng UNION, vì MATCH
+    nằm trong OR thì MySQL không dùng được FULLTEXT index.
+    match='substring' giữ cách tìm chuỗi con cũ trên mọi cột (chế độ tương thích, quét bảng).
+
+    Yêu cầu: index FULLTEXT được tạo khi tắt stopword (migration 15, innodb_ft_enable_stopword=0);
+    index tạo với stopword mặc định bỏ mọi token chứa 'a', 'i'... nên nhiều từ khóa không khớp.
+    """
+    joins = ""
+    conditions = []
+    params = []
+    search = (search or '').strip()
+    if search and match != 'substring' and len(search) >= NGRAM_TOKEN_SIZE:
+        joins = f""" JOIN (
+            SELECT x.id FROM bbrreport x WHERE MATCH({FULLTEXT_COLUMNS}) AGAINST (%s IN BOOLEAN MODE)
+            UNION
+            SELECT x.id FROM nhacungcap s JOIN bbrreport x ON x.supplier = s.MANCC
+            WHERE MATCH(s.TENNCC) AGAINST (%s IN BOOLEAN MODE)
+        ) hits ON hits.id = b.id"""
+        term = _fulltext_term(search)
+        params.extend([term, term])
+    if week and str(week).isdigit():
+        conditions.append("b.week = %s")
+        params.append(int(week))
+    if search and not joins:
+        conditions.append("(" + " OR ".join(f"{col} LIKE %s" for col in SEARCH_COLUMNS) + ")")
+        params.extend([_contains(search)] * len(SEARCH_COLUMNS))
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    return f"FROM bbrreport b{joins} LEFT JOIN nhacungcap n ON b.supplier = n.MANCC{where}", params
+
+
+def search_keychecks(cursor, search, match='fulltext', limit=100):
+    """Danh sách keycheck khớp từ khóa (dùng index, không tải toàn bộ báo cáo)"""
+    source, params = build_filter(None, search, match)
+    cursor.execute(f"SELECT b.keycheck {source} ORDER BY b.id LIMIT %s", params + [limit])
+    return [row['keycheck'] for row in cursor.fetchall()]
+
+
+def get_weeks(cursor):
+    cursor.execute("SELECT DISTINCT week FROM bbrreport WHERE week IS NOT NULL ORDER BY week")
+    return [int(row['week']) for row in cursor.fetchall()]
+
+
+def count_rows(cursor, source, params):
+    cursor.execute(f"SELECT COUNT(*) AS total {source}", params)
+    return cursor.fetchone()['total']
+
+
+def fetch_page(cursor, source, params, sort_by=None, order='asc', page=1, per_page=50):
+    sort_col = SORT_COLUMNS.get(sort_by)
+    direction = 'DESC' if order == 'desc' else 'ASC'
+    order_by = f"{sort_col} {direction}, b.id" if sort_col else "b.id"
+    offset = max(page - 1, 0) * per_page
+    cursor.execute(f"SELECT b.*, n.TENNCC {source} ORDER BY {order_by} LIMIT %s OFFSET %s",
+                   params + [per_page, offset])
+    return cursor.fetchall()
+
+
+def get_po_stats(cursor, source, params):
+    """Tổng số kiện / CBM theo Parent PO + nhà cung cấp, sắp xếp CBM giảm dần"""
+    cursor.execute(f"""
+        SELECT b.parentpo, COALESCE(n.TENNCC, '') AS TENNCC,
+               COALESCE(SUM(b.qty), 0) AS qty, COALESCE(SUM(b.total_cbm), 0) AS total_cbm
+        {source}
+        GROUP BY b.parentpo, COALESCE(n.TENNCC, '')
+        HAVING b.parentpo IS NOT NULL
+        ORDER BY total_cbm DESC
+    """, params)
+    return [dict(row, qty=float(row['qty']), total_cbm=float(row['total_cbm'])) for row in cursor.fetchall()]
+
+
+def get_cbm_stats(cursor, source, params):
+    """Tổng CBM, CBM quy đổi theo loại pallet và CBM các nhóm Chipboard"""
+    chip_cols = ", ".join(
+        f"COALESCE(SUM(CASE WHEN b.item IN ({', '.join(['%s'] * len(skus))}) THEN b.total_cbm END), 0) AS `chip_{name}`"
+        for name, skus in CHIPBOARD_GROUPS.items())
+    chip_params = [sku for skus in CHIPBOARD_GROUPS.values() for sku in skus]
+    kind_cols = ", ".join(
+        f"COALESCE(SUM(CASE WHEN b.kindpallet = '{kind}' THEN b.total_cbm END), 0) AS `kind_{kind}`"
+        for kind in list(PALLET_CBM) + ['1.5'])
+    cursor.execute(f"""
+        SELECT COALESCE(SUM(b.total_cbm), 0) AS total_cbm, {kind_cols}, {chip_cols}
+        {source}
+    """, chip_params + params)
+    row = cursor.fetchone()
+    return cbm_stats_from_sums(
+        float(row['total_cbm']),
+        {kind: float(row[f'kind_{kind}']) for kind in list(PALLET_CBM) + ['1.5']},
+        {name: float(row[f'chip_{name}']) for name in CHIPBOARD_GROUPS})
+
+
+def cbm_stats_from_sums(total_cbm, kind_cbm, chip_cbm):
+    pallet_stats = {'1m2': 0, '1m6': 0, '1m9': 0, '1.5': 0}
+    for kind in PALLET_CBM:
+        cbm = kind_cbm.get(kind, 0)
+        pallet_stats[kind] = float(pallets_by_cbm(cbm, kind)) * BBR_PALLET_FACTOR if cbm > 0 else 0
+    pallet_stats['1.5'] = kind_cbm.get('1.5', 0)
+    chipboard_stats = {name: chip_cbm.get(name, 0) for name in CHIPBOARD_GROUPS}
+    return total_cbm, pallet_stats, chipboard_stats
+
+
+# === BẢNG TỔNG HỢP THEO TUẦN ===
+# bbr_weekly_summary: tổng qty/CBM theo week × parentpo × supplier × kindpallet × nhóm chipboard.
+# Được cập nhật trong cùng transaction với import BBR và xóa tuần.
+def _chipboard_case(col='item'):
+    whens = " ".join(
+        f"WHEN {col} IN ({', '.join(repr(sku) for sku in skus)}) THEN '{name}'"
+        for name, skus in CHIPBOARD_GROUPS.items())
+    return f"CASE {whens} ELSE NULL END"
+
+
+def _week_condition(weeks, col='week'):
+    weeks = set(weeks)
+    parts = []
+    params = [int(w) for w in weeks if w is not None]
+    if params:
+        parts.append(f"{col} IN ({', '.join(['%s'] * len(params))})")
+    if None in weeks:
+        parts.append(f"{col} IS NULL")
+    return "(" + " OR ".join(parts) + ")", params
+
+
+def refresh_summary(cursor, weeks=None):
+    """Tính lại bảng tổng hợp cho các tuần được chỉ định (None = toàn bộ)"""
+    if weeks is None:
+        where, params = "", []
+    else:
+        weeks = list(weeks)
+        if not weeks:
+            return
+        cond, params = _week_condition(weeks)
+        where = " WHERE " + cond
+    cursor.execute(f"DELETE FROM bbr_weekly_summary{where}", params)
+    cursor.execute(f"""
+        INSERT INTO bbr_weekly_summary (week, parentpo, supplier, kindpallet, chipboard_group, qty, total_cbm, line_count)
+        SELECT week, parentpo, supplier, kindpallet, {_chipboard_case()} AS chipboard_group,
+               COALESCE(SUM(qty), 0), COALESCE(SUM(total_cbm), 0), COUNT(*)
+        FROM bbrreport{where}
+        GROUP BY week, parentpo, supplier, kindpallet, chipboard_group
+    """, params)
+
+
+def delete_week_summary(cursor, week):
+    cursor.execute("DELETE FROM bbr_weekly_summary WHERE week = %s", (week,))
+
+
+def _summary_filter(week):
+    if week and str(week).isdigit():
+        return " WHERE s.week = %s", [int(week)]
+    return "", []
+
+
+def get_summary_cbm_stats(cursor, week=None):
+    """Giống get_cbm_stats nhưng đọc từ bảng tổng hợp (khi không có từ khóa tìm kiếm)"""
+    where, params = _summary_filter(week)
+    cursor.execute(f"""
+        SELECT s.kindpallet, s.chipboard_group, SUM(s.total_cbm) AS total_cbm
+        FROM bbr_weekly_summary s{where}
+        GROUP BY s.kindpallet, s.chipboard_group
+    """, params)
+    total_cbm = 0.0
+    kind_cbm = {}
+    chip_cbm = {}
+    for row in cursor.fetchall():
+        cbm = float(row['total_cbm'] or 0)
+        total_cbm += cbm
+        if row['kindpallet'] is not None:
+            kind_cbm[row['kindpallet']] = kind_cbm.get(row['kindpallet'], 0) + cbm
+        if row['chipboard_group'] is not None:
+            chip_cbm[row['chipboard_group']] = chip_cbm.get(row['chipboard_group'], 0) + cbm
+    return cbm_stats_from_sums(total_cbm, kind_cbm, chip_cbm)
+
+
+def get_summary_po_stats(cursor, week=None):
+    """Giống get_po_stats nhưng đọc từ bảng tổng hợp"""
+    where, params = _summary_filter(week)
+    cond = where + (" AND " if where else " WHERE ") + "s.parentpo IS NOT NULL"
+    cursor.execute(f"""
+        SELECT s.parentpo, COALESCE(n.TENNCC, '') AS TENNCC,
+               COALESCE(SUM(s.qty), 0) AS qty, COALESCE(SUM(s.total_cbm), 0) AS total_cbm
+        FROM bbr_weekly_summary s LEFT JOIN nhacungcap n ON s.supplier = n.MANCC
+        {cond}
+        GROUP BY s.parentpo, COALESCE(n.TENNCC, '')
+        ORDER BY total_cbm DESC
+    """, params)
+    return [dict(row, qty=float(row['qty']), total_cbm=float(row['total_cbm'])) for row in cursor.fetchall()]
+
+
+def stats(cursor, week=None, search='', match='fulltext'):
+    """Thống kê cho trang BBR: dùng bảng tổng hợp, chỉ tính trực tiếp khi có tìm kiếm"""
+    if search:
+        source, params = build_filter(week, search, match)
+        total_cbm, pallet_stats, chipboard_stats = get_cbm_stats(cursor, source, params)
+        return total_cbm, pallet_stats, chipboard_stats, get_po_stats(cursor, source, params)
+    total_cbm, pallet_stats, chipboard_stats = get_summary_cbm_stats(cursor, week)
+    return total_cbm, pallet_stats, chipboard_stats, get_summary_po_stats(cursor, week)
+
+
+def po_stats(cursor, week=None, search='', match='fulltext'):
+    if search:
+        return get_po_stats(cursor, *build_filter(week, search, match))
+    return get_summary_po_stats(cursor, week)
+
+
+def import_job(conn, job, files):
+    """Job nền: đọc file CSV BBR, nạp vào bảng tạm và upsert vào bbrreport"""
+    path, _ = files[0]
+    rows = parse_bbr_file(pd.read_csv(path))
+    job.progress(parsed=len(rows))
+    updated, inserted = upsert_bbr(conn, rows)
+    job.progress(written=updated + inserted)
+    typeahead.add('po', rows['parentpo'].unique())
+    typeahead.add('sku', rows['item'].unique())
+    return f"Đã xử lý xong! Cập nhật: {updated}, Thêm mới: {inserted}", "success"
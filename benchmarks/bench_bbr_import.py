@@ -0,0 +1,104 @@
+"""Benchmark xử lý file BBR: vòng lặp iterrows cũ so với bbr_report.parse_bbr_file + bbr_report.staging_rows.
+
+    python benchmarks/bench_bbr_import.py [số dòng]
+"""
+import math
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bbr_report  # noqa: E402
+
+
+def make_input(n, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365, n), unit='D')
+    df = pd.DataFrame({
+        'PO Number': rng.integers(4500000, 4600000, n),
+        'Item No': [f"LLR{v}" for v in rng.integers(10000, 99999, n)],
+        'Parent PO': [f"P{v}" for v in rng.integers(1000, 1200, n)],
+        'origin': rng.choice(['VN', 'CN', 'vn', 'TH'], n),
+        'VNDR CD': rng.choice(['V001', 'V002', 'V003'], n),
+        'DELIVERY DT': dates.strftime('%Y-%m-%d'),
+        'QTY': rng.integers(0, 500, n),
+        'QTY per PCK': rng.choice([0, 1, 6, 12], n),
+        'MC CBM': rng.random(n).round(4),
+    })
+    df.loc[df.sample(frac=0.01, random_state=seed).index, 'DELIVERY DT'] = None
+    return df
+
+
+def legacy_split(df_input, existing_keys, master_dict):
+    """Cách xử lý cũ trong route bbr() (giữ lại để so sánh)"""
+    updates = []
+    inserts = []
+    for _, row in df_input.iterrows():
+        def get_str(col):
+            val = row.get(col)
+            return str(val).strip() if pd.notna(val) else ''
+
+        po = get_str('PO Number')
+        item = get_str('Item No')
+        parent_po = get_str('Parent PO')
+        origin = get_str('origin')
+        vndr = get_str('VNDR CD')
+        keycheck = f"{po}_{item}_{parent_po}"
+
+        try:
+            d_dt = pd.to_datetime(row.get('DELIVERY DT'))
+            add_days = 3 if str(origin).upper() == 'VN' else 14
+            new_date = d_dt + pd.Timedelta(days=add_days)
+            new_date_str = new_date.strftime('%Y-%m-%d')
+            week_num = new_date.isocalendar()[1]
+        except:
+            new_date_str = None
+            week_num = None
+
+        q_pck = pd.to_numeric(row.get('QTY per PCK'), errors='coerce') or 1
+        qty_val = (pd.to_numeric(row.get('QTY'), errors='coerce') or 0) / q_pck
+
+        if keycheck in existing_keys:
+            updates.append((new_date_str, week_num, qty_val, keycheck))
+        else:
+            cbm = pd.to_numeric(row.get('MC CBM'), errors='coerce') or 0
+            total_cbm = qty_val * cbm
+            kind = master_dict.get(item, None)
+            inserts.append((keycheck, origin, po, item, vndr, parent_po, new_date_str, qty_val, cbm, week_num, kind, total_cbm))
+    return updates, inserts
+
+
+def same(a, b):
+    def norm(v):
+        if v is None or (isinstance(v, float) and math.isnan(v)):
+            return None
+        return float(v) if isinstance(v, (int, float, np.number)) and not isinstance(v, bool) else v
+    return [tuple(map(norm, r)) for r in a] == [tuple(map(norm, r)) for r in b]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    df = make_input(n)
+
+    # Phần phân loại UPDATE/INSERT và kindpallet nay chạy trong SQL, nên so sánh với toàn bộ dòng là INSERT
+    t0 = time.perf_counter()
+    _, old = legacy_split(df, set(), {})
+    t_old = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    staged = bbr_report.staging_rows(bbr_report.parse_bbr_file(df))
+    t_new = time.perf_counter() - t0
+    new = [r[1:11] + (None, r[11]) for r in staged]
+
+    print(f"Số dòng: {n}")
+    print(f"iterrows (cũ):   {t_old:8.3f}s  {n / t_old:12,.0f} dòng/s")
+    print(f"vectorized (mới): {t_new:8.3f}s  {n / t_new:12,.0f} dòng/s  (x{t_old / t_new:.1f})")
+    print(f"Kết quả giống nhau: {same(old, new)}")
+
+
+if __name__ == "__main__":
+    main()
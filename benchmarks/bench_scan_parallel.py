@@ -0,0 +1,50 @@
+"""Benchmark đọc nhiều file Scan (Excel): lần lượt so với scan_import.parse_files (process pool).
+
+    python benchmarks/bench_scan_parallel.py [số dòng mỗi file] [số worker]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scan_import  # noqa: E402
+from bench_scan_parse import make_input  # noqa: E402
+
+FILE_COUNTS = [1, 2, 5, 10, 20]
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    if len(sys.argv) > 2:
+        scan_import.PARSE_WORKERS = int(sys.argv[2])
+
+    folder = tempfile.mkdtemp()
+    files = []
+    for i in range(max(FILE_COUNTS)):
+        path = os.path.join(folder, f"scan_{i}.xlsx")
+        make_input(rows, seed=i).to_excel(path, header=False, index=False)
+        files.append((path, f"scan_{i}.xlsx"))
+
+    # Khởi động pool trước để không tính thời gian spawn process vào lần đo đầu tiên
+    scan_import.parse_files(files[:2], 'JOB1')
+
+    print(f"{rows} dòng mỗi file, {scan_import.PARSE_WORKERS} worker")
+    print(f"{'Số file':>8} {'lần lượt':>10} {'song song':>10} {'tăng tốc':>9}")
+    for count in FILE_COUNTS:
+        subset = files[:count]
+        t0 = time.perf_counter()
+        sequential = [scan_import.parse_file(path, name, 'JOB1', '2024-01-01 00:00:00')[1] for path, name in subset]
+        t_seq = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        parallel = scan_import.parse_files(subset, 'JOB1')
+        t_par = time.perf_counter() - t0
+
+        same = all(len(a) == len(b) for a, (_, b) in zip(sequential, parallel))
+        print(f"{count:>8} {t_seq:>9.2f}s {t_par:>9.2f}s {t_seq / t_par:>8.1f}x{'' if same else '  (khác số dòng!)'}")
+
+
+if __name__ == "__main__":
+    main()
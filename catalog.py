@@ -0,0 +1,74 @@
+"""Tìm kiếm danh sách Nhà cung cấp và Master Data bằng index.
+
+Mã (MANCC, SKU) tìm theo tiền tố (LIKE 'q%' dùng PRIMARY KEY); tên NCC và mô tả SKU tìm
+bằng FULLTEXT ngram. Hai nhánh gộp bằng UNION rồi JOIN với bảng chính. Tổng số dòng đếm qua pagination.count (cache theo câu truy vấn,
+hết hiệu lực khi thêm/sửa/xóa qua pagination.invalidate).
+"""
+import pagination
+from bbr_report import NGRAM_TOKEN_SIZE
+
+
+def _prefix(search):
+    """Mẫu LIKE tiền tố (escape ký tự đại diện của LIKE)"""
+    return search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _phrase(search):
+    """Cụm từ cho MATCH ... IN BOOLEAN MODE (giống cách tìm BBR)"""
+    return '"' + search.replace('"', ' ') + '"'
+
+
+def _filter(table, key, code_col, text_col, search):
+    """JOIN lọc theo từ khóa, đặt ngay sau bảng chính: (mệnh đề JOIN, tham số).
+
+    Hai nhánh dùng index riêng (tiền tố trên khóa chính, FULLTEXT trên cột chữ) gộp bằng UNION,
+    vì LIKE / MATCH nằm trong OR thì MySQL không dùng được index nào. Index FULLTEXT phải được
+    tạo khi tắt stopword (migration 15, 16); 'migrations.py check' kiểm tra bằng dữ liệu thật.
+    """
+    search = (search or '').strip()
+    if not search:
+        return "", []
+    if len(search) < NGRAM_TOKEN_SIZE:
+        # Từ khóa ngắn hơn token ngram: FULLTEXT không tìm được, chỉ tìm tiền tố của mã
+        return (f" JOIN (SELECT {key} FROM {table} WHERE {code_col} LIKE %s) hits USING ({key})",
+                [_prefix(search)])
+    return (f""" JOIN (
+            SELECT {key} FROM {table} WHERE {code_col} LIKE %s
+            UNION
+            SELECT {key} FROM {table} WHERE MATCH({text_col}) AGAINST (%s IN BOOLEAN MODE)
+        ) hits USING ({key})""", [_prefix(search), _phrase(search)])
+
+
+def supplier_filter(search):
+    """JOIN theo MANCC (tiền tố) hoặc TENNCC (FULLTEXT), đặt sau FROM nhacungcap"""
+    return _filter("nhacungcap", "MANCC", "MANCC", "TENNCC", search)
+
+
+def masterdata_filter(search):
+    """JOIN theo SKU (tiền tố) hoặc mô tả (FULLTEXT), đặt sau FROM masterdata m"""
+    return _filter("masterdata", "sku", "sku", "description", search)
+
+
+# Cột được phép sắp xếp danh sách Master Data (tham số URL -> cột SQL) để tránh SQL Injection
+MASTERDATA_SORT = {'sku': 'm.sku', 'TENNCC': 'n.TENNCC', 'quantity': 'm.quantity', 'cbm': 'm.cbm'}
+
+
+def supplier_page(cursor, search, page, per_page):
+    """(danh sách NCC của trang, tổng số dòng khớp từ khóa)"""
+    join, params = supplier_filter(search)
+    total = pagination.count(cursor, f"SELECT COUNT(*) AS total FROM nhacungcap{join}", params)
+    cursor.execute(f"SELECT * FROM nhacungcap{join} ORDER BY MANCC LIMIT %s OFFSET %s",
+                   params + [per_page, max(page - 1, 0) * per_page])
+    return cursor.fetchall(), total
+
+
+def masterdata_page(cursor, search, sort_by, order, page, per_page):
+    """(danh sách Master Data kèm TENNCC của trang, tổng số dòng khớp từ khóa)"""
+    sort_col = MASTERDATA_SORT.get(sort_by, 'm.sku')
+    direction = 'DESC' if order == 'desc' else 'ASC'
+    join, params = masterdata_filter(search)
+    total = pagination.count(cursor, f"SELECT COUNT(*) AS total FROM masterdata m{join}", params)
+    cursor.execute(f"""SELECT m.*, n.TENNCC FROM masterdata m{join} LEFT JOIN nhacungcap n ON m.MANCC = n.MANCC
+                       ORDER BY {sort_col} {direction} LIMIT %s OFFSET %s""",
+                   params + [per_page, max(page - 1, 0) * per_page])
+    return cursor.fetchall(), total
@@ -0,0 +1,262 @@
+import os
+import queue
+import threading
+import time
+
+import mysql.connector
+from flask import g, has_app_context
+
+
+def _connect():
+    """Mở một kết nối MySQL mới (có TLS) theo biến môi trường"""
+    return mysql.connector.connect(
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT") or 3306),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        database=os.getenv("DB_NAME"),
+        ssl_ca=os.getenv("DB_SSL_CA"),
+        ssl_disabled=False
+    )
+
+
+class ConnectionPool:
+    """Pool kết nối MySQL: kiểm tra sức khỏe khi lấy ra, tái tạo kết nối quá hạn"""
+
+    def __init__(self):
+        self.configure()
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._pid = os.getpid()
+        self.stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'connects': 0,
+            'recycled': 0,
+            'ping_failures': 0,
+        }
+
+    def configure(self):
+        # Cấu hình theo từng gunicorn worker (mỗi worker có một pool riêng)
+        self.size = int(os.getenv("DB_POOL_SIZE") or 5)
+        self.timeout = float(os.getenv("DB_POOL_TIMEOUT") or 10)    # Số giây chờ khi pool hết kết nối
+        self.recycle = int(os.getenv("DB_POOL_RECYCLE") or 1800)    # Kết nối cũ hơn N giây sẽ được tạo lại
+
+    def _reset_after_fork(self):
+        # gunicorn fork worker sau khi import app: không dùng lại socket của tiến trình cha
+        if self._pid != os.getpid():
+            self._idle = queue.LifoQueue()
+            self._created = 0
+            self._pid = os.getpid()
+
+    def _new_connection(self):
+        conn = _connect()
+        conn._pool_created_at = time.monotonic()
+        self.stats['connects'] += 1
+        return conn
+
+    def checkout(self):
+        self._reset_after_fork()
+        self.stats['checkouts'] += 1
+
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    return self._new_connection()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            self.stats['waits'] += 1
+            try:
+                conn = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                self.stats['timeouts'] += 1
+                raise mysql.connector.errors.PoolError(
+                    f"Hết kết nối trong pool (size={self.size}) sau {self.timeout}s")
+
+        # Tái tạo kết nối đã quá hạn
+        if time.monotonic() - conn._pool_created_at > self.recycle:
+            self.stats['recycled'] += 1
+            self._discard(conn)
+            return self._replace()
+
+        # Kiểm tra sức khỏe trước khi giao cho request
+        try:
+            conn.ping(reconnect=False)
+        except Exception:
+            self.stats['ping_failures'] += 1
+            self._discard(conn)
+            return self._replace()
+        return conn
+
+    def _replace(self):
+        try:
+            return self._new_connection()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def release(self, conn):
+        if conn is None:
+            return
+        if self._pid != os.getpid():
+            return
+        try:
+            if conn.is_connected():
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put(conn)
+                return
+        except Exception:
+            pass
+        # Kết nối hỏng: bỏ đi, lần sau sẽ tạo mới
+        self._discard(conn)
+        with self._lock:
+            self._created -= 1
+
+    def get_stats(self):
+        idle = self._idle.qsize()
+        return dict(self.stats, size=self.size, created=self._created, idle=idle,
+                    in_use=self._created - idle, pid=os.getpid())
+
+
+class PooledConnection:
+    """Kết nối mượn từ pool; close() trả kết nối về pool thay vì đóng socket"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+
+class RequestConnection(PooledConnection):
+    """Kết nối gắn với request hiện tại; chỉ được trả về pool ở teardown"""
+
+    def close(self):
+        pass
+
+
+pool = ConnectionPool()
+
+
+def get_db_connection():
+    """Lấy kết nối từ pool.
+
+    Trong request: mỗi request dùng chung một kết nối, tự động trả về pool khi teardown.
+    Ngoài request (scheduler, CLI): người gọi tự close() để trả kết nối về pool.
+    """
+    host = os.getenv("DB_HOST")
+    if not host:
+        print("❌ Lỗi: Biến môi trường DB_HOST chưa được cấu hình. Vui lòng kiểm tra file .env hoặc cấu hình trên Render.")
+        return None
+
+    if has_app_context() and '_db_conn' in g:
+        return g._db_conn
+
+    try:
+        conn = pool.checkout()
+    except mysql.connector.Error as e:
+        print(f"❌ Lỗi kết nối MySQL ({host}): {e}")
+        return None
+
+    if has_app_context():
+        g._db_conn = RequestConnection(pool, conn)
+        return g._db_conn
+    return PooledConnection(pool, conn)
+
+
+def release_request_connection(exc=None):
+    """Teardown: luôn trả kết nối của request về pool (kể cả khi route lỗi)"""
+    wrapper = g.pop('_db_conn', None)
+    if wrapper is not None:
+        pool.release(wrapper._conn)
+        wrapper._conn = None
+
+
+def init_app(app):
+    pool.configure()  # Đọc lại cấu hình sau khi app đã load .env
+    app.teardown_appcontext(release_request_connection)
+
+
+def insert_batches(cursor, sql, rows, batch_size=1000, on_batch=None):
+    """executemany theo từng lô (mysql-connector gộp mỗi lô thành một câu INSERT nhiều dòng)
+
+    on_batch(n) được gọi sau mỗi lô, dùng để báo tiến độ.
+    """
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        cursor.executemany(sql, batch)
+        if on_batch:
+            on_batch(len(batch))
+    return len(rows)
+
+
+def select_in(cursor, sql, values, chunk_size=1000, params=()):
+    """Chạy SELECT ... WHERE col IN ({placeholders}) theo từng nhóm giá trị, gộp kết quả.
+
+    sql chứa đúng một chỗ {placeholders}; giá trị trùng/rỗng được bỏ qua. params là các
+    tham số đứng trước {placeholders} trong sql (ví dụ jobno = %s AND sscc IN (...)).
+    """
+    values = list(dict.fromkeys(v for v in values if v not in (None, '')))
+    rows = []
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start:start + chunk_size]
+        cursor.execute(sql.format(placeholders=", ".join(["%s"] * len(chunk))), list(params) + chunk)
+        rows.extend(cursor.fetchall())
+    return rows
+
+
+def unique_key_exists(cursor, table, column):
+    """True nếu bảng có PRIMARY KEY / UNIQUE KEY chỉ gồm đúng một cột column"""
+    cursor.execute("""
+        SELECT 1 FROM information_schema.statistics s
+        WHERE s.table_schema = DATABASE() AND s.table_name = %s AND s.column_name = %s
+          AND s.non_unique = 0 AND s.seq_in_index = 1
+          AND NOT EXISTS (
+              SELECT 1 FROM information_schema.statistics t
+              WHERE t.table_schema = s.table_schema AND t.table_name = s.table_name
+                AND t.index_name = s.index_name AND t.seq_in_index > 1)
+        LIMIT 1
+    """, (table, column))
+    return cursor.fetchone() is not None
+
+
+def get_dedicated_connection():
+    """Kết nối riêng từ pool (kể cả trong request), người gọi tự close().
+
+    Dùng cho cursor không buffer đọc dữ liệu lớn (export stream), vì trong lúc đọc
+    kết nối không chạy được truy vấn khác và có thể sống lâu hơn request.
+    """
+    if not os.getenv("DB_HOST"):
+        return None
+    try:
+        return PooledConnection(pool, pool.checkout())
+    except mysql.connector.Error as e:
+        print(f"❌ Lỗi kết nối MySQL: {e}")
+        return None
@@ -0,0 +1,213 @@
+"""Danh sách và xuất dữ liệu chi tiết Inbound / Outbound theo khoảng ngày (CSV hoặc Excel).
+
+Đọc bằng cursor không buffer (fetchmany từng lô) trên kết nối riêng: CSV được stream
+thẳng ra response, Excel ghi bằng workbook write-only vào file tạm, nên bộ nhớ không
+tăng theo số dòng.
+"""
+import csv
+import io
+import tempfile
+
+from openpyxl import Workbook
+
+import pagination
+
+FETCH_SIZE = 5000
+
+INBOUND_COLUMNS = [
+    ('i.datercv', 'Ngày nhập'), ('i.PackinglistNo', 'Packing List'), ('i.po', 'PO'), ('i.sku', 'SKU'),
+    ('i.MANCC', 'Mã NCC'), ('n.TENNCC', 'Nhà cung cấp'), ('i.carton', 'Số kiện'), ('i.cbm', 'CBM'),
+    ('i.contxe', 'Cont/Xe'), ('i.labour', 'Nhân công'),
+]
+OUTBOUND_COLUMNS = [
+    ('datercv', 'Ngày nhận picking'), ('jobno', 'Job No'), ('po', 'PO'), ('parentpo', 'Parent PO'),
+    ('childpo', 'Child PO'), ('fdc', 'FDC'), ('sku', 'SKU'), ('carton', 'Số kiện'), ('cbm', 'CBM'),
+    ('loosecarton', 'Loose Carton'), ('kindpallet', 'Loại Pallet'), ('container', 'Container'),
+    ('seal', 'Seal'), ('datestuff', 'Ngày đóng hàng'), ('remark', 'Ghi chú'),
+]
+
+
+def inbound_filter(args):
+    """Điều kiện lọc q/from_date/to_date của trang Inbound (bảng inbound alias i)"""
+    conditions = []
+    params = []
+
+    search = args.get('q', '')
+    if search:
+        conditions.append("(i.po LIKE %s OR i.sku LIKE %s OR i.PackinglistNo LIKE %s)")
+        params.extend([f"%{search}%"] * 3)
+
+    from_date = args.get('from_date')
+    if from_date:
+        conditions.append("i.datercv >= %s")
+        params.append(from_date)
+
+    to_date = args.get('to_date')
+    if to_date:
+        conditions.append("i.datercv <= %s")
+        params.append(to_date)
+    return conditions, params
+
+
+def outbound_filter(args):
+    """Điều kiện lọc q/from_date/to_date của trang Outbound"""
+    conditions = []
+    params = []
+
+    search = args.get('q', '')
+    if search:
+        conditions.append("(jobno LIKE %s OR parentpo LIKE %s OR sku LIKE %s)")
+        params.extend([f"%{search}%"] * 3)
+
+    from_date = args.get('from_date')
+    if from_date:
+        conditions.append("datercv >= %s")
+        params.append(from_date)
+
+    to_date = args.get('to_date')
+    if to_date:
+        conditions.append("datercv <= %s")
+        params.append(to_date)
+    return conditions, params
+
+
+def inbound_pages(cursor, args):
+    """Trang Inbound: (danh sách chi tiết keyset theo (datercv, id), thống kê Packing List)"""
+    base_query = "FROM inbound i LEFT JOIN nhacungcap n ON i.MANCC = n.MANCC"
+    conditions, params = inbound_filter(args)
+    where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+    # Có alias cho Edit Modal
+    inbounds_select = f"""
+        SELECT
+            i.id, i.PackinglistNo, i.PackinglistNo as packing,
+            i.po, i.sku, n.TENNCC as supplier,
+            i.carton, i.carton as qty,
+            i.cbm, i.contxe, i.contxe as container,
+            i.datercv, i.datercv as date, i.labour
+        {base_query}
+    """
+    inbounds = pagination.keyset(cursor, inbounds_select, conditions, params,
+                                 [('i.datercv', 'datercv'), ('i.id', 'id')], args,
+                                 per_page=50, count_from="FROM inbound i", prefix='d_')
+
+    # Thống kê Packing List (GROUP BY + LIMIT/OFFSET trong SQL)
+    stats_sql = f"""
+        SELECT
+            i.PackinglistNo as `Packing List`,
+            MAX(i.datercv) as `Ngày nhập hàng`,
+            COALESCE(SUM(i.cbm), 0) as `Tổng CBM`,
+            COALESCE(SUM(i.carton), 0) as `Tổng Số Kiện`,
+            MAX(n.TENNCC) as `Nhà Cung Cấp`
+        {base_query}
+        {where_clause}
+        GROUP BY i.PackinglistNo
+        ORDER BY `Ngày nhập hàng` DESC
+    """
+    stats = pagination.offset(cursor, stats_sql, params,
+                              f"SELECT COUNT(DISTINCT i.PackinglistNo) AS total FROM inbound i {where_clause}", params,
+                              args, per_page=10)
+    return inbounds, stats
+
+
+def outbound_pages(cursor, args):
+    """Trang Outbound: (danh sách keyset theo (datercv, id), thống kê theo DO)"""
+    conditions, params = outbound_filter(args)
+    where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+    outbounds = pagination.keyset(cursor, "SELECT * FROM outbound", conditions, params,
+                                  [('datercv', 'datercv'), ('id', 'id')], args,
+                                  per_page=10, count_from="FROM outbound")
+
+    # Thống kê theo DO (GROUP BY + LIMIT/OFFSET trong SQL)
+    stats_sql = f"""
+        SELECT
+            jobno as `DO Number`,
+            container,
+            seal,
+            datestuff,
+            MAX(datercv) as `Ngày nhận picking hàng`,
+            COALESCE(SUM(cbm), 0) as `Tổng CBM`,
+            COALESCE(SUM(carton), 0) as `Tổng Số Kiện`
+        FROM outbound
+        {where_clause}
+        GROUP BY jobno, container, seal, datestuff
+        ORDER BY `Ngày nhận picking hàng` DESC
+    """
+    stats_count_sql = f"SELECT COUNT(*) AS total FROM (SELECT 1 FROM outbound {where_clause} GROUP BY jobno, container, seal, datestuff) g"
+    stats = pagination.offset(cursor, stats_sql, params, stats_count_sql, params,
+                              args, per_page=20, prefix='s_')
+    return outbounds, stats
+
+
+def inbound_query(args):
+    conditions, params = inbound_filter(args)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    cols = ", ".join(col for col, _ in INBOUND_COLUMNS)
+    sql = f"SELECT {cols} FROM inbound i LEFT JOIN nhacungcap n ON i.MANCC = n.MANCC{where} ORDER BY i.datercv, i.id"
+    return sql, params, [title for _, title in INBOUND_COLUMNS]
+
+
+def outbound_query(args):
+    conditions, params = outbound_filter(args)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    cols = ", ".join(col for col, _ in OUTBOUND_COLUMNS)
+    sql = f"SELECT {cols} FROM outbound{where} ORDER BY datercv, id"
+    return sql, params, [title for _, title in OUTBOUND_COLUMNS]
+
+
+def iter_rows(conn, sql, params):
+    """Đọc kết quả theo lô FETCH_SIZE dòng bằng cursor không buffer (người gọi đóng kết nối)"""
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=False)
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            yield rows
+    finally:
+        if cursor is not None:
+            try:
+                # Bỏ phần kết quả chưa đọc (client ngắt giữa chừng) trước khi trả kết nối về pool
+                conn.consume_results()
+                cursor.close()
+            except Exception:
+                pass
+
+
+def stream_csv(conn, sql, params, headers):
+    """Generator các khối CSV (UTF-8 có BOM để Excel đọc đúng tiếng Việt); đóng kết nối khi xong.
+
+    Nếu generator không bao giờ được chạy, route cần đăng ký thêm response.call_on_close(conn.close).
+    """
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(headers)
+        yield '\ufeff' + buffer.getvalue()
+        for rows in iter_rows(conn, sql, params):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            yield buffer.getvalue()
+    finally:
+        conn.close()
+
+
+def write_xlsx(conn, sql, params, headers, sheet_name):
+    """Ghi ra file tạm bằng workbook write-only; trả về file đã seek(0) (tự xóa khi đóng). Đóng kết nối khi xong"""
+    try:
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(sheet_name)
+        ws.append(headers)
+        for rows in iter_rows(conn, sql, params):
+            for row in rows:
+                ws.append(row)
+    finally:
+        conn.close()
+    output = tempfile.TemporaryFile()
+    wb.save(output)
+    output.seek(0)
+    return output
@@ -0,0 +1,29 @@
+"""Phần dùng chung của các job import file Excel/CSV: gom lỗi theo dòng và thông báo kết quả"""
+import numpy as np
+
+MAX_REJECTS_SHOWN = 30
+
+
+def reject_rows(checks, n):
+    """checks: [(mask theo dòng, lý do), ...] -> (mảng bool các dòng lỗi, ['Dòng x: lý do, ...'])"""
+    bad = np.zeros(n, dtype=bool)
+    reasons = [[] for _ in range(n)]
+    for mask, reason in checks:
+        mask = np.asarray(mask, dtype=bool)
+        bad |= mask
+        for i in np.flatnonzero(mask):
+            reasons[i].append(reason)
+
+    # Số dòng trong file Excel (dòng 1 là tiêu đề)
+    rejects = [f"Dòng {i + 2}: {', '.join(reasons[i])}" for i in np.flatnonzero(bad)]
+    return bad, rejects
+
+
+def result_message(message, rejects, written):
+    """Thêm các dòng bị bỏ qua (tối đa MAX_REJECTS_SHOWN) vào thông báo; trả về (thông báo, loại)"""
+    if not rejects:
+        return message, "success"
+    shown = rejects[:MAX_REJECTS_SHOWN]
+    more = f" ... và {len(rejects) - len(shown)} dòng khác" if len(rejects) > len(shown) else ""
+    message += f" Bỏ qua {len(rejects)} dòng: " + "; ".join(shown) + more
+    return message, "warning" if written else "danger"
@@ -0,0 +1,126 @@
+"""Import Inbound hàng loạt từ file Packing List Excel/CSV (chạy trong job nền)"""
+import pandas as pd
+
+import pagination
+import typeahead
+from db import insert_batches, select_in
+from import_utils import reject_rows, result_message
+from outbound_import import read_file
+
+# Tên cột chấp nhận trong file (không phân biệt hoa thường)
+COLUMN_ALIASES = {
+    'packing': ['packinglistno', 'packing list', 'packing list no', 'packing', 'packing number'],
+    'po': ['po', 'po number', 'ppo', 'parentpo', 'parent po'],
+    'sku': ['sku', 'item', 'mã hàng'],
+    'carton': ['carton', 'cartons', 'ctns', 'qty', 'quantity', 'số lượng', 'số kiện'],
+    'container': ['container', 'cont/xe', 'contxe', 'cont', 'xe'],
+    'date': ['date', 'datercv', 'ngày nhập', 'ngày'],
+    'labour': ['labour', 'labor', 'nhân công'],
+}
+LABOURS = {'insource': 'Insource', 'outsource': 'Outsource'}
+
+INSERT_SQL = "INSERT INTO inbound (MANCC, po, sku, carton, contxe, datercv, cbm, labour, PackinglistNo) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"
+
+# Truy vấn dùng trong route của app.py (migrations.py check EXPLAIN đúng các câu này)
+PO_IMPORTED_SQL = "SELECT SUM(carton) FROM inbound WHERE po = %s"
+# Tham số: (po, po, po)
+PO_CONTEXT_SQL = """
+    SELECT b.item,
+           SUM(b.qty) AS qty,
+           MAX(b.cbm) AS cbm,
+           COALESCE(MAX(n.TENNCC), MAX(b.supplier)) AS supplier,
+           COALESCE(MAX(i.imported), 0) AS imported,
+           (SELECT COALESCE(SUM(carton), 0) FROM inbound WHERE po = %s) AS po_imported
+    FROM bbrreport b
+    LEFT JOIN nhacungcap n ON n.MANCC = b.supplier
+    LEFT JOIN (SELECT sku, SUM(carton) AS imported FROM inbound WHERE po = %s GROUP BY sku) i ON i.sku = b.item
+    WHERE b.parentpo = %s
+    GROUP BY b.item
+    ORDER BY b.item
+"""
+PACKINGLIST_SQL = """
+    SELECT i.*, n.TENNCC
+    FROM inbound i
+    LEFT JOIN nhacungcap n ON i.MANCC = n.MANCC
+    WHERE i.PackinglistNo = %s
+"""
+
+
+def normalize(df, defaults):
+    """Đổi tên cột theo COLUMN_ALIASES; cột thiếu lấy giá trị mặc định từ form"""
+    lookup = {str(c).strip().lower(): c for c in df.columns}
+    out = pd.DataFrame(index=df.index)
+    for field, aliases in COLUMN_ALIASES.items():
+        col = next((lookup[a] for a in aliases if a in lookup), None)
+        if col is not None:
+            out[field] = df[col].fillna('').astype(str).str.strip()
+        else:
+            out[field] = defaults.get(field) or ''
+    # Ô trống lấy mặc định của form (vd. ngày, container chung cho cả file)
+    for field, value in defaults.items():
+        if value:
+            out.loc[out[field] == '', field] = value
+    return out
+
+
+def lookup_skus(cursor, skus):
+    """Nhà cung cấp và CBM đơn vị cho tất cả SKU (một truy vấn cho mỗi 1000 SKU)"""
+    rows = select_in(cursor, """
+        SELECT b.item, MAX(b.supplier) AS supplier, MAX(b.cbm) AS cbm
+        FROM bbrreport b
+        WHERE b.item IN ({placeholders})
+        GROUP BY b.item
+    """, skus)
+    return {r['item']: (r['supplier'] or '', float(r['cbm'] or 0)) for r in rows}
+
+
+def validate(df, known):
+    """Trả về (các dòng hợp lệ, danh sách lỗi theo dòng trong file)"""
+    cartons = pd.to_numeric(df['carton'], errors='coerce')
+    # Ngày dạng ISO (yyyy-mm-dd, ô ngày Excel) trước, còn lại hiểu là dd/mm/yyyy
+    dates = pd.to_datetime(df['date'], errors='coerce', format='ISO8601')
+    dates = dates.fillna(pd.to_datetime(df['date'], errors='coerce', format='mixed', dayfirst=True))
+    labour = df['labour'].str.lower().map(LABOURS)
+
+    checks = [
+        (df['packing'] == '', "thiếu Packing List"),
+        (df['po'] == '', "thiếu PO"),
+        (df['sku'] == '', "thiếu SKU"),
+        (~df['sku'].isin(known) & (df['sku'] != ''), "SKU không có trong BBR"),
+        (cartons.isna() | (cartons <= 0), "số kiện không hợp lệ"),
+        (dates.isna(), "ngày nhập không hợp lệ"),
+        (labour.isna(), "nhân công phải là Insource/Outsource"),
+    ]
+    bad, rejects = reject_rows(checks, len(df))
+    ok = df[~bad].copy()
+    ok['carton'] = cartons[~bad]
+    ok['date'] = dates[~bad].dt.strftime('%Y-%m-%d')
+    ok['labour'] = labour[~bad]
+    return ok, rejects
+
+
+def import_job(conn, job, files, packing=None, date=None, container=None, labour=None):
+    path, filename = files[0]
+    df = read_file(path, filename).reset_index(drop=True)
+    df = normalize(df, {'packing': packing, 'date': date, 'container': container, 'labour': labour})
+    job.progress(parsed=len(df))
+
+    cursor = conn.cursor(dictionary=True)
+    info = lookup_skus(cursor, df['sku'].unique())
+    ok, rejects = validate(df, list(info))
+
+    inserted = 0
+    if len(ok):
+        supplier = ok['sku'].map(lambda s: info[s][0])
+        unit_cbm = ok['sku'].map(lambda s: info[s][1]).to_numpy(dtype=float)
+        ok['cbm'] = unit_cbm * ok['carton'].to_numpy(dtype=float)
+        rows = list(zip(supplier, ok['po'], ok['sku'], ok['carton'].astype(float), ok['container'],
+                        ok['date'], ok['cbm'].astype(float), ok['labour'], ok['packing']))
+        insert_batches(cursor, INSERT_SQL, rows, on_batch=lambda n: job.progress(written=n))
+        pagination.invalidate(cursor, 'inbound')
+        conn.commit()
+        typeahead.add('inbound_container', ok['container'].unique())
+        inserted = len(rows)
+
+    message = f"Đã import {inserted}/{len(df)} dòng Inbound từ {filename}."
+    return result_message(message, rejects, inserted)
@@ -0,0 +1,329 @@
+"""Chạy import file trong nền (không giữ gunicorn worker trong suốt quá trình xử lý).
+
+File upload được lưu vào thư mục spool, job được ghi vào bảng import_jobs và chạy trên
+thread pool của worker. Mỗi loại import (bbr, inbound, outbound, scanfile, masterdata) chỉ
+chạy một job tại một thời điểm: trong một worker các job cùng loại xếp hàng và chạy lần lượt
+trên một thread; giữa các gunicorn worker dùng MySQL GET_LOCK không chờ. Khi worker khác đang
+giữ khóa, job được thử lại sau LOCK_RETRY giây, trong lúc chờ không giữ thread hay kết nối.
+
+Hàng đợi chỉ nằm trong bộ nhớ của worker. Khi thread pool được tạo (worker mới khởi động),
+các job queued/running của worker đã chết trên cùng host (và job mọi host quá STALE_AFTER
+giây không cập nhật) được đánh dấu lỗi, file spool không thuộc worker nào còn sống bị xóa.
+"""
+import os
+import socket
+import tempfile
+import threading
+import traceback
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.utils import secure_filename
+
+from db import get_db_connection, get_dedicated_connection
+
+SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or os.path.join(tempfile.gettempdir(), 'wms_uploads')
+LOCK_TIMEOUT = 3600  # Số giây tối đa chờ job cùng loại (ở worker khác) chạy xong
+LOCK_RETRY = 5       # Số giây giữa hai lần thử lấy khóa khi worker khác đang chạy job cùng loại
+STALE_AFTER = 2 * LOCK_TIMEOUT  # Job queued/running không cập nhật quá số giây này coi như đã mất
+HOST = socket.gethostname()[:64]
+
+_executor = None
+_executor_pid = None
+_worker = None  # Mã của worker hiện tại (đổi mỗi lần tạo thread pool), ghi vào import_jobs và tên file spool
+_executor_lock = threading.Lock()
+
+_queues = {}     # kind -> deque các job chờ chạy trong worker này
+_active = set()  # kind đang có thread xử lý hàng đợi
+_queue_lock = threading.Lock()
+
+
+def _get_executor():
+    # Tạo thread pool sau khi gunicorn fork worker
+    global _executor, _executor_pid, _worker
+    created = False
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            with _queue_lock:
+                _queues.clear()
+                _active.clear()
+            _executor = ThreadPoolExecutor(max_workers=int(os.getenv("IMPORT_WORKERS") or 2),
+                                           thread_name_prefix='import')
+            _executor_pid = os.getpid()
+            _worker = uuid.uuid4().hex
+            _register_worker()
+            created = True
+    if created:
+        try:
+            recover()
+        except Exception:
+            traceback.print_exc()
+    return _executor
+
+
+def _pid_file(pid):
+    return os.path.join(SPOOL_DIR, f".worker-{pid}")
+
+
+def _register_worker():
+    """Ghi mã worker vào SPOOL_DIR/.worker-<pid> để worker khác trên host biết worker này còn sống"""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    tmp = _pid_file(os.getpid()) + ".tmp"
+    with open(tmp, 'w') as f:
+        f.write(_worker)
+    os.replace(tmp, _pid_file(os.getpid()))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _live_workers():
+    """Mã các worker còn sống trên host này (xóa file .worker-<pid> của process đã thoát)"""
+    live = {_worker}
+    for name in os.listdir(SPOOL_DIR):
+        if not name.startswith('.worker-') or not name[len('.worker-'):].isdigit():
+            continue
+        pid = int(name[len('.worker-'):])
+        path = os.path.join(SPOOL_DIR, name)
+        try:
+            if pid == os.getpid():
+                continue
+            if _pid_alive(pid):
+                with open(path) as f:
+                    live.add(f.read().strip())
+            else:
+                os.remove(path)
+        except OSError:
+            pass
+    return live
+
+
+def mark_stale(cursor, host, live, before=None):
+    """Đánh dấu lỗi các job queued/running đã mất worker; trả về số job.
+
+    Job của host này mà worker không còn trong live, và job của mọi host quá STALE_AFTER giây
+    không cập nhật. before (giờ của DB) bỏ qua job tạo sau thời điểm đó (worker vừa khởi động
+    song song có thể chưa kịp ghi file .worker-<pid>).
+    """
+    placeholders = ", ".join(["%s"] * len(live))
+    sql = f"""
+        UPDATE import_jobs
+        SET status = 'error', category = 'danger', updated_at = NOW(),
+            message = 'Worker xử lý job đã dừng (khởi động lại), vui lòng import lại file'
+        WHERE status IN ('queued', 'running')
+          AND (((host = %s OR host IS NULL) AND (worker IS NULL OR worker NOT IN ({placeholders})))
+               OR updated_at < NOW() - INTERVAL %s SECOND)
+    """
+    params = [host, *live, STALE_AFTER]
+    if before is not None:
+        sql += " AND created_at < %s"
+        params.append(before)
+    cursor.execute(sql, params)
+    return cursor.rowcount
+
+
+def _remove_orphans(live, before):
+    """Xóa file spool không thuộc worker nào còn sống (tên file bắt đầu bằng mã worker)"""
+    for name in os.listdir(SPOOL_DIR):
+        if name.startswith('.') or name.split('_', 1)[0] in live:
+            continue
+        path = os.path.join(SPOOL_DIR, name)
+        try:
+            if os.path.getmtime(path) < before:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def recover():
+    """Dọn job và file spool bị bỏ lại khi worker trước đó dừng giữa chừng"""
+    started = time.time()
+    conn = get_dedicated_connection()
+    if not conn:
+        return
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT NOW()")
+        before = cursor.fetchone()[0]
+        live = _live_workers()
+        stale = mark_stale(cursor, HOST, live, before)
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+    _remove_orphans(live, started)
+    if stale:
+        print(f"⚠️  Đã đánh dấu lỗi {stale} job import bị bỏ dở")
+
+
+class Job:
+    """Trạng thái một job import; cập nhật qua kết nối riêng (commit ngay) để trang có thể poll"""
+
+    def __init__(self, job_id, kind):
+        self.id = job_id
+        self.kind = kind
+        self.rows_parsed = 0
+        self.rows_written = 0
+        self.queued_at = time.monotonic()
+        self._conn = None
+
+    def _update(self, **fields):
+        if self._conn is None:
+            self._conn = get_db_connection()
+            if not self._conn:
+                return
+        sets = ", ".join(f"{k} = %s" for k in fields)
+        cursor = self._conn.cursor()
+        cursor.execute(f"UPDATE import_jobs SET {sets}, updated_at = NOW() WHERE id = %s",
+                       list(fields.values()) + [self.id])
+        self._conn.commit()
+        cursor.close()
+
+    def progress(self, parsed=None, written=None):
+        """Cộng dồn số dòng đã đọc / đã ghi"""
+        if parsed:
+            self.rows_parsed += parsed
+        if written:
+            self.rows_written += written
+        self._update(rows_parsed=self.rows_parsed, rows_written=self.rows_written)
+
+    def start(self):
+        self._update(status='running')
+
+    def finish(self, status, message, category):
+        self._update(status=status, message=message, category=category)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def save_upload(file):
+    """Lưu file upload vào spool, trả về (đường dẫn, tên file gốc)"""
+    _get_executor()
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    name = f"{_worker}_{uuid.uuid4().hex}_{secure_filename(file.filename) or 'upload'}"
+    path = os.path.join(SPOOL_DIR, name)
+    file.save(path)
+    return path, file.filename
+
+
+def submit(conn, kind, files, handler, **params):
+    """Lưu file và đưa job vào hàng đợi; trả về job id.
+
+    handler(conn, job, files, **params) -> (message, category), trong đó files là list
+    (đường dẫn, tên file gốc).
+    """
+    _get_executor()
+    saved = [save_upload(f) for f in files if f and f.filename]
+    job_id = uuid.uuid4().hex
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO import_jobs (id, kind, status, filename, host, worker) VALUES (%s, %s, 'queued', %s, %s, %s)",
+                   (job_id, kind, ", ".join(name for _, name in saved)[:255], HOST, _worker))
+    conn.commit()
+    cursor.close()
+    with _queue_lock:
+        _queues.setdefault(kind, deque()).append((Job(job_id, kind), saved, handler, params))
+    _schedule(kind)
+    return job_id
+
+
+def _schedule(kind):
+    """Giao hàng đợi của kind cho một thread nếu chưa có thread nào xử lý"""
+    with _queue_lock:
+        if kind in _active or not _queues.get(kind):
+            return
+        _active.add(kind)
+    _get_executor().submit(_drain, kind)
+
+
+def _drain(kind):
+    """Chạy lần lượt các job cùng loại; nhả thread khi hết job hoặc khi worker khác giữ khóa"""
+    while True:
+        with _queue_lock:
+            if not _queues.get(kind):
+                _active.discard(kind)
+                return
+            entry = _queues[kind][0]
+        try:
+            done = _run(*entry)
+        except Exception:
+            traceback.print_exc()
+            done = True
+        if not done:
+            with _queue_lock:
+                _active.discard(kind)
+            timer = threading.Timer(LOCK_RETRY, _schedule, (kind,))
+            timer.daemon = True
+            timer.start()
+            return
+        with _queue_lock:
+            _queues[kind].popleft()
+
+
+def _run(job, files, handler, params):
+    """Chạy một job; False nếu worker khác đang chạy job cùng loại (job ở lại đầu hàng đợi)"""
+    conn = get_db_connection()
+    lock_name = f"wms_import_{job.kind}"
+    locked = False
+    waiting = False
+    try:
+        if not conn:
+            job.finish('error', "Lỗi kết nối Database", 'danger')
+            return True
+        cursor = conn.cursor()
+        cursor.execute("SELECT GET_LOCK(%s, 0)", (lock_name,))
+        locked = cursor.fetchone()[0] == 1
+        cursor.close()
+        if not locked:
+            if time.monotonic() - job.queued_at < LOCK_TIMEOUT:
+                waiting = True
+                return False
+            job.finish('error', "Hết thời gian chờ job import khác cùng loại", 'danger')
+            return True
+        job.start()
+        message, category = handler(conn, job, files, **params)
+        job.finish('done', message, category)
+        return True
+    except Exception as e:
+        traceback.print_exc()
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        job.finish('error', f"Lỗi xử lý file: {e}", 'danger')
+        return True
+    finally:
+        if conn:
+            if locked:
+                cursor = conn.cursor()
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (lock_name,))
+                cursor.fetchall()
+                cursor.close()
+            conn.close()
+        job.close()
+        if not waiting:
+            for path, _ in files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def get_job(cursor, job_id):
+    cursor.execute("""
+        SELECT id, kind, status, filename, rows_parsed, rows_written, message, category, created_at, updated_at
+        FROM import_jobs WHERE id = %s
+    """, (job_id,))
+    return cursor.fetchone()
+
@@ -0,0 +1,140 @@
+"""Ước tính pallet và container (dùng chung cho BBR, Picking List và API load plan)"""
+import numpy as np
+
+# CBM quy đổi một pallet theo loại
+PALLET_CBM = {'1m2': 3.06, '1m6': 4.08, '1m9': 4.85}
+DEFAULT_KIND = '1m2'
+
+# Hệ số pallet dùng trên trang BBR (CBM / CBM pallet × 1.5)
+BBR_PALLET_FACTOR = 1.5
+
+# Dung tích xếp hàng thực tế (CBM) và tải trọng tối đa (kg) theo loại container
+CONTAINERS = {
+    '20': {'cbm': 28.0, 'kg': 28000},
+    '40': {'cbm': 58.0, 'kg': 26500},
+    '40HC': {'cbm': 68.0, 'kg': 26500},
+}
+
+
+def pallets_by_cbm(cbm, kind=DEFAULT_KIND):
+    """Số pallet ước tính từ CBM (vô hướng hoặc mảng)"""
+    divisor = PALLET_CBM.get(kind, PALLET_CBM[DEFAULT_KIND])
+    return np.asarray(cbm, dtype=float) / divisor
+
+
+def estimate_pallets(cartons, cartonperpallet, cbm, kind):
+    """Số pallet cho từng dòng SKU.
+
+    Ưu tiên cartonperpallet của masterdata (làm tròn lên), nếu không có thì ước tính
+    theo CBM / CBM pallet của kindpallet. Trả về (pallets, by_carton) với by_carton là
+    mảng bool cho biết dòng nào tính theo cartonperpallet.
+    """
+    cartons = np.asarray(cartons, dtype=float)
+    cpp = np.nan_to_num(np.asarray(cartonperpallet, dtype=float), nan=0.0)
+    cbm = np.nan_to_num(np.asarray(cbm, dtype=float), nan=0.0)
+    kind = np.asarray(kind, dtype=object)
+
+    divisor = np.full(len(cbm), PALLET_CBM[DEFAULT_KIND])
+    for name, value in PALLET_CBM.items():
+        divisor[kind == name] = value
+
+    by_carton = cpp > 0
+    pallets = np.where(by_carton, np.ceil(cartons / np.where(by_carton, cpp, 1)), cbm / divisor)
+    return pallets, by_carton
+
+
+def split_oversized(volumes, weights, max_cbm, max_kg):
+    """Tách các dòng lớn hơn sức chứa một container thành nhiều phần bằng nhau"""
+    volumes = np.asarray(volumes, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    parts = np.maximum(np.ceil(np.maximum(volumes / max_cbm, weights / max_kg)), 1).astype(int)
+    line = np.repeat(np.arange(len(volumes)), parts)
+    return (np.repeat(volumes / parts, parts), np.repeat(weights / parts, parts), line)
+
+
+def first_fit_decreasing(volumes, weights, max_cbm, max_kg):
+    """Xếp các kiện vào container theo First-Fit Decreasing (theo CBM, kiểm tra cả tải trọng).
+
+    Trả về (bin của từng phần tử, CBM đã xếp mỗi container, kg đã xếp mỗi container).
+    Phần tử lớn hơn một container cần được tách trước bằng split_oversized.
+    """
+    volumes = np.asarray(volumes, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    n = len(volumes)
+    assignment = np.full(n, -1, dtype=int)
+    used_cbm = np.zeros(max(n, 1))
+    used_kg = np.zeros(max(n, 1))
+    bins = 0
+
+    for i in np.argsort(-volumes, kind='stable'):
+        v, w = volumes[i], weights[i]
+        fits = np.flatnonzero((used_cbm[:bins] + v <= max_cbm + 1e-9) & (used_kg[:bins] + w <= max_kg + 1e-9))
+        b = fits[0] if len(fits) else bins
+        if b == bins:
+            bins += 1
+        used_cbm[b] += v
+        used_kg[b] += w
+        assignment[i] = b
+    return assignment, used_cbm[:bins], used_kg[:bins]
+
+
+def plan_containers(volumes, weights, container_types=None):
+    """Số container cần cho từng loại (20', 40', 40HC) và tỷ lệ lấp đầy"""
+    result = {}
+    for name in container_types or CONTAINERS:
+        spec = CONTAINERS[name]
+        vol, kg, _ = split_oversized(volumes, weights, spec['cbm'], spec['kg'])
+        _, used_cbm, used_kg = first_fit_decreasing(vol, kg, spec['cbm'], spec['kg'])
+        count = len(used_cbm)
+        result[name] = {
+            'containers': count,
+            'cbm_per_container': [round(float(x), 3) for x in used_cbm],
+            'kg_per_container': [round(float(x), 1) for x in used_kg],
+            'fill_pct': round(float(used_cbm.sum() / (count * spec['cbm']) * 100), 1) if count else 0,
+        }
+    return result
+
+
+def plan_job(cursor, jobno):
+    """Load plan cho một Job No: pallet theo SKU/FDC và số container theo FFD"""
+    cursor.execute("""
+        SELECT o.sku, o.fdc, o.carton, o.cbm, COALESCE(NULLIF(o.kindpallet, ''), m.kindpallet) AS kindpallet,
+               m.cartonperpallet, m.weight
+        FROM outbound o LEFT JOIN masterdata m ON m.sku = o.sku
+        WHERE o.jobno = %s
+    """, (jobno,))
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+
+    cartons = np.array([float(r['carton'] or 0) for r in rows])
+    cbm = np.array([float(r['cbm'] or 0) for r in rows])
+    weight = cartons * np.array([float(r['weight'] or 0) for r in rows])
+    cpp = np.array([float(r['cartonperpallet'] or 0) for r in rows])
+    kind = np.array([r['kindpallet'] or DEFAULT_KIND for r in rows], dtype=object)
+    pallets, by_carton = estimate_pallets(cartons, cpp, cbm, kind)
+
+    skus = {}
+    fdcs = {}
+    for r, p, c, v, bc in zip(rows, pallets, cartons, cbm, by_carton):
+        s = skus.setdefault(r['sku'], {'sku': r['sku'], 'cartons': 0.0, 'cbm': 0.0, 'pallets': 0.0, 'by_carton': bool(bc)})
+        s['cartons'] += c
+        s['cbm'] += v
+        s['pallets'] += p
+        f = fdcs.setdefault(r['fdc'] or 'Khác', {'fdc': r['fdc'] or 'Khác', 'cartons': 0.0, 'cbm': 0.0, 'pallets': 0.0})
+        f['cartons'] += c
+        f['cbm'] += v
+        f['pallets'] += p
+
+    return {
+        'jobno': jobno,
+        'lines': len(rows),
+        'total_cartons': float(cartons.sum()),
+        'total_cbm': round(float(cbm.sum()), 3),
+        'total_kg': round(float(weight.sum()), 1),
+        'total_pallets': round(float(pallets.sum()), 2),
+        'pallets_by_cbm': {kind: round(float(pallets_by_cbm(cbm.sum(), kind)), 2) for kind in PALLET_CBM},
+        'skus': [dict(s, cbm=round(s['cbm'], 3), pallets=round(s['pallets'], 2)) for s in skus.values()],
+        'fdcs': [dict(f, cbm=round(f['cbm'], 3), pallets=round(f['pallets'], 2)) for f in fdcs.values()],
+        'containers': plan_containers(cbm, weight),
+    }
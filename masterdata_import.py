@@ -0,0 +1,110 @@
+"""Import / cập nhật Master Data hàng loạt từ file Excel/CSV (chạy trong job nền)"""
+import numpy as np
+import pandas as pd
+
+import pagination
+import refdata
+import typeahead
+from db import insert_batches, unique_key_exists
+from import_utils import reject_rows, result_message
+from outbound_import import read_file
+
+# Tên cột chấp nhận trong file (không phân biệt hoa thường)
+COLUMN_ALIASES = {
+    'sku': ['sku', 'item', 'mã hàng'],
+    'MANCC': ['mancc', 'supplier', 'supplier code', 'mã ncc', 'ncc'],
+    'description': ['description', 'desc', 'mô tả'],
+    'quantity': ['quantity', 'qty', 'pcs', 'số pcs'],
+    'weight': ['weight', 'kg', 'trọng lượng'],
+    'length': ['length', 'l', 'dài'],
+    'width': ['width', 'w', 'rộng'],
+    'height': ['height', 'h', 'cao'],
+    'refix': ['refix'],
+    'loosecase': ['loosecase', 'loose case'],
+    'kindpallet': ['kindpallet', 'kind pallet', 'loại pallet'],
+    'cartonperpallet': ['cartonperpallet', 'carton/pallet', 'carton per pallet'],
+    'remark': ['remark', 'ghi chú'],
+}
+REQUIRED = ['sku', 'MANCC', 'length', 'width', 'height']
+DIMENSIONS = ['length', 'width', 'height']
+NUMERIC = ['quantity', 'weight', 'cartonperpallet']
+INTEGER = ['quantity', 'cartonperpallet']
+
+
+def normalize(df):
+    """Đổi tên cột theo COLUMN_ALIASES; chỉ giữ các cột có trong file"""
+    lookup = {str(c).strip().lower(): c for c in df.columns}
+    out = pd.DataFrame(index=df.index)
+    for field, aliases in COLUMN_ALIASES.items():
+        col = next((lookup[a] for a in aliases if a in lookup), None)
+        if col is not None:
+            out[field] = df[col].fillna('').astype(str).str.strip()
+    return out
+
+
+def validate(df, suppliers):
+    """Trả về (các dòng hợp lệ đã có cbm, danh sách lỗi theo dòng trong file)"""
+    numbers = {c: pd.to_numeric(df[c], errors='coerce') for c in DIMENSIONS + NUMERIC if c in df}
+    checks = [
+        (df['sku'] == '', "thiếu SKU"),
+        (df['sku'].duplicated() & (df['sku'] != ''), "SKU lặp trong file"),
+        (~df['MANCC'].isin(suppliers), "MANCC không có trong danh sách nhà cung cấp"),
+    ]
+    for c in DIMENSIONS:
+        checks.append((numbers[c].isna() | (numbers[c] < 0), f"{c} không phải số hợp lệ"))
+    for c in NUMERIC:
+        if c in numbers:
+            checks.append(((df[c] != '') & numbers[c].isna(), f"{c} không phải số"))
+
+    bad, rejects = reject_rows(checks, len(df))
+    ok = df[~bad].copy()
+    dims = np.column_stack([numbers[c][~bad].to_numpy(dtype=float) for c in DIMENSIONS])
+    for i, c in enumerate(DIMENSIONS):
+        ok[c] = dims[:, i]
+    # CBM = Dài x Rộng x Cao (cm) / 1.000.000, tính cho cả file một lần
+    ok['cbm'] = dims.prod(axis=1) / 1000000
+    for c in NUMERIC:
+        if c in numbers:
+            ok[c] = numbers[c][~bad].round() if c in INTEGER else numbers[c][~bad]
+    # Kiểu Python (float/str/None) cho mysql-connector; ô số trống -> NULL
+    return ok.astype(object).where(ok.notna(), None), rejects
+
+
+def upsert_sql(columns):
+    """INSERT ... ON DUPLICATE KEY UPDATE cho các cột có trong file (cột khác giữ nguyên).
+
+    Cần UNIQUE KEY / PRIMARY KEY trên masterdata.sku (migration 14); import_job kiểm tra trước.
+    """
+    updates = ", ".join(f"{c} = VALUES({c})" for c in columns if c != 'sku')
+    return (f"INSERT INTO masterdata ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON DUPLICATE KEY UPDATE {updates}")
+
+
+def import_job(conn, job, files):
+    path, filename = files[0]
+    df = normalize(read_file(path, filename).reset_index(drop=True))
+    job.progress(parsed=len(df))
+
+    missing = [c for c in REQUIRED if c not in df]
+    if missing:
+        return f"File {filename} thiếu cột: {', '.join(missing)}", "danger"
+
+    cursor = conn.cursor(dictionary=True)
+    if not unique_key_exists(cursor, 'masterdata', 'sku'):
+        # Không có khóa thì ON DUPLICATE KEY UPDATE sẽ thêm dòng trùng thay vì cập nhật
+        return "Bảng masterdata chưa có UNIQUE KEY trên sku: chạy 'python migrations.py upgrade' trước khi import.", "danger"
+    ok, rejects = validate(df, list(refdata.suppliers(cursor)))
+
+    written = 0
+    if len(ok):
+        columns = list(ok.columns)
+        values = list(zip(*(ok[c].tolist() for c in columns)))
+        insert_batches(cursor, upsert_sql(columns), values, on_batch=lambda n: job.progress(written=n))
+        refdata.bump(cursor, 'masterdata')
+        pagination.invalidate(cursor, 'masterdata')
+        conn.commit()
+        typeahead.add('sku', ok['sku'].unique())
+        written = len(values)
+
+    message = f"Đã thêm/cập nhật {written}/{len(df)} SKU Master Data từ {filename}."
+    return result_message(message, rejects, written)
@@ -0,0 +1,722 @@
+"""Quản lý schema database (tạo bảng, index) theo version.
+
+Cách dùng:
+    python migrations.py upgrade   # Áp dụng các migration chưa chạy
+    python migrations.py status    # Xem version hiện tại
+    python migrations.py check     # EXPLAIN các truy vấn của app, báo lỗi nếu có full table scan
+    python migrations.py rebuild-summary   # Tính lại toàn bộ bảng tổng hợp BBR theo tuần
+    python migrations.py rebuild-pallet-ledger   # Tính lại sổ tồn pallet theo ngày
+"""
+import argparse
+import os
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
+
+import bbr_report  # noqa: E402
+import pallet_ledger  # noqa: E402
+from db import get_db_connection, unique_key_exists  # noqa: E402
+
+
+# === HELPERS ===
+def index_exists(cursor, table, name):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """, (table, name))
+    return cursor.fetchone() is not None
+
+
+def column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        LIMIT 1
+    """, (table, column))
+    return cursor.fetchone() is not None
+
+
+def create_index(table, name, columns, kind='', options=''):
+    """Bước migration tạo index nếu chưa có (MySQL không hỗ trợ CREATE INDEX IF NOT EXISTS)"""
+    def step(cursor):
+        if not index_exists(cursor, table, name):
+            cursor.execute(f"CREATE {kind} INDEX `{name}` ON `{table}` ({columns}) {options}")
+    step.__doc__ = f"INDEX {name} ON {table}({columns})"
+    return step
+
+
+def fulltext_index(table, name, columns, rebuild=False):
+    """Bước migration tạo FULLTEXT (ngram) không dùng stopword.
+
+    Stopword mặc định của InnoDB ('a', 'i', 'in', 'to'...) loại mọi token ngram có chứa chúng,
+    nên các từ khóa như 'an', 'ai' không bao giờ khớp. Danh sách stopword được chốt lúc tạo
+    index, vì vậy tắt innodb_ft_enable_stopword trong session khi tạo. rebuild=True xóa index
+    đã có (tạo trước khi có bước này) rồi tạo lại.
+    """
+    def step(cursor):
+        if index_exists(cursor, table, name):
+            if not rebuild:
+                return
+            cursor.execute(f"DROP INDEX `{name}` ON `{table}`")
+        cursor.execute("SET SESSION innodb_ft_enable_stopword = 0")
+        try:
+            cursor.execute(f"CREATE FULLTEXT INDEX `{name}` ON `{table}` ({columns}) WITH PARSER ngram")
+        finally:
+            cursor.execute("SET SESSION innodb_ft_enable_stopword = DEFAULT")
+    step.__doc__ = f"FULLTEXT {name} ON {table}({columns})"
+    return step
+
+
+def add_column(table, column, definition):
+    """Bước migration thêm cột nếu chưa có"""
+    def step(cursor):
+        if not column_exists(cursor, table, column):
+            cursor.execute(f"ALTER TABLE `{table}` ADD COLUMN `{column}` {definition}")
+    step.__doc__ = f"COLUMN {table}.{column}"
+    return step
+
+
+class MigrationError(Exception):
+    """Migration không thể tự chạy tiếp: cần người vận hành xử lý dữ liệu trước"""
+
+
+MAX_DUPLICATES_SHOWN = 50
+
+
+def unique_masterdata_sku(cursor):
+    """UNIQUE KEY trên masterdata.sku (import Master Data upsert theo khóa này).
+
+    Database cũ có thể tạo bảng không có khóa chính và đã có SKU lặp. Không tự chọn dòng nào
+    giữ lại: dừng migration và liệt kê các SKU lặp để xử lý tay, rồi chạy lại upgrade.
+    """
+    if unique_key_exists(cursor, 'masterdata', 'sku'):
+        return
+    cursor.execute("""
+        SELECT sku, COUNT(*) FROM masterdata WHERE sku IS NOT NULL
+        GROUP BY sku HAVING COUNT(*) > 1 ORDER BY sku
+    """)
+    duplicates = cursor.fetchall()
+    if duplicates:
+        shown = ", ".join(f"{sku!r} ({n} dòng)" for sku, n in duplicates[:MAX_DUPLICATES_SHOWN])
+        more = f" ... và {len(duplicates) - MAX_DUPLICATES_SHOWN} SKU khác" if len(duplicates) > MAX_DUPLICATES_SHOWN else ""
+        raise MigrationError(f"masterdata có {len(duplicates)} SKU lặp, cần xóa/gộp trước khi thêm UNIQUE KEY: "
+                             f"{shown}{more}")
+    cursor.execute("ALTER TABLE masterdata ADD UNIQUE KEY uq_masterdata_sku (sku)")
+
+
+# === MIGRATIONS ===
+# Mỗi migration: (version, mô tả, danh sách bước). Bước là câu SQL hoặc hàm nhận cursor.
+# Mọi bước phải idempotent để chạy lại an toàn trên database đã có sẵn bảng.
+MIGRATIONS = [
+    (1, "Tạo các bảng nghiệp vụ", [
+        """CREATE TABLE IF NOT EXISTS nhacungcap (
+            MANCC VARCHAR(50) NOT NULL PRIMARY KEY,
+            TENNCC VARCHAR(255),
+            QG VARCHAR(50)
+        )""",
+        """CREATE TABLE IF NOT EXISTS masterdata (
+            sku VARCHAR(100) NOT NULL PRIMARY KEY,
+            MANCC VARCHAR(50),
+            description VARCHAR(255),
+            quantity INT,
+            weight DOUBLE,
+            length DOUBLE,
+            width DOUBLE,
+            height DOUBLE,
+            cbm DOUBLE,
+            refix VARCHAR(50),
+            loosecase VARCHAR(10),
+            kindpallet VARCHAR(10),
+            cartonperpallet INT,
+            remark VARCHAR(255)
+        )""",
+        """CREATE TABLE IF NOT EXISTS bbrreport (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            keycheck VARCHAR(255),
+            origin VARCHAR(20),
+            PO VARCHAR(100),
+            item VARCHAR(100),
+            supplier VARCHAR(50),
+            parentpo VARCHAR(100),
+            deliverydate DATE,
+            qty DOUBLE,
+            cbm DOUBLE,
+            week INT,
+            kindpallet VARCHAR(10),
+            total_cbm DOUBLE,
+            Status VARCHAR(50)
+        )""",
+        """CREATE TABLE IF NOT EXISTS inbound (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            MANCC VARCHAR(50),
+            po VARCHAR(100),
+            sku VARCHAR(100),
+            carton DOUBLE,
+            contxe VARCHAR(100),
+            datercv DATE,
+            cbm DOUBLE,
+            labour VARCHAR(50),
+            PackinglistNo VARCHAR(100)
+        )""",
+        """CREATE TABLE IF NOT EXISTS outbound (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            jobno VARCHAR(100),
+            po VARCHAR(100),
+            parentpo VARCHAR(100),
+            sku VARCHAR(100),
+            carton DOUBLE,
+            datercv VARCHAR(20),
+            cbm DOUBLE,
+            childpo VARCHAR(100),
+            fdc VARCHAR(20),
+            remark VARCHAR(100),
+            loosecarton VARCHAR(10),
+            kindpallet VARCHAR(10),
+            container VARCHAR(100),
+            seal VARCHAR(100),
+            datestuff DATE,
+            customer VARCHAR(255)
+        )""",
+        """CREATE TABLE IF NOT EXISTS scanfile (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            jobno VARCHAR(100),
+            release_key VARCHAR(100),
+            sscc VARCHAR(100),
+            master_delivery VARCHAR(100),
+            qty DOUBLE,
+            master_ctl VARCHAR(100),
+            master_st_company VARCHAR(255),
+            master_add1 VARCHAR(255),
+            master_add2 VARCHAR(255),
+            master_add3 VARCHAR(255),
+            master_add4 VARCHAR(255),
+            ship_to VARCHAR(100),
+            st_zip VARCHAR(50),
+            barcode VARCHAR(100),
+            sku VARCHAR(100),
+            tag_label VARCHAR(5),
+            jobno_type VARCHAR(120),
+            pallet VARCHAR(50),
+            pallet_type VARCHAR(20),
+            time_scan DATETIME,
+            jobscan VARCHAR(100)
+        )""",
+        """CREATE TABLE IF NOT EXISTS pallet_management (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            date DATE,
+            pallet_type VARCHAR(10),
+            action VARCHAR(10),
+            quantity INT,
+            remark VARCHAR(255)
+        )""",
+    ]),
+    (2, "Index cho các truy vấn WHERE/GROUP BY của app", [
+        create_index('bbrreport', 'idx_bbr_keycheck_status', 'keycheck, Status'),
+        create_index('bbrreport', 'idx_bbr_item', 'item'),
+        create_index('bbrreport', 'idx_bbr_parentpo', 'parentpo'),
+        create_index('bbrreport', 'idx_bbr_week', 'week'),
+        create_index('inbound', 'idx_inbound_po', 'po'),
+        create_index('inbound', 'idx_inbound_packinglist', 'PackinglistNo'),
+        create_index('inbound', 'idx_inbound_datercv_labour', 'datercv, labour'),
+        create_index('inbound', 'idx_inbound_contxe', 'contxe'),
+        create_index('outbound', 'idx_outbound_jobno', 'jobno'),
+        create_index('outbound', 'idx_outbound_datercv', 'datercv'),
+        create_index('outbound', 'idx_outbound_container', 'container'),
+        create_index('scanfile', 'idx_scanfile_jobno_sku', 'jobno, sku'),
+        create_index('pallet_management', 'idx_pallet_date_id', 'date, id'),
+    ]),
+    (3, "Bảng tổng hợp BBR theo tuần", [
+        """CREATE TABLE IF NOT EXISTS bbr_weekly_summary (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            week INT,
+            parentpo VARCHAR(100),
+            supplier VARCHAR(50),
+            kindpallet VARCHAR(10),
+            chipboard_group VARCHAR(10),
+            qty DOUBLE NOT NULL DEFAULT 0,
+            total_cbm DOUBLE NOT NULL DEFAULT 0,
+            line_count INT NOT NULL DEFAULT 0,
+            KEY idx_bbr_summary_week (week, parentpo)
+        )""",
+        lambda cursor: bbr_report.refresh_summary(cursor),
+    ]),
+    (4, "FULLTEXT (ngram) cho tìm kiếm BBR", [
+        fulltext_index('bbrreport', 'ft_bbr_search', 'PO, item, parentpo, supplier'),
+        fulltext_index('nhacungcap', 'ft_nhacungcap_tenncc', 'TENNCC'),
+    ]),
+    (5, "Bảng theo dõi job import chạy nền", [
+        """CREATE TABLE IF NOT EXISTS import_jobs (
+            id CHAR(32) NOT NULL PRIMARY KEY,
+            kind VARCHAR(20) NOT NULL,
+            status VARCHAR(10) NOT NULL,
+            filename VARCHAR(255),
+            rows_parsed INT NOT NULL DEFAULT 0,
+            rows_written INT NOT NULL DEFAULT 0,
+            message TEXT,
+            category VARCHAR(10),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )""",
+    ]),
+    (6, "Index keyset cho phân trang Inbound", [
+        create_index('inbound', 'idx_inbound_datercv_id', 'datercv, id'),
+    ]),
+    (7, "Phiên bản dữ liệu cho cache in hàng loạt", [
+        """CREATE TABLE IF NOT EXISTS data_version (
+            name VARCHAR(150) NOT NULL PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )""",
+        create_index('outbound', 'idx_outbound_datestuff', 'datestuff'),
+    ]),
+    (8, "Index SSCC cho kiểm tra scan trùng", [
+        create_index('scanfile', 'idx_scanfile_jobno_sscc', 'jobno, sscc'),
+        create_index('scanfile', 'idx_scanfile_sscc', 'sscc'),
+    ]),
+    (9, "Sổ tồn pallet theo ngày", [
+        """CREATE TABLE IF NOT EXISTS pallet_daily_balance (
+            pallet_type VARCHAR(10) NOT NULL,
+            date DATE NOT NULL,
+            in_qty BIGINT NOT NULL DEFAULT 0,
+            out_qty BIGINT NOT NULL DEFAULT 0,
+            cum_in BIGINT NOT NULL DEFAULT 0,
+            cum_out BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (pallet_type, date)
+        )""",
+        lambda cursor: pallet_ledger.rebuild(cursor),
+    ]),
+    (10, "FULLTEXT (ngram) cho tìm kiếm Master Data", [
+        fulltext_index('masterdata', 'ft_masterdata_description', 'description'),
+    ]),
+    (11, "Lịch sử chạy báo cáo định kỳ (worker.py)", [
+        """CREATE TABLE IF NOT EXISTS report_runs (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            job VARCHAR(50) NOT NULL,
+            period_start DATE,
+            period_end DATE,
+            status VARCHAR(10) NOT NULL,
+            attempts INT NOT NULL DEFAULT 0,
+            message TEXT,
+            started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME,
+            INDEX idx_report_runs_job_period (job, period_end)
+        )""",
+    ]),
+    (12, "Scan máy cầm tay không ghi được (dead letter)", [
+        """CREATE TABLE IF NOT EXISTS scan_dead_letter (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            jobno VARCHAR(100),
+            sscc VARCHAR(100),
+            payload TEXT,
+            error VARCHAR(255),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_scan_dead_letter_jobno (jobno)
+        )""",
+    ]),
+    (13, "Index supplier của BBR cho nhánh tìm theo tên NCC", [
+        create_index('bbrreport', 'idx_bbr_supplier', 'supplier'),
+    ]),
+    (14, "UNIQUE KEY masterdata.sku", [
+        unique_masterdata_sku,
+    ]),
+    (15, "Tạo lại FULLTEXT tìm kiếm BBR không dùng stopword", [
+        fulltext_index('bbrreport', 'ft_bbr_search', 'PO, item, parentpo, supplier', rebuild=True),
+        fulltext_index('nhacungcap', 'ft_nhacungcap_tenncc', 'TENNCC', rebuild=True),
+    ]),
+    (16, "Tạo lại FULLTEXT mô tả Master Data không dùng stopword", [
+        fulltext_index('masterdata', 'ft_masterdata_description', 'description', rebuild=True),
+    ]),
+    (17, "Ghi host/worker của job import để dọn job mồ côi khi worker khởi động lại", [
+        add_column('import_jobs', 'host', 'VARCHAR(64)'),
+        add_column('import_jobs', 'worker', 'CHAR(32)'),
+        create_index('import_jobs', 'idx_import_jobs_status_host', 'status, host'),
+    ]),
+]
+
+
+def ensure_version_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT NOT NULL PRIMARY KEY,
+            description VARCHAR(255),
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def current_version(cursor):
+    ensure_version_table(cursor)
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+
+def upgrade(conn):
+    cursor = conn.cursor()
+    version = current_version(cursor)
+    applied = 0
+    for number, description, steps in MIGRATIONS:
+        if number <= version:
+            continue
+        print(f"➡️  Migration {number}: {description}")
+        for step in steps:
+            if callable(step):
+                step(cursor)
+            else:
+                cursor.execute(step)
+        cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)", (number, description))
+        conn.commit()
+        applied += 1
+    cursor.close()
+    print(f"✅ Schema ở version {max(version, MIGRATIONS[-1][0])} ({applied} migration mới)")
+
+
+def status(conn):
+    cursor = conn.cursor()
+    version = current_version(cursor)
+    cursor.close()
+    latest = MIGRATIONS[-1][0]
+    print(f"Version hiện tại: {version} / mới nhất: {latest}")
+    for number, description, _ in MIGRATIONS:
+        mark = '✅' if number <= version else '⏳'
+        print(f"  {mark} {number}: {description}")
+    return version == latest
+
+
+# === CHECK MODE ===
+# EXPLAIN chính các câu SQL mà app tạo ra: mỗi mục gọi hàm dựng truy vấn thật của module
+# (bbr_report, catalog, exports, ...) với ExplainCursor, nên truy vấn được kiểm tra luôn khớp
+# với code. Truy vấn theo khóa chính (WHERE id = %s, sku = %s, MANCC = %s) và các bước import
+# trên bảng tạm không được liệt kê.
+CHECK_MIN_ROWS = int(os.getenv("CHECK_MIN_ROWS") or 1000)  # Full scan ước tính từ số dòng này là lỗi
+
+
+class _Row(dict):
+    """Dòng giả cho fetchone(): cột nào cũng là 0 để code gọi chạy tiếp"""
+
+    def __missing__(self, key):
+        return 0
+
+
+class ExplainCursor:
+    """Cursor thay thế: chạy EXPLAIN thay cho câu lệnh, ghi lại (câu SQL, kế hoạch)"""
+
+    STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH', '(')
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.plans = []
+        self.rowcount = 0
+        self.lastrowid = None
+
+    def execute(self, sql, params=()):
+        if sql.lstrip().upper().startswith(self.STATEMENTS):
+            self._cursor.execute("EXPLAIN " + sql, params)
+            self.plans.append((sql, self._cursor.fetchall()))
+
+    def executemany(self, sql, seq_params):
+        for params in list(seq_params)[:1]:
+            self.execute(sql, params)
+
+    def fetchone(self):
+        return _Row()
+
+    def fetchall(self):
+        return []
+
+    def fetchmany(self, size=None):
+        return []
+
+    def close(self):
+        pass
+
+
+def _static(sql, params):
+    """Câu SQL dùng chung với route của app.py (hằng số trong module tương ứng)"""
+    return lambda c: c.execute(sql, params)
+
+
+def _export(query):
+    return lambda c: c.execute(*query[:2])
+
+
+def _check_list():
+    """[(tên, hàm(cursor), lý do được phép full scan hoặc None), ...]"""
+    from werkzeug.datastructures import MultiDict
+
+    import catalog
+    import exports
+    import inbound_import
+    import jobs
+    import loadplan
+    import outbound_import
+    import print_docs
+    import refdata
+    import reports
+    import scan_import
+    import scan_live
+    import typeahead
+    import versions
+
+    dates = MultiDict({'from_date': '2024-01-01', 'to_date': '2024-01-31'})
+    after = MultiDict({'from_date': '2024-01-01', 'page': '2', 'after': '2024-01-31|100',
+                       'd_page': '2', 'd_after': '2024-01-31|100'})
+    search = MultiDict({'q': 'LLR'})
+    history_rows = [{'pallet_type': '1m2', 'date': '2024-01-30'}, {'pallet_type': '1m6', 'date': '2024-01-31'}]
+    return [
+        # Dữ liệu tham chiếu: cache của worker nạp toàn bộ bảng (đặt trước để các lần gọi sau dùng cache)
+        ("refdata: nạp masterdata", refdata._load_masterdata, "cache refdata nạp toàn bộ bảng một lần mỗi phiên bản"),
+        ("refdata: nạp nhacungcap", refdata._load_suppliers, "cache refdata nạp toàn bộ bảng một lần mỗi phiên bản"),
+        *((f"typeahead: {kind}", _static(sql, ()), None) for kind, (sql, _) in typeahead.SOURCES.items()),
+        # supplier / masterdata
+        ("supplier: danh sách", lambda c: catalog.supplier_page(c, '', 1, 10), None),
+        ("supplier: tìm kiếm", lambda c: catalog.supplier_page(c, 'AB', 1, 10), None),
+        ("supplier: tìm kiếm 1 ký tự", lambda c: catalog.supplier_page(c, 'A', 1, 10), None),
+        ("masterdata: danh sách", lambda c: catalog.masterdata_page(c, '', 'sku', 'asc', 1, 10), None),
+        ("masterdata: tìm kiếm", lambda c: catalog.masterdata_page(c, 'LLR', 'sku', 'asc', 1, 10), None),
+        ("masterdata: sắp xếp theo CBM", lambda c: catalog.masterdata_page(c, '', 'cbm', 'desc', 1, 10),
+         "sắp xếp theo cột không có index (CBM, số lượng, tên NCC) phải đọc toàn bộ Master Data"),
+        # bbr
+        ("bbr: danh sách tuần", bbr_report.get_weeks, None),
+        ("bbr: trang mặc định", lambda c: bbr_report.fetch_page(c, *bbr_report.build_filter()), None),
+        ("bbr: đếm theo tuần", lambda c: bbr_report.count_rows(c, *bbr_report.build_filter(1)), None),
+        ("bbr: trang theo tuần", lambda c: bbr_report.fetch_page(c, *bbr_report.build_filter(1)), None),
+        ("bbr: đếm FULLTEXT", lambda c: bbr_report.count_rows(c, *bbr_report.build_filter(None, 'LLR68')), None),
+        ("bbr: trang FULLTEXT", lambda c: bbr_report.fetch_page(c, *bbr_report.build_filter(None, 'LLR68')), None),
+        ("bbr: trang tuần + FULLTEXT", lambda c: bbr_report.fetch_page(c, *bbr_report.build_filter(1, 'LLR68')), None),
+        ("bbr: thống kê theo tuần", lambda c: bbr_report.stats(c, 1), None),
+        ("bbr: thống kê toàn bộ", lambda c: bbr_report.stats(c),
+         "trang BBR không lọc tuần đọc toàn bộ bảng tổng hợp (đã gom theo tuần/PO)"),
+        ("bbr: thống kê FULLTEXT", lambda c: bbr_report.stats(c, 1, 'LLR68'), None),
+        ("bbr: keycheck theo từ khóa", lambda c: bbr_report.search_keychecks(c, 'LLR68'), None),
+        ("bbr: tìm chuỗi con", lambda c: bbr_report.fetch_page(c, *bbr_report.build_filter(None, 'LLR68', 'substring')),
+         "match=substring là chế độ tương thích LIKE '%q%', cố ý quét bảng"),
+        ("bbr: tính lại tổng hợp theo tuần", lambda c: bbr_report.refresh_summary(c, [1]), None),
+        ("bbr: xóa tổng hợp theo tuần", lambda c: bbr_report.delete_week_summary(c, 1), None),
+        ("bbr: xóa theo tuần", _static(bbr_report.DELETE_WEEK_SQL, (1,)), None),
+        ("bbr: SKU theo PO", _static(bbr_report.PO_SKUS_SQL, ('PO',)), None),
+        ("bbr: thông tin SKU", _static(bbr_report.SKU_INFO_SQL, ('SKU',)), None),
+        # inbound
+        ("inbound: trang mặc định", lambda c: exports.inbound_pages(c, MultiDict()),
+         "thống kê Packing List khi không lọc ngày gom nhóm toàn bộ inbound"),
+        ("inbound: trang theo ngày", lambda c: exports.inbound_pages(c, dates), None),
+        ("inbound: trang keyset", lambda c: exports.inbound_pages(c, after), None),
+        ("inbound: tìm kiếm", lambda c: exports.inbound_pages(c, search), "tìm PO/SKU/Packing List bằng LIKE '%q%'"),
+        ("inbound: xuất dữ liệu thô", _export(exports.inbound_query(dates)), None),
+        ("inbound: SKU của file import", lambda c: inbound_import.lookup_skus(c, ['A', 'B']), None),
+        ("inbound: đã nhập theo PO", _static(inbound_import.PO_IMPORTED_SQL, ('PO',)), None),
+        ("inbound: PO context", _static(inbound_import.PO_CONTEXT_SQL, ('PO', 'PO', 'PO')), None),
+        ("inbound: in packing list", _static(inbound_import.PACKINGLIST_SQL, ('PL',)), None),
+        ("inbound: báo cáo outsource", _static(reports.OUTSOURCE_SQL, ('2024-01-21', '2024-02-20')), None),
+        # outbound
+        ("outbound: trang mặc định", lambda c: exports.outbound_pages(c, MultiDict()),
+         "thống kê DO khi không lọc ngày gom nhóm toàn bộ outbound"),
+        ("outbound: trang theo ngày", lambda c: exports.outbound_pages(c, dates), None),
+        ("outbound: trang keyset", lambda c: exports.outbound_pages(c, after), None),
+        ("outbound: tìm kiếm", lambda c: exports.outbound_pages(c, search), "tìm Job No/PO/SKU bằng LIKE '%q%'"),
+        ("outbound: xuất dữ liệu thô", _export(exports.outbound_query(dates)), None),
+        ("outbound: SKU của file import", lambda c: outbound_import.lookup_skus(c, ['A', 'B']), None),
+        ("outbound: Job No theo ngày", lambda c: print_docs.find_jobnos(c, '2024-01-01', '2024-01-02', 'CONT', ['JOB1']), None),
+        ("outbound: in hàng loạt", lambda c: print_docs.fetch_grouped(c, ['JOB1', 'JOB2']), None),
+        ("outbound: load plan", lambda c: loadplan.plan_job(c, 'JOB'), None),
+        ("data_version: theo khóa", lambda c: versions.get(c, ['outbound:JOB1', 'scanfile:JOB1']), None),
+        # scanfile
+        ("scanfile: bộ đếm scan trực tiếp", lambda c: scan_live._seed(c, 'JOB'), None),
+        ("scanfile: SSCC đã có trong job", lambda c: scan_import.existing_ssccs(c, 'JOB', ['S1', 'S2']), None),
+        ("scanfile: SSCC đã có ở mọi job", lambda c: scan_import.existing_ssccs(c, 'JOB', ['S1', 'S2'], True), None),
+        ("scanfile: báo cáo SSCC trùng", lambda c: scan_import.duplicate_report(c, 'JOB'), None),
+        ("scanfile: chi tiết", _static(scan_import.DETAILS_SQL, ('JOB', 'SKU')), None),
+        ("scanfile: xóa theo job", _static(scan_import.DELETE_JOB_SQL, ('JOB',)), None),
+        # pallet
+        ("pallet: tồn hiện tại", pallet_ledger.stock, None),
+        ("pallet: tồn đến ngày", lambda c: pallet_ledger.stock(c, '2024-01-31'), None),
+        ("pallet: lịch sử", lambda c: pallet_ledger.history(c, MultiDict()), None),
+        ("pallet: lịch sử theo ngày", lambda c: pallet_ledger.history(c, dates), None),
+        ("pallet: lịch sử keyset", lambda c: pallet_ledger.history(c, after), None),
+        ("pallet: tồn từng giao dịch", lambda c: pallet_ledger.running_balances(c, history_rows), None),
+        ("pallet: ghi sổ", lambda c: pallet_ledger.apply(c, '2024-01-31', '1m2', 'IN', 1), None),
+        ("pallet: xuất theo ngày", _export(pallet_ledger.export_query(dates)), None),
+        # job nền / báo cáo định kỳ
+        ("import_jobs: trạng thái", lambda c: jobs.get_job(c, 'x' * 32), None),
+        ("import_jobs: đánh dấu job mồ côi", lambda c: jobs.mark_stale(c, 'host', ['x' * 32]), None),
+        ("report: kỳ đã gửi", lambda c: reports._already_sent(c, 'outsource_email', '2024-01-20'), None),
+        ("report: lịch sử chạy", reports.recent_runs, None),
+    ]
+
+
+def _full_scans(plan):
+    """Các bảng bị quét toàn bộ: type=ALL và (không có index khả dụng hoặc ước tính >= CHECK_MIN_ROWS dòng).
+
+    Bảng dẫn xuất (<derived2>, <union2,3>) bỏ qua vì đã được kiểm tra ở các dòng của truy vấn con.
+    """
+    return [row for row in plan
+            if row.get('type') == 'ALL' and not str(row.get('table') or '').startswith('<')
+            and (not row.get('possible_keys') or (row.get('rows') or 0) >= CHECK_MIN_ROWS)]
+
+
+def _bigram(value):
+    """Bigram chữ/số đầu tiên có chứa 'a' hoặc 'i' (bị stopword mặc định của InnoDB loại bỏ)"""
+    text = str(value or '').lower()
+    for i in range(len(text) - 1):
+        pair = text[i:i + 2]
+        if pair.isalnum() and ('a' in pair or 'i' in pair):
+            return pair
+    return None
+
+
+def _stopword_checks():
+    """[(tên, SQL lấy dòng mẫu (k = khóa, v = chữ), hàm(từ khóa) -> (SQL tìm theo khóa, tham số))]"""
+    import catalog
+
+    def supplier(term):
+        join, params = catalog.supplier_filter(term)
+        return f"SELECT 1 FROM nhacungcap{join} WHERE MANCC = %s", params
+
+    def masterdata(term):
+        join, params = catalog.masterdata_filter(term)
+        return f"SELECT 1 FROM masterdata m{join} WHERE m.sku = %s", params
+
+    def bbr(term):
+        source, params = bbr_report.build_filter(None, term)
+        return f"SELECT 1 {source} WHERE b.id = %s", params
+
+    return [
+        ("supplier: tên NCC", "SELECT MANCC AS k, TENNCC AS v FROM nhacungcap "
+                              "WHERE TENNCC LIKE '%a%' OR TENNCC LIKE '%i%' LIMIT 50", supplier),
+        ("masterdata: mô tả", "SELECT sku AS k, description AS v FROM masterdata "
+                              "WHERE description LIKE '%a%' OR description LIKE '%i%' LIMIT 50", masterdata),
+        ("bbr: PO/SKU/NCC", "SELECT id AS k, CONCAT_WS(' ', PO, item, parentpo, supplier) AS v FROM bbrreport "
+                            "ORDER BY id DESC LIMIT 200", bbr),
+    ]
+
+
+def stopword_check(conn):
+    """Tìm một bigram chứa 'a'/'i' lấy từ dữ liệu thật qua đúng bộ lọc FULLTEXT của app.
+
+    Index ngram tạo với stopword mặc định bỏ các token đó nên dòng mẫu không được tìm thấy
+    (cần migration 15/16). Bảng không có dữ liệu phù hợp thì bỏ qua.
+    """
+    cursor = conn.cursor(dictionary=True)
+    failures = []
+    for name, sample_sql, build in _stopword_checks():
+        cursor.execute(sample_sql)
+        sample = next(((r['k'], term) for r in cursor.fetchall() for term in [_bigram(r['v'])] if term), None)
+        if sample is None:
+            print(f"  ⏭️  stopword {name}: không có dữ liệu mẫu")
+            continue
+        key, term = sample
+        sql, params = build(term)
+        cursor.execute(sql, params + [key])
+        found = cursor.fetchall()
+        if found:
+            print(f"  ✅ stopword {name}: '{term}' tìm thấy {key!r}")
+        else:
+            failures.append(f"stopword {name}: '{term}' không tìm thấy {key!r} (index FULLTEXT còn stopword)")
+            print(f"  ❌ {failures[-1]}")
+    cursor.close()
+    return failures
+
+
+def check(conn):
+    """EXPLAIN các truy vấn do app tạo; lỗi khi có full scan mà mục đó không ghi lý do được phép.
+
+    Trên bảng nhỏ MySQL vẫn có thể chọn full scan dù có index, nên type=ALL chỉ là lỗi khi
+    không có index khả dụng hoặc bảng ước tính từ CHECK_MIN_ROWS dòng trở lên.
+    """
+    import mysql.connector
+
+    raw = conn.cursor(dictionary=True)
+    failures = []
+    warnings = []
+    for name, run, full_scan in _check_list():
+        cursor = ExplainCursor(raw)
+        try:
+            run(cursor)
+        except mysql.connector.Error as e:
+            failures.append(f"{name}: {e}")
+            print(f"  ❌ {name}: {e}")
+            continue
+        scans = [row for _, plan in cursor.plans for row in _full_scans(plan)]
+        for row in scans:
+            message = f"{name}: full scan trên bảng {row.get('table')} (~{row.get('rows')} dòng)"
+            if full_scan:
+                warnings.append(f"{message} — {full_scan}")
+            else:
+                failures.append(message)
+        mark = '❌' if scans and not full_scan else ('⚠️ ' if scans else '✅')
+        print(f"  {mark} {name}: " + "; ".join(
+            ", ".join(f"{r.get('table')}={r.get('type')}/{r.get('key')}" for r in plan) for _, plan in cursor.plans))
+    conn.rollback()
+    raw.close()
+    stopwords = stopword_check(conn)
+
+    for w in warnings:
+        print(f"   ⚠️  {w}")
+    if failures:
+        print("❌ Có truy vấn quét toàn bộ bảng:")
+        for f in failures:
+            print(f"   - {f}")
+        return False
+    if stopwords:
+        print("❌ Tìm kiếm FULLTEXT bỏ sót từ khóa (chạy 'python migrations.py upgrade'):")
+        for f in stopwords:
+            print(f"   - {f}")
+        return False
+    print("✅ Tất cả truy vấn đều dùng index")
+    return True
+
+
+# === BACKFILL ===
+def rebuild_summary(conn):
+    cursor = conn.cursor()
+    bbr_report.refresh_summary(cursor)
+    conn.commit()
+    cursor.execute("SELECT COUNT(*) FROM bbr_weekly_summary")
+    print(f"✅ Đã tính lại bảng tổng hợp BBR: {cursor.fetchone()[0]} dòng")
+    cursor.close()
+
+
+def rebuild_pallet_ledger(conn):
+    cursor = conn.cursor()
+    pallet_ledger.rebuild(cursor)
+    conn.commit()
+    cursor.execute("SELECT COUNT(*) FROM pallet_daily_balance")
+    print(f"✅ Đã tính lại sổ tồn pallet: {cursor.fetchone()[0]} dòng")
+    cursor.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migration schema WMS")
+    parser.add_argument('command', choices=['upgrade', 'status', 'check', 'rebuild-summary', 'rebuild-pallet-ledger'])
+    args = parser.parse_args(argv)
+
+    conn = get_db_connection()
+    if not conn:
+        print("❌ Không kết nối được Database")
+        return 1
+    try:
+        if args.command == 'upgrade':
+            try:
+                upgrade(conn)
+            except MigrationError as e:
+                conn.rollback()
+                print(f"❌ {e}")
+                return 1
+            return 0
+        if args.command == 'rebuild-summary':
+            rebuild_summary(conn)
+            return 0
+        if args.command == 'rebuild-pallet-ledger':
+            rebuild_pallet_ledger(conn)
+            return 0
+        if args.command == 'status':
+            return 0 if status(conn) else 2
+        return 0 if check(conn) else 1
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
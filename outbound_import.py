@@ -0,0 +1,98 @@
+"""Import Outbound từ file Excel/CSV (chạy trong job nền)"""
+from datetime import datetime
+
+import pandas as pd
+
+import pagination
+import typeahead
+import refdata
+import versions
+from db import insert_batches, select_in
+
+# Tên cột chấp nhận trong file, theo thứ tự ưu tiên
+COLUMN_ALIASES = {
+    'po': ['PPO', 'PO Number', 'po'],
+    'sku': ['SKU', 'Item', 'Mã hàng', 'sku'],
+    'childpo': ['Child PO', 'ChildPO', 'childpo'],
+    'qty': ['Sum of Carton', 'Quantity', 'Số lượng', 'Carton', 'carton'],
+}
+
+INSERT_SQL = "INSERT INTO outbound (jobno, po, sku, carton, datercv, cbm, childpo, fdc, remark, loosecarton, kindpallet, container) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+
+
+def read_file(path, filename):
+    # Đọc file Excel hoặc CSV
+    if filename.endswith('.csv'):
+        return pd.read_csv(path, dtype=str)
+    return pd.read_excel(path, dtype=str)
+
+
+def resolve_columns(columns):
+    """Tên cột thực tế trong file cho từng trường (None nếu không có)"""
+    return {field: next((c for c in names if c in columns), None) for field, names in COLUMN_ALIASES.items()}
+
+
+def lookup_skus(cursor, skus):
+    """CBM / loosecase / kindpallet cho các SKU có trong file.
+
+    Ưu tiên masterdata; SKU không có trong masterdata lấy CBM từ bbrreport.
+    """
+    cached = refdata.masterdata(cursor)
+    master = {sku: cached[sku] for sku in skus if sku in cached}
+    missing = [s for s in skus if s not in master]
+    bbr_cbm = {r['item']: float(r['cbm']) for r in select_in(cursor, """
+        SELECT item, MAX(cbm) AS cbm FROM bbrreport
+        WHERE cbm IS NOT NULL AND cbm != 0 AND item IN ({placeholders})
+        GROUP BY item
+    """, missing)}
+
+    cbm = {sku: info.cbm for sku, info in master.items()}
+    cbm.update(bbr_cbm)
+    loosecase = {sku: info.loosecase for sku, info in master.items()}
+    kindpallet = {sku: info.kindpallet for sku, info in master.items()}
+    return cbm, loosecase, kindpallet
+
+
+def import_job(conn, job, files, do_no, date, container, add_more):
+    path, filename = files[0]
+    df = read_file(path, filename)
+    df = df.fillna('')
+
+    # Chuẩn hóa tên cột
+    df.columns = df.columns.str.strip()
+    job.progress(parsed=len(df))
+
+    cols = resolve_columns(df.columns)
+    none = pd.Series([None] * len(df), index=df.index, dtype=object)
+    po = df[cols['po']] if cols['po'] else none
+    sku = df[cols['sku']] if cols['sku'] else none
+    childpo = df[cols['childpo']] if cols['childpo'] else none
+    qty = pd.to_numeric(df[cols['qty']], errors='coerce') if cols['qty'] else pd.Series(0.0, index=df.index)
+
+    # Chỉ lấy dòng có SKU và số lượng > 0
+    keep = (sku.fillna('') != '') & (qty > 0)
+    if not keep.any():
+        return "Không tìm thấy dữ liệu hợp lệ trong file.", "warning"
+    po, sku, childpo, qty = po[keep], sku[keep], childpo[keep], qty[keep].astype(float)
+
+    cursor = conn.cursor(dictionary=True)
+    cbm, loosecase, kindpallet = lookup_skus(cursor, sku.unique().tolist())
+
+    total_cbm = sku.map(cbm).fillna(0).to_numpy(dtype=float) * qty.to_numpy()
+    fdc = childpo.where(childpo.fillna('') != '', '').astype(str).str[:3]
+    loose_carton = [loosecase.get(s, '') for s in sku]
+    kind_pallet = [kindpallet.get(s, '') for s in sku]
+
+    # Áp dụng Job No và Ngày từ form cho tất cả các dòng
+    n = len(sku)
+    date_out = date if date else datetime.now().strftime('%d-%m-%Y')
+    remark = 'add_more' if add_more else ''
+    inserts = list(zip([do_no] * n, po, sku, qty.tolist(), [date_out] * n, total_cbm.tolist(), childpo, fdc,
+                       [remark] * n, loose_carton, kind_pallet, [container] * n))
+
+    insert_batches(cursor, INSERT_SQL, inserts, on_batch=lambda n: job.progress(written=n))
+    versions.bump(cursor, [versions.outbound_key(do_no)])
+    pagination.invalidate(cursor, 'outbound')
+    conn.commit()
+    typeahead.add('outbound_container', [container])
+    return f"Đã import thành công {len(inserts)} dòng dữ liệu!", "success"
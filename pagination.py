@@ -0,0 +1,162 @@
+"""Phân trang phía server cho các danh sách lịch sử (Inbound, Outbound, Pallet).
+
+- Danh sách chi tiết: keyset pagination theo (ngày, id) giảm dần, chỉ LIMIT số dòng cần hiển thị.
+  Khi không có token (ví dụ mở thẳng ?page=5) thì dùng LIMIT/OFFSET.
+- Bảng thống kê (GROUP BY): LIMIT/OFFSET trong SQL.
+- Tổng số dòng: COUNT(*) chỉ trên bảng chính (không JOIN), cache ngắn hạn trong worker
+  (LRU tối đa COUNT_CACHE_SIZE câu truy vấn). Mỗi kết quả lưu kèm phiên bản dữ liệu
+  (versions.py, khóa 'table:<bảng>') của các bảng trong câu COUNT; route ghi gọi invalidate()
+  trước commit để tăng phiên bản, nên cache đúng cả khi worker khác ghi dữ liệu.
+"""
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import versions
+
+COUNT_TTL = 30          # Số giây giữ kết quả COUNT(*)
+COUNT_CACHE_SIZE = 256  # Số câu COUNT (theo SQL + tham số) giữ tối đa trong mỗi worker
+
+_count_cache = OrderedDict()  # (sql, tham số) -> (thời điểm, phiên bản các bảng, tổng)
+_count_lock = threading.Lock()
+_TABLE_RE = re.compile(r"\b(?:FROM|JOIN)\s+`?(\w+)", re.IGNORECASE)
+
+
+class Page:
+    """Một trang dữ liệu + thông tin để tạo link Trước/Sau"""
+
+    def __init__(self, items, page, per_page, total, first_key=None, last_key=None, prefix=''):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.first_key = first_key
+        self.last_key = last_key
+        self.prefix = prefix
+
+    @property
+    def total_pages(self):
+        return math.ceil(self.total / self.per_page) if self.total else 0
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def has_next(self):
+        return self.page < self.total_pages
+
+    def _args(self, page, **token):
+        args = {self.prefix + 'page': page}
+        args.update({self.prefix + k: v for k, v in token.items() if v})
+        return args
+
+    def prev_args(self):
+        if self.page - 1 <= 1:
+            return self._args(1)
+        return self._args(self.page - 1, before=self.first_key)
+
+    def next_args(self):
+        return self._args(self.page + 1, after=self.last_key)
+
+
+def _encode(row, keys):
+    values = [row.get(name) for _, name in keys]
+    if any(v is None for v in values):
+        return None
+    return "|".join(str(v) for v in values)
+
+
+def _decode(token, keys):
+    parts = token.rsplit("|", len(keys) - 1) if token else []
+    return parts if len(parts) == len(keys) else None
+
+
+def _table_keys(sql):
+    return [versions.table_key(t) for t in sorted(set(_TABLE_RE.findall(sql)))]
+
+
+def count(cursor, sql, params):
+    """COUNT(*) có cache theo (câu SQL, tham số) trong COUNT_TTL giây, khi phiên bản các bảng không đổi"""
+    cache_key = (sql, tuple(params))
+    stamp = versions.get(cursor, _table_keys(sql))
+    now = time.monotonic()
+    with _count_lock:
+        hit = _count_cache.get(cache_key)
+        if hit and now - hit[0] < COUNT_TTL and hit[1] == stamp:
+            _count_cache.move_to_end(cache_key)
+            return hit[2]
+    cursor.execute(sql, params)
+    row = cursor.fetchone()
+    total = int((row['total'] if isinstance(row, dict) else row[0]) or 0)
+    with _count_lock:
+        _count_cache[cache_key] = (now, stamp, total)
+        _count_cache.move_to_end(cache_key)
+        for key in [k for k, v in _count_cache.items() if now - v[0] >= COUNT_TTL]:
+            del _count_cache[key]
+        while len(_count_cache) > COUNT_CACHE_SIZE:
+            _count_cache.popitem(last=False)
+    return total
+
+
+def invalidate(cursor, *tables):
+    """Đánh dấu bảng đã đổi để cache COUNT ở mọi worker hết hiệu lực (gọi trước conn.commit())"""
+    versions.bump(cursor, [versions.table_key(t) for t in tables])
+
+
+def keyset(cursor, select, conditions, params, keys, args, per_page, count_from, prefix=''):
+    """Phân trang keyset theo các cột keys (giảm dần).
+
+    select: "SELECT ... FROM ... JOIN ..." (chưa có WHERE)
+    conditions/params: điều kiện lọc dùng chung cho dữ liệu và COUNT
+    keys: [(cột SQL, tên trường trong kết quả), ...], ví dụ [('i.datercv', 'datercv'), ('i.id', 'id')]
+    count_from: "FROM bảng alias" để đếm tổng (không JOIN)
+    args: request.args; đọc page/after/before (có prefix)
+    """
+    page = max(args.get(prefix + 'page', 1, type=int), 1)
+    after = _decode(args.get(prefix + 'after'), keys)
+    before = _decode(args.get(prefix + 'before'), keys)
+
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    total = count(cursor, f"SELECT COUNT(*) AS total {count_from}{where}", params)
+
+    cols = [col for col, _ in keys]
+    conds = list(conditions)
+    query_params = list(params)
+    direction, reverse = "DESC", False
+    offset = 0
+    token = after or before
+    if token:
+        op = "<" if after else ">"
+        # (a, b) < (x, y)  <=>  a < x OR (a = x AND b < y): dùng được index (a, b)
+        ors = []
+        for i, col in enumerate(cols):
+            eqs = [f"{c} = %s" for c in cols[:i]]
+            ors.append("(" + " AND ".join(eqs + [f"{col} {op} %s"]) + ")")
+            query_params.extend(token[:i] + [token[i]])
+        conds.append("(" + " OR ".join(ors) + ")")
+        if before:
+            direction, reverse = "ASC", True
+    else:
+        offset = (page - 1) * per_page
+
+    where = " WHERE " + " AND ".join(conds) if conds else ""
+    order = ", ".join(f"{col} {direction}" for col in cols)
+    cursor.execute(f"{select}{where} ORDER BY {order} LIMIT %s OFFSET %s", query_params + [per_page, offset])
+    items = cursor.fetchall()
+    if reverse:
+        items.reverse()
+
+    first_key = _encode(items[0], keys) if items else None
+    last_key = _encode(items[-1], keys) if items else None
+    return Page(items, page, per_page, total, first_key, last_key, prefix)
+
+
+def offset(cursor, sql, params, count_sql, count_params, args, per_page, prefix=''):
+    """Phân trang LIMIT/OFFSET cho truy vấn đã có WHERE/GROUP BY/ORDER BY"""
+    page = max(args.get(prefix + 'page', 1, type=int), 1)
+    total = count(cursor, count_sql, count_params)
+    cursor.execute(f"{sql} LIMIT %s OFFSET %s", list(params) + [per_page, (page - 1) * per_page])
+    return Page(cursor.fetchall(), page, per_page, total, prefix=prefix)
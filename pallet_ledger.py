@@ -0,0 +1,150 @@
+"""Sổ tồn pallet theo ngày (bảng pallet_daily_balance).
+
+Mỗi (loại pallet, ngày có giao dịch) có một dòng: nhập/xuất trong ngày và lũy kế nhập/xuất
+đến hết ngày đó. Thêm/xóa giao dịch cập nhật dòng của ngày đó và cộng dồn vào các ngày sau
+(trong cùng transaction), nên tồn hiện tại và tồn tại một ngày bất kỳ chỉ cần tra index
+(pallet_type, date) thay vì SUM toàn bộ pallet_management.
+"""
+import pagination
+
+PALLET_TYPES = ('1m2', '1m6', '1m9')
+
+
+def _delta(action, qty):
+    if action == 'IN':
+        return qty, 0
+    if action == 'OUT':
+        return 0, qty
+    return 0, 0
+
+
+def apply(cursor, date, pallet_type, action, qty):
+    """Ghi một giao dịch vào sổ (qty âm khi xóa giao dịch); gọi trước conn.commit()"""
+    d_in, d_out = _delta(action, qty)
+    if not d_in and not d_out:
+        return
+    # Ngày chưa có dòng: bắt đầu từ lũy kế của ngày gần nhất trước đó
+    cursor.execute("""
+        SELECT cum_in, cum_out FROM pallet_daily_balance
+        WHERE pallet_type = %s AND date < %s ORDER BY date DESC LIMIT 1
+    """, (pallet_type, date))
+    prev = cursor.fetchone()
+    cum_in, cum_out = (_value(prev, 'cum_in', 0), _value(prev, 'cum_out', 1)) if prev else (0, 0)
+    cursor.execute("""
+        INSERT IGNORE INTO pallet_daily_balance (pallet_type, date, in_qty, out_qty, cum_in, cum_out)
+        VALUES (%s, %s, 0, 0, %s, %s)
+    """, (pallet_type, date, cum_in, cum_out))
+    cursor.execute("""
+        UPDATE pallet_daily_balance
+        SET in_qty = in_qty + IF(date = %s, %s, 0), out_qty = out_qty + IF(date = %s, %s, 0),
+            cum_in = cum_in + %s, cum_out = cum_out + %s
+        WHERE pallet_type = %s AND date >= %s
+    """, (date, d_in, date, d_out, d_in, d_out, pallet_type, date))
+
+
+def _value(row, name, index):
+    return (row[name] if isinstance(row, dict) else row[index]) or 0
+
+
+def _balance(row):
+    if not row:
+        return {'in': 0, 'out': 0, 'stock': 0}
+    cum_in, cum_out = _value(row, 'cum_in', 0), _value(row, 'cum_out', 1)
+    return {'in': cum_in, 'out': cum_out, 'stock': cum_in - cum_out}
+
+
+def stock(cursor, as_of=None):
+    """{loại: {'in', 'out', 'stock'}} lũy kế đến hết ngày as_of (None = hiện tại)"""
+    summary = {}
+    for pallet_type in PALLET_TYPES:
+        if as_of:
+            cursor.execute("""
+                SELECT cum_in, cum_out FROM pallet_daily_balance
+                WHERE pallet_type = %s AND date <= %s ORDER BY date DESC LIMIT 1
+            """, (pallet_type, as_of))
+        else:
+            cursor.execute("""
+                SELECT cum_in, cum_out FROM pallet_daily_balance
+                WHERE pallet_type = %s ORDER BY date DESC LIMIT 1
+            """, (pallet_type,))
+        summary[pallet_type] = _balance(cursor.fetchone())
+    return summary
+
+
+def _date_filter(args):
+    conditions = []
+    params = []
+    if args.get('from_date'):
+        conditions.append("date >= %s")
+        params.append(args.get('from_date'))
+    if args.get('to_date'):
+        conditions.append("date <= %s")
+        params.append(args.get('to_date'))
+    return conditions, params
+
+
+def history(cursor, args):
+    """Lịch sử giao dịch lọc theo from_date/to_date, phân trang keyset theo (date, id)"""
+    conditions, params = _date_filter(args)
+    return pagination.keyset(cursor, "SELECT * FROM pallet_management", conditions, params,
+                             [('date', 'date'), ('id', 'id')], args,
+                             per_page=50, count_from="FROM pallet_management")
+
+
+def export_query(args):
+    """(sql, params) xuất lịch sử giao dịch theo from_date/to_date, mới nhất trước"""
+    conditions, params = _date_filter(args)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    sql = f"SELECT date, pallet_type, action, quantity, remark FROM pallet_management{where} ORDER BY date DESC, id DESC"
+    return sql, params
+
+
+def running_balances(cursor, rows):
+    """{id: (tồn đầu, tồn cuối)} của từng giao dịch trong rows (một trang lịch sử).
+
+    Tồn đầu ngày lấy từ sổ; chỉ đọc thêm các giao dịch của những ngày có trong trang.
+    """
+    days = {(r['pallet_type'], r['date']) for r in rows}
+    if not days:
+        return {}
+    dates = sorted({d for _, d in days})
+    cursor.execute(f"""
+        SELECT id, date, pallet_type, action, quantity FROM pallet_management
+        WHERE date IN ({", ".join(["%s"] * len(dates))}) ORDER BY date, id
+    """, dates)
+    same_day = cursor.fetchall()
+
+    balances = {}
+    for pallet_type, date in days:
+        cursor.execute("""
+            SELECT cum_in - in_qty AS opening_in, cum_out - out_qty AS opening_out FROM pallet_daily_balance
+            WHERE pallet_type = %s AND date = %s
+        """, (pallet_type, date))
+        opening = cursor.fetchone()
+        running = (opening['opening_in'] - opening['opening_out']) if opening else 0
+        for tx in same_day:
+            if tx['pallet_type'] != pallet_type or tx['date'] != date:
+                continue
+            d_in, d_out = _delta(tx['action'], tx['quantity'] or 0)
+            balances[tx['id']] = (running, running + d_in - d_out)
+            running += d_in - d_out
+    return balances
+
+
+def rebuild(cursor):
+    """Tính lại toàn bộ sổ từ pallet_management (migration / sửa dữ liệu)"""
+    cursor.execute("DELETE FROM pallet_daily_balance")
+    cursor.execute("""
+        INSERT INTO pallet_daily_balance (pallet_type, date, in_qty, out_qty, cum_in, cum_out)
+        SELECT pallet_type, date, in_qty, out_qty,
+               SUM(in_qty) OVER (PARTITION BY pallet_type ORDER BY date),
+               SUM(out_qty) OVER (PARTITION BY pallet_type ORDER BY date)
+        FROM (
+            SELECT pallet_type, date,
+                   COALESCE(SUM(CASE WHEN action = 'IN' THEN quantity END), 0) AS in_qty,
+                   COALESCE(SUM(CASE WHEN action = 'OUT' THEN quantity END), 0) AS out_qty
+            FROM pallet_management
+            WHERE pallet_type IS NOT NULL AND date IS NOT NULL AND action IN ('IN', 'OUT')
+            GROUP BY pallet_type, date
+        ) d
+    """)
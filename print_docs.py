@@ -0,0 +1,183 @@
+"""Dữ liệu in Picking List / Delivery Note cho một hoặc nhiều Job No.
+
+In hàng loạt đọc toàn bộ dòng bằng một truy vấn đã sắp xếp theo jobno, FDC, PO, SKU và
+gom nhóm jobno → FDC trong một lượt duyệt. Mỗi dòng kèm cartonperpallet / trọng lượng của
+Master Data để Picking List ước tính pallet (loadplan.estimate_pallets) và container theo cả
+CBM lẫn tải trọng. HTML đã render được cache theo tập Job No, hợp lệ khi phiên bản dữ liệu
+(versions.py) của các Job No đó và của Master Data không đổi.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import loadplan
+import refdata
+import versions
+from db import select_in
+
+CACHE_SIZE = 32
+DOC_TYPES = ('pickinglist', 'deliverynote')
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def find_jobnos(cursor, date=None, datestuff=None, container=None, jobnos=None):
+    """Danh sách Job No theo ngày nhận picking, ngày đóng hàng, container hoặc danh sách nhập tay"""
+    conditions = []
+    params = []
+    if date:
+        conditions.append("datercv = %s")
+        params.append(date)
+    if datestuff:
+        conditions.append("datestuff = %s")
+        params.append(datestuff)
+    if container:
+        conditions.append("container = %s")
+        params.append(container)
+    found = set()
+    if jobnos:
+        # Job No nhập tay lấy đúng giá trị trong Database (collation không phân biệt hoa thường,
+        # nhưng dict kết quả và khóa phiên bản dùng giá trị gốc)
+        rows = select_in(cursor, "SELECT DISTINCT jobno FROM outbound WHERE jobno IN ({placeholders})",
+                         [j.strip() for j in jobnos])
+        found.update(r['jobno'] for r in rows if r['jobno'])
+    if conditions:
+        cursor.execute(f"SELECT DISTINCT jobno FROM outbound WHERE {' AND '.join(conditions)}", params)
+        found.update(r['jobno'] for r in cursor.fetchall() if r['jobno'])
+    return sorted(found)
+
+
+def fetch_grouped(cursor, jobnos):
+    """{jobno: {fdc: [dòng, ...]}} theo thứ tự jobno, FDC, PO, SKU (một truy vấn mỗi 1000 Job No)"""
+    rows = select_in(cursor, """
+        SELECT o.*, m.cartonperpallet, m.weight AS unit_weight, m.kindpallet AS master_kindpallet
+        FROM outbound o LEFT JOIN masterdata m ON m.sku = o.sku
+        WHERE o.jobno IN ({placeholders}) ORDER BY o.jobno, o.fdc, o.parentpo, o.sku, o.id
+    """, jobnos)
+    jobs = {}
+    for item in rows:
+        fdc = item['fdc'] if item['fdc'] else 'Khác'
+        jobs.setdefault(item['jobno'], {}).setdefault(fdc, []).append(item)
+    return jobs
+
+
+def _norm(jobno):
+    return str(jobno).strip().casefold()
+
+
+def fetch_job(cursor, do_no):
+    """(Job No trong Database, {fdc: [dòng]}) của một Job No; None nếu không có.
+
+    do_no so khớp không phân biệt hoa thường / khoảng trắng đầu cuối như collation của cột.
+    """
+    grouped = fetch_grouped(cursor, [do_no.strip()])
+    for jobno, groups in grouped.items():
+        if _norm(jobno) == _norm(do_no):
+            return jobno, groups
+    # Collation còn bỏ qua dấu: nếu chỉ có một Job No khớp thì dùng Job No đó
+    if len(grouped) == 1:
+        return next(iter(grouped.items()))
+    return do_no, None
+
+
+def pickinglist_context(do_no, groups):
+    """Biến cho print_pickinglist.html từ {fdc: [dòng]} của một Job No"""
+    grouped_data = {}
+    grand_total_pallet_1m2 = 0
+    grand_total_pallet_1m9 = 0
+    all_items = [item for items in groups.values() for item in items]
+
+    # Pallet từng dòng: cartonperpallet của Master Data, không có thì CBM / CBM pallet của loại pallet
+    cartons = np.array([float(item['carton'] or 0) for item in all_items])
+    cbms = np.array([float(item['cbm'] or 0) for item in all_items])
+    cpp = np.array([float(item.get('cartonperpallet') or 0) for item in all_items])
+    kind = np.array([item['kindpallet'] or item.get('master_kindpallet') or loadplan.DEFAULT_KIND for item in all_items],
+                    dtype=object)
+    pallets, _ = loadplan.estimate_pallets(cartons, cpp, cbms, kind)
+    weights = cartons * np.array([float(item.get('unit_weight') or 0) for item in all_items])
+
+    start = 0
+    for fdc, items in groups.items():
+        data = {'items': items, 'total_cbm': 0, 'total_carton': 0, 'total_loose_carton': 0,
+                'pallets': float(pallets[start:start + len(items)].sum()),
+                'weight': float(weights[start:start + len(items)].sum())}
+        start += len(items)
+        for item in items:
+            cbm = float(item['cbm']) if item['cbm'] else 0
+            carton = float(item['carton']) if item['carton'] else 0
+            data['total_cbm'] += cbm
+            data['total_carton'] += carton
+            # Tính tổng Loose Carton (nếu cột loosecarton có dữ liệu)
+            if item.get('looscarton') == 'Y':
+                data['total_loose_carton'] += carton
+
+        # Số lượng Pallet dự kiến cho nhóm FDC
+        cbm = data['total_cbm']
+        data['pallet_1m2'] = float(loadplan.pallets_by_cbm(cbm, '1m2')) if cbm else 0
+        data['pallet_1m9'] = float(loadplan.pallets_by_cbm(cbm, '1m9')) if cbm else 0
+        grand_total_pallet_1m2 += data['pallet_1m2']
+        grand_total_pallet_1m9 += data['pallet_1m9']
+        grouped_data[fdc] = data
+
+    first = all_items[0]
+    return {
+        'do_no': do_no,
+        'grouped_data': grouped_data,
+        'date': first['datercv'],
+        'container': first.get('container') or first.get('contxe') or '',
+        'total_pallet_1m2': grand_total_pallet_1m2,
+        'total_pallet_1m9': grand_total_pallet_1m9,
+        'total_pallets': float(pallets.sum()),
+        'total_weight': float(weights.sum()),
+        # Dự kiến số container (First-Fit Decreasing theo CBM và trọng lượng từng dòng)
+        'containers': loadplan.plan_containers(cbms, weights),
+    }
+
+
+def deliverynote_context(do_no, items):
+    """Biến cho print_deliverynote.html từ các dòng của một Job No (theo thứ tự nhập, tức id)"""
+    items = sorted(items, key=lambda item: item['id'])
+    first = items[0]
+    return {
+        'do_no': do_no,
+        'items': items,
+        'total_qty': sum(item['carton'] for item in items),
+        'total_cbm': sum(item['cbm'] for item in items),
+        'date': first['datercv'],
+        'container': first.get('container') or first.get('contxe') or '',
+        'seal': first.get('seal', ''),
+        'customer': first.get('customer', ''),
+    }
+
+
+def batch_context(doc, grouped):
+    """Danh sách biến template cho từng Job No (đã sắp xếp)"""
+    docs = []
+    for jobno, groups in grouped.items():
+        if doc == 'deliverynote':
+            docs.append(deliverynote_context(jobno, [item for items in groups.values() for item in items]))
+        else:
+            docs.append(pickinglist_context(jobno, groups))
+    return docs
+
+
+def cached_render(cursor, doc, jobnos, render):
+    """HTML in hàng loạt cho tập Job No; render(grouped) chỉ được gọi khi cache hết hạn"""
+    keys = [versions.outbound_key(j) for j in jobnos] + [refdata.key('masterdata')]
+    stamp = versions.get(cursor, keys)
+    cache_key = (doc, tuple(sorted(jobnos)))
+    with _cache_lock:
+        hit = _cache.get(cache_key)
+        if hit and hit[0] == stamp:
+            _cache.move_to_end(cache_key)
+            return hit[1]
+
+    html = render(fetch_grouped(cursor, jobnos))
+    with _cache_lock:
+        _cache[cache_key] = (stamp, html)
+        _cache.move_to_end(cache_key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return html
@@ -0,0 +1,97 @@
+"""Cache dữ liệu tham chiếu (masterdata, nhacungcap) trong bộ nhớ của worker.
+
+Mỗi bảng được nạp toàn bộ một lần thành cấu trúc tra cứu gọn (dict theo khóa) và lưu kèm
+phiên bản dữ liệu (versions.py, khóa 'ref:<bảng>'). Mỗi lần dùng chỉ đọc số phiên bản
+(một truy vấn theo khóa chính); chỉ nạp lại khi route ghi của bảng đó đã tăng phiên bản,
+kể cả từ worker khác.
+"""
+import threading
+from typing import NamedTuple
+
+import versions
+
+
+class SkuInfo(NamedTuple):
+    MANCC: str
+    cbm: float
+    loosecase: str
+    kindpallet: str
+    remark: str  # Đã strip; '' nếu không có
+
+
+def _values(row):
+    return tuple(row.values()) if isinstance(row, dict) else row
+
+
+def _load_masterdata(cursor):
+    cursor.execute("SELECT sku, MANCC, cbm, loosecase, kindpallet, remark FROM masterdata")
+    data = {}
+    for row in cursor.fetchall():
+        sku, mancc, cbm, loosecase, kindpallet, remark = _values(row)
+        data[sku] = SkuInfo(mancc or '', float(cbm) if cbm else 0.0, loosecase or '', kindpallet or '',
+                            str(remark).strip() if remark else '')
+    return data
+
+
+def _load_suppliers(cursor):
+    cursor.execute("SELECT MANCC, TENNCC FROM nhacungcap ORDER BY MANCC")
+    return {mancc: tenncc or '' for mancc, tenncc in (_values(r) for r in cursor.fetchall())}
+
+
+LOADERS = {'masterdata': _load_masterdata, 'nhacungcap': _load_suppliers}
+
+_cache = {}  # bảng -> (phiên bản, dữ liệu)
+_lock = threading.Lock()
+_load_lock = threading.Lock()  # Chỉ một thread nạp lại tại một thời điểm
+stats = {table: {'hits': 0, 'misses': 0, 'size': 0} for table in LOADERS}
+
+
+def key(table):
+    return f"ref:{table}"
+
+
+def bump(cursor, *tables):
+    """Đánh dấu bảng tham chiếu đã đổi (gọi trước conn.commit() của route ghi)"""
+    versions.bump(cursor, [key(t) for t in tables])
+
+
+def get(cursor, table):
+    """Dữ liệu đã cache của bảng; nạp lại nếu phiên bản trong Database khác bản đang giữ"""
+    version = versions.get(cursor, [key(table)])[key(table)]
+    with _lock:
+        hit = _cache.get(table)
+        if hit and hit[0] == version:
+            stats[table]['hits'] += 1
+            return hit[1]
+    with _load_lock:
+        with _lock:
+            hit = _cache.get(table)
+            if hit and hit[0] == version:
+                stats[table]['hits'] += 1
+                return hit[1]
+        data = LOADERS[table](cursor)
+        with _lock:
+            _cache[table] = (version, data)
+            stats[table]['misses'] += 1
+            stats[table]['size'] = len(data)
+    return data
+
+
+def masterdata(cursor):
+    """{sku: SkuInfo}"""
+    return get(cursor, 'masterdata')
+
+
+def suppliers(cursor):
+    """{MANCC: TENNCC} theo thứ tự MANCC"""
+    return get(cursor, 'nhacungcap')
+
+
+def supplier_options(cursor):
+    """Danh sách NCC cho dropdown (dict MANCC/TENNCC như kết quả SELECT cũ)"""
+    return [{'MANCC': mancc, 'TENNCC': tenncc} for mancc, tenncc in suppliers(cursor).items()]
+
+
+def get_stats():
+    with _lock:
+        return {table: dict(s) for table, s in stats.items()}
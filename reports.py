@@ -0,0 +1,299 @@
+"""Báo cáo định kỳ (tạo file + gửi email), chạy bởi worker.py thay vì trong gunicorn worker.
+
+Mỗi lần chạy được ghi vào bảng report_runs (kỳ báo cáo, trạng thái, số lần thử). Một kỳ đã
+gửi thành công sẽ không gửi lại, kể cả khi worker khởi động lại và chạy bù lịch bị lỡ.
+Chỉ một tiến trình được chạy báo cáo tại một thời điểm nhờ MySQL GET_LOCK (RunnerLock).
+Lỗi tạm thời (Database, SMTP) được thử lại với thời gian chờ tăng dần.
+"""
+import os
+import smtplib
+import time
+import traceback
+from datetime import date, datetime
+from email import encoders
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from io import BytesIO
+from typing import Callable, NamedTuple
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+
+from db import get_db_connection, get_dedicated_connection
+
+TIMEZONE = os.getenv("REPORT_TIMEZONE") or "Asia/Ho_Chi_Minh"
+RETRIES = int(os.getenv("REPORT_RETRIES") or 3)                # Số lần thử tối đa cho một lần chạy
+RETRY_DELAY = int(os.getenv("REPORT_RETRY_DELAY") or 60)       # Số giây chờ trước lần thử lại đầu tiên
+LOCK_NAME = "wms_report_worker"
+
+
+class ConfigError(Exception):
+    """Lỗi cấu hình (thiếu biến môi trường): không thử lại"""
+
+
+# === OUTSOURCE ===
+def outsource_period(today=None):
+    """Kỳ báo cáo Outsource: từ ngày 21 tháng trước đến ngày 20 tháng này"""
+    today = today or datetime.now(ZoneInfo(TIMEZONE)).date()
+    end = date(today.year, today.month, 20)
+    if today.month == 1:
+        start = date(today.year - 1, 12, 21)
+    else:
+        start = date(today.year, today.month - 1, 21)
+    return start, end
+
+
+OUTSOURCE_SQL = """
+    SELECT
+        i.datercv as `Ngày nhập`,
+        i.contxe as `Cont/Xe`,
+        SUM(i.carton) as `Tổng Số Carton`,
+        SUM(i.cbm) as `Tổng CBM`
+    FROM inbound i
+    WHERE i.labour = 'Outsource'
+    AND i.datercv >= %s AND i.datercv <= %s
+    GROUP BY i.datercv, i.contxe
+    ORDER BY i.datercv ASC
+"""
+
+
+def generate_outsource_data(start=None, end=None):
+    """Tạo file Excel báo cáo Outsource (dùng chung cho Export và Email)"""
+    if start is None or end is None:
+        start, end = outsource_period()
+    conn = get_db_connection()
+    if not conn: return None, None
+
+    start_str = start.strftime('%Y-%m-%d')
+    end_str = end.strftime('%Y-%m-%d')
+
+    df = pd.read_sql(OUTSOURCE_SQL, conn, params=(start_str, end_str))
+    conn.close()
+
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name='Outsource Report')
+    output.seek(0)
+
+    filename = f"Outsource_Report_{start_str}_{end_str}.xlsx"
+    return output, filename
+
+
+def send_outsource_report(start, end):
+    excel_file, filename = generate_outsource_data(start, end)
+    if not excel_file:
+        raise RuntimeError("Không thể tạo file báo cáo (lỗi kết nối Database)")
+
+    sender = mailer.sender()
+    recipients = [r.strip() for r in os.getenv("MAIL_RECIPIENTS", "").split(',') if r.strip()]
+    if not recipients:
+        raise ConfigError("Thiếu MAIL_RECIPIENTS trong .env")
+
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = ", ".join(recipients)
+    msg['Subject'] = f"Báo cáo Outsource Định Kỳ - {filename}"
+
+    body = f"Kính gửi,\n\nĐính kèm là báo cáo Outsource từ ngày 21 tháng trước đến ngày 20 tháng này.\n\nTrân trọng,\nWMS System"
+    msg.attach(MIMEText(body, 'plain'))
+
+    part = MIMEBase('application', 'octet-stream')
+    part.set_payload(excel_file.read())
+    encoders.encode_base64(part)
+    part.add_header('Content-Disposition', f'attachment; filename= {filename}')
+    msg.attach(part)
+
+    mailer.send(msg, recipients)
+    return f"Đã gửi {filename} đến: {', '.join(recipients)}"
+
+
+class Report(NamedTuple):
+    func: Callable    # func(start, end) -> message
+    period: Callable  # period() -> (start, end) của lần chạy hiện tại
+    cron: dict        # Lịch chạy (tham số CronTrigger của APScheduler)
+
+
+REPORTS = {
+    'outsource_email': Report(send_outsource_report, outsource_period, {'day': 20, 'hour': 8}),
+}
+
+
+# === SMTP ===
+class Mailer:
+    """Giữ một kết nối SMTP dùng lại giữa các lần gửi; kiểm tra bằng NOOP, tự kết nối lại"""
+
+    def __init__(self):
+        self._server = None
+
+    def sender(self):
+        sender = os.getenv("MAIL_USERNAME")
+        if not (sender and os.getenv("MAIL_PASSWORD")):
+            raise ConfigError("Thiếu cấu hình Email trong .env")
+        return sender
+
+    def _connect(self):
+        server = smtplib.SMTP(os.getenv("MAIL_SERVER", "smtp.gmail.com"), int(os.getenv("MAIL_PORT") or 587),
+                              timeout=30)
+        server.starttls()
+        server.login(self.sender(), os.getenv("MAIL_PASSWORD"))
+        self._server = server
+
+    def _alive(self):
+        if self._server is None:
+            return False
+        try:
+            return self._server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def send(self, msg, recipients):
+        if not self._alive():
+            self.close()
+            self._connect()
+        try:
+            self._server.send_message(msg, self.sender(), recipients)
+        except smtplib.SMTPServerDisconnected:
+            # Server đóng kết nối giữa NOOP và lúc gửi: kết nối lại một lần
+            self._connect()
+            self._server.send_message(msg, self.sender(), recipients)
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+
+mailer = Mailer()
+
+
+# === LOCK ===
+class RunnerLock:
+    """GET_LOCK giữ trên một kết nối riêng suốt đời tiến trình (mất kết nối thì MySQL tự nhả khóa)"""
+
+    def __init__(self, name):
+        self.name = name
+        self._conn = None
+
+    def _query(self, sql):
+        cursor = self._conn.cursor()
+        cursor.execute(sql, (self.name,))
+        value = cursor.fetchone()[0]
+        cursor.close()
+        return value
+
+    def ensure(self):
+        """True nếu tiến trình này đang giữ khóa; thử lấy khóa (không chờ) nếu chưa giữ"""
+        if self._conn is not None:
+            try:
+                if self._query("SELECT IS_USED_LOCK(%s) = CONNECTION_ID()") == 1:
+                    return True
+            except Exception:
+                pass
+            self.release()
+        conn = get_dedicated_connection()
+        if not conn:
+            return False
+        self._conn = conn
+        try:
+            if self._query("SELECT GET_LOCK(%s, 0)") == 1:
+                return True
+        except Exception:
+            traceback.print_exc()
+        self.release()
+        return False
+
+    def release(self):
+        if self._conn is not None:
+            try:
+                self._query("SELECT RELEASE_LOCK(%s)")
+            except Exception:
+                pass
+            self._conn.close()
+            self._conn = None
+
+
+runner = RunnerLock(LOCK_NAME)
+
+
+# === RUN HISTORY ===
+def _already_sent(cursor, name, end):
+    cursor.execute("SELECT id FROM report_runs WHERE job = %s AND period_end = %s AND status = 'done' LIMIT 1",
+                   (name, end))
+    return cursor.fetchone() is not None
+
+
+def _record(run_id=None, **fields):
+    """Ghi lịch sử chạy qua kết nối riêng (commit ngay); trả về id của lần chạy"""
+    conn = get_db_connection()
+    if not conn:
+        return run_id
+    cursor = conn.cursor()
+    if run_id is None:
+        cursor.execute(f"INSERT INTO report_runs ({', '.join(fields)}) VALUES ({', '.join(['%s'] * len(fields))})",
+                       list(fields.values()))
+        run_id = cursor.lastrowid
+    else:
+        sets = ", ".join(f"{k} = %s" for k in fields)
+        cursor.execute(f"UPDATE report_runs SET {sets}, finished_at = NOW() WHERE id = %s",
+                       list(fields.values()) + [run_id])
+    conn.commit()
+    cursor.close()
+    conn.close()
+    return run_id
+
+
+def run(name, force=False):
+    """Chạy một báo cáo (job của worker); trả về trạng thái 'done' / 'skipped' / 'error'"""
+    report = REPORTS[name]
+    if not runner.ensure():
+        print(f"⏭️  {name}: tiến trình khác đang giữ khóa chạy báo cáo, bỏ qua.")
+        return 'skipped'
+
+    start, end = report.period()
+    conn = get_db_connection()
+    if not conn:
+        print(f"❌ {name}: không kết nối được Database")
+        return 'error'
+    cursor = conn.cursor()
+    sent = _already_sent(cursor, name, end)
+    cursor.close()
+    conn.close()
+    if sent and not force:
+        print(f"⏭️  {name}: kỳ {start} → {end} đã gửi, bỏ qua.")
+        return 'skipped'
+
+    run_id = _record(job=name, period_start=start, period_end=end, status='running', attempts=0)
+    for attempt in range(1, RETRIES + 1):
+        try:
+            message = report.func(start, end)
+        except ConfigError as e:
+            _record(run_id, status='error', attempts=attempt, message=str(e))
+            print(f"❌ {name}: {e}")
+            return 'error'
+        except Exception as e:
+            traceback.print_exc()
+            mailer.close()
+            if attempt == RETRIES:
+                _record(run_id, status='error', attempts=attempt, message=f"Lỗi sau {attempt} lần thử: {e}")
+                print(f"❌ {name}: lỗi sau {attempt} lần thử: {e}")
+                return 'error'
+            delay = RETRY_DELAY * 2 ** (attempt - 1)
+            _record(run_id, status='retrying', attempts=attempt, message=str(e))
+            print(f"🔁 {name}: lần {attempt} lỗi ({e}), thử lại sau {delay}s")
+            time.sleep(delay)
+        else:
+            _record(run_id, status='done', attempts=attempt, message=message)
+            print(f"✅ {name}: {message}")
+            return 'done'
+
+
+def recent_runs(cursor, limit=20):
+    cursor.execute("""
+        SELECT id, job, period_start, period_end, status, attempts, message, started_at, finished_at
+        FROM report_runs ORDER BY id DESC LIMIT %s
+    """, (limit,))
+    return cursor.fetchall()
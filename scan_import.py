@@ -0,0 +1,218 @@
+"""Import file Scan (SSCC) cho một Job No (chạy trong job nền).
+
+Mỗi file được đọc một lần (header=None); các cột B–O được lấy theo vị trí cho cả cột,
+tag_label / jobno_type tính bằng phép toán trên cột. Khi upload nhiều file, các file được
+đọc song song trong process pool, gộp lại rồi ghi theo từng lô trong một transaction.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import refdata
+import versions
+from db import insert_batches, select_in
+
+INSERT_SQL = "INSERT INTO scanfile (jobno, release_key, sscc, master_delivery, qty, master_ctl, master_st_company, master_add1,master_add2,master_add3,master_add4,ship_to,st_zip,barcode,sku,tag_label,jobno_type, pallet, pallet_type, time_scan,jobscan) VALUES (%s, %s, %s, %s, %s, %s, %s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s, %s, %s, %s,%s)"
+
+# Truy vấn dùng trong route của app.py (migrations.py check EXPLAIN đúng các câu này)
+DETAILS_SQL = """
+    SELECT release_key, COUNT(sscc) as sscc_count
+    FROM scanfile
+    WHERE jobno = %s AND sku = %s
+    GROUP BY release_key
+    ORDER BY release_key
+"""
+DELETE_JOB_SQL = "DELETE FROM scanfile WHERE jobno = %s"
+
+# Cột B..O của file scan theo vị trí (A=0, B=1, ...)
+SCAN_COLUMNS = ['release_key', 'sscc', 'master_delivery', 'qty', 'master_ctl', 'master_st_company',
+                'master_add1', 'master_add2', 'master_add3', 'master_add4', 'ship_to', 'st_zip', 'barcode', 'sku']
+FIRST_COLUMN = 1
+MIN_COLUMNS = FIRST_COLUMN + len(SCAN_COLUMNS)  # Cần tới cột O
+
+PARSE_WORKERS = int(os.getenv("SCAN_PARSE_WORKERS") or 4)  # Số process đọc file song song
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def read_scan_file(path, filename):
+    """Đọc file scan đúng một lần, mọi ô dạng chuỗi, không dùng dòng tiêu đề"""
+    if filename.lower().endswith('.csv'):
+        return pd.read_csv(path, header=None, dtype=str)
+    return pd.read_excel(path, header=None, dtype=str)
+
+
+def parse_scan_rows(df, jobno, time_scan):
+    """DataFrame các cột scanfile (chưa có tag_label) từ file đọc bằng read_scan_file.
+
+    Ô trống -> '', qty không phải số -> 0; bỏ dòng không có SSCC lẫn Release Key và dòng
+    tiêu đề (ô SSCC không chứa chữ số).
+    """
+    if df.shape[1] < MIN_COLUMNS:
+        return pd.DataFrame(columns=['jobno'] + SCAN_COLUMNS + ['jobno_type', 'pallet', 'pallet_type', 'time_scan', 'jobscan'])
+
+    raw = df.iloc[:, FIRST_COLUMN:MIN_COLUMNS].copy()
+    raw.columns = SCAN_COLUMNS
+    out = raw.fillna('').apply(lambda col: col.str.strip())
+    out['qty'] = pd.to_numeric(out['qty'], errors='coerce').fillna(0).astype(float)
+
+    keep = (out['sscc'] != '') | (out['release_key'] != '')
+    # Dòng tiêu đề (nếu có): ô SSCC có chữ nhưng không có chữ số
+    first = out['sscc'].iloc[0] if len(out) else ''
+    if first and not any(c.isdigit() for c in first):
+        keep.iloc[0] = False
+    out = out[keep].copy()
+
+    jobno = jobno.strip()
+    out.insert(0, 'jobno', jobno)
+    out['jobno_type'] = jobno + '_' + out['master_delivery'].str[:3]
+    out['pallet'] = ''
+    out['pallet_type'] = ''
+    out['time_scan'] = time_scan
+    out['jobscan'] = ''
+    return out
+
+
+def tag_labels(skus, remarks):
+    """'Y' nếu SKU trùng remark của chính SKU đó trong Master Data, ngược lại 'N'"""
+    return (skus.map(remarks).fillna('') == skus).map({True: 'Y', False: 'N'})
+
+
+def load_remarks(cursor, skus):
+    """Remark Master Data (đã strip) của các SKU có trong file, từ cache refdata"""
+    master = refdata.masterdata(cursor)
+    return {sku: master[sku].remark for sku in skus if sku in master and master[sku].remark}
+
+
+def insert_rows(parsed):
+    """Tuple theo thứ tự cột của INSERT_SQL"""
+    return list(zip(parsed['jobno'], *(parsed[c] for c in SCAN_COLUMNS), parsed['tag_label'], parsed['jobno_type'],
+                    parsed['pallet'], parsed['pallet_type'], parsed['time_scan'], parsed['jobscan']))
+
+
+def existing_ssccs(cursor, jobno, ssccs, all_jobs=False):
+    """SSCC đã có trong scanfile: của Job No này, hoặc của mọi Job No nếu all_jobs"""
+    if all_jobs:
+        rows = select_in(cursor, "SELECT DISTINCT sscc FROM scanfile WHERE sscc IN ({placeholders})", ssccs)
+    else:
+        rows = select_in(cursor, "SELECT DISTINCT sscc FROM scanfile WHERE jobno = %s AND sscc IN ({placeholders})",
+                         ssccs, params=(jobno,))
+    return {row['sscc'] for row in rows}
+
+
+def duplicate_mask(ssccs, seen):
+    """True cho SSCC đã có trong seen hoặc lặp lại trong chính file (giữ lần đầu); SSCC rỗng không tính.
+
+    seen được cập nhật thêm các SSCC mới của file.
+    """
+    present = ssccs != ''
+    mask = present & (ssccs.isin(seen) | ssccs.duplicated())
+    seen.update(ssccs[present & ~mask])
+    return mask
+
+
+def duplicate_report(cursor, jobno):
+    """SSCC lặp trong Job No và SSCC của Job No đã có ở Job No khác (dùng index jobno, sscc)"""
+    cursor.execute("""
+        SELECT sscc, COUNT(*) as count FROM scanfile
+        WHERE jobno = %s AND sscc IS NOT NULL AND sscc != ''
+        GROUP BY sscc HAVING COUNT(*) > 1 ORDER BY sscc
+    """, (jobno,))
+    within = cursor.fetchall()
+    cursor.execute("""
+        SELECT s.sscc, o.jobno as other_jobno, COUNT(*) as count
+        FROM (SELECT DISTINCT sscc FROM scanfile WHERE jobno = %s AND sscc IS NOT NULL AND sscc != '') s
+        JOIN scanfile o ON o.sscc = s.sscc AND o.jobno != %s
+        GROUP BY s.sscc, o.jobno ORDER BY s.sscc, o.jobno
+    """, (jobno, jobno))
+    return {'jobno': jobno, 'within_job': within, 'other_jobs': cursor.fetchall()}
+
+
+def parse_file(path, filename, jobno, time_scan):
+    """Đọc và parse một file scan (chạy trong process con); trả về (số dòng đọc, DataFrame)"""
+    df = read_scan_file(path, filename)
+    return len(df), parse_scan_rows(df, jobno, time_scan)
+
+
+def _get_pool():
+    # Process pool tạo sau khi gunicorn fork worker; spawn vì worker đang chạy nhiều thread
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+            _pool_pid = os.getpid()
+    return _pool
+
+
+def parse_files(files, jobno, on_parsed=None):
+    """Parse các file (song song nếu có nhiều file), trả về list (tên file, DataFrame) theo thứ tự upload.
+
+    on_parsed(n) được gọi khi mỗi file đọc xong, dùng để báo tiến độ.
+    """
+    time_scan = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if len(files) < 2 or PARSE_WORKERS < 2:
+        results = []
+        for path, filename in files:
+            n, parsed = parse_file(path, filename, jobno, time_scan)
+            if on_parsed:
+                on_parsed(n)
+            results.append((filename, parsed))
+        return results
+
+    futures = [_get_pool().submit(parse_file, path, filename, jobno, time_scan) for path, filename in files]
+    by_future = {f: i for i, f in enumerate(futures)}
+    parsed = [None] * len(files)
+    for future in as_completed(futures):
+        n, parsed[by_future[future]] = future.result()
+        if on_parsed:
+            on_parsed(n)
+    return [(filename, frame) for (_, filename), frame in zip(files, parsed)]
+
+
+def import_job(conn, job, files, jobno, replace, all_jobs=False):
+    parsed_files = parse_files(files, jobno, on_parsed=lambda n: job.progress(parsed=n))
+    if not parsed_files:
+        return "Không tìm thấy dữ liệu hợp lệ trong các file.", "warning"
+
+    cursor = conn.cursor(dictionary=True)
+    if replace:
+        cursor.execute("DELETE FROM scanfile WHERE jobno = %s", (jobno,))
+
+    merged = pd.concat([frame for _, frame in parsed_files], ignore_index=True)
+    merged['tag_label'] = tag_labels(merged['sku'], load_remarks(cursor, merged['sku'].unique().tolist()))
+    seen = existing_ssccs(cursor, jobno.strip(), merged['sscc'].unique().tolist(), all_jobs)
+
+    # Đánh dấu trùng theo thứ tự file để số dòng từng file giống khi import lần lượt
+    keep = []
+    total_duplicates = 0
+    file_details = []
+    for filename, frame in parsed_files:
+        duplicates = duplicate_mask(frame['sscc'], seen)
+        n_dup = int(duplicates.sum())
+        dup_note = f", {n_dup} SSCC trùng bị bỏ qua" if n_dup else ""
+        file_details.append(f"{filename} ({len(frame) - n_dup} dòng{dup_note})")
+        total_duplicates += n_dup
+        keep.append(~duplicates.to_numpy())
+
+    inserts = insert_rows(merged[np.concatenate(keep)])
+    total_inserted = insert_batches(cursor, INSERT_SQL, inserts, on_batch=lambda n: job.progress(written=n))
+
+    stamps = [versions.scanfile_key(jobno), versions.scanfile_key(jobno.strip())]
+    if replace:
+        # Scan máy cầm tay nhận trước khi thay thế không được ghi đè lên dữ liệu mới
+        stamps.append(versions.scanreset_key(jobno.strip()))
+    versions.bump(cursor, stamps)
+    conn.commit()
+    if total_inserted > 0:
+        category = "warning" if total_duplicates else "success"
+        return f"Đã import tổng cộng {total_inserted} dòng scan cho Job No: {jobno}. Chi tiết: {', '.join(file_details)}", category
+    if total_duplicates:
+        return f"Tất cả SSCC đều đã được import. Chi tiết: {', '.join(file_details)}", "warning"
+    return "Không tìm thấy dữ liệu hợp lệ trong các file.", "warning"
@@ -0,0 +1,374 @@
+"""Nhận scan SSCC trực tiếp từ máy quét cầm tay và đối chiếu Job No theo thời gian thực.
+
+Scan được ghi vào hàng đợi trong bộ nhớ (write-behind); một thread nền của worker gom
+và INSERT vào scanfile theo lô. Mỗi Job No có bộ đếm trong bộ nhớ (ordered / scanned /
+lỗi tag label theo SKU), được nạp một lần từ Database rồi cập nhật ngay khi nhận scan,
+nên trang đối chiếu và API poll không phải GROUP BY lại. Bộ đếm lưu kèm phiên bản dữ liệu
+(versions.py) của outbound và scanfile; khi worker khác hoặc import file thay đổi dữ liệu
+thì bộ đếm được nạp lại.
+
+Scan được kiểm tra độ dài/kiểu trước khi nhận; dòng vẫn bị Database từ chối khi ghi được
+chuyển vào bảng scan_dead_letter, không làm kẹt các scan khác. Hàng đợi có giới hạn
+(MAX_QUEUE): khi đầy, API trả lỗi để máy quét gửi lại thay vì nhận rồi làm mất scan.
+
+Mỗi worker có hàng đợi riêng, nên lúc ghi (khóa dòng phiên bản của Job No) kiểm tra lại:
+scan nhận trước khi Job No bị xóa / import thay thế (khóa 'scanreset:<jobno>' đã tăng) bị
+bỏ, SSCC đã được worker khác ghi trước bị chuyển vào scan_dead_letter.
+"""
+import atexit
+import json
+import math
+import os
+import threading
+import time
+import traceback
+from datetime import datetime
+
+import mysql.connector
+
+import scan_import
+import versions
+from db import get_dedicated_connection, insert_batches
+
+FLUSH_SIZE = int(os.getenv("SCAN_FLUSH_SIZE") or 500)          # Số scan tối đa mỗi lần ghi
+FLUSH_INTERVAL = float(os.getenv("SCAN_FLUSH_INTERVAL") or 1)  # Số giây tối đa một scan nằm trong hàng đợi
+MAX_BATCH = 500                                                # Số scan tối đa mỗi request
+MAX_COUNTERS = 200                                             # Số Job No giữ bộ đếm trong bộ nhớ
+MAX_QUEUE = int(os.getenv("SCAN_MAX_QUEUE") or 20000)          # Số scan tối đa chờ ghi; đầy thì từ chối scan mới
+
+# Trường JSON tùy chọn của một scan (ngoài sscc) -> cột scanfile
+SCAN_FIELDS = ['release_key', 'master_delivery', 'qty', 'master_ctl', 'master_st_company', 'master_add1',
+               'master_add2', 'master_add3', 'master_add4', 'ship_to', 'st_zip', 'barcode', 'sku']
+# Độ dài tối đa của cột scanfile (strict mode báo lỗi thay vì cắt bớt)
+FIELD_LENGTHS = {'jobno': 100, 'sscc': 100, 'release_key': 100, 'master_delivery': 100, 'master_ctl': 100,
+                 'master_st_company': 255, 'master_add1': 255, 'master_add2': 255, 'master_add3': 255,
+                 'master_add4': 255, 'ship_to': 100, 'st_zip': 50, 'barcode': 100, 'sku': 100}
+
+
+class QueueFull(Exception):
+    """Hàng đợi ghi đã đầy (Database chậm hoặc lỗi): máy quét gửi lại sau"""
+
+
+class JobCounters:
+    """Số liệu đối chiếu của một Job No: ordered / scanned / lỗi tag label theo SKU"""
+
+    def __init__(self, jobno, stamp, ordered, scanned, errors, ssccs):
+        self.jobno = jobno
+        self.stamp = stamp
+        self.ssccs = ssccs  # SSCC đã scan của Job No (phát hiện trùng)
+        self.ordered = ordered
+        self.scanned = scanned
+        self.errors = errors
+        self.total_ordered = sum(ordered.values())
+        self.total_scanned = sum(scanned.values())
+        self.total_errors = sum(errors.values())
+
+    def add(self, sscc, sku, tag_label):
+        self.ssccs.add(sscc)
+        self.scanned[sku] = self.scanned.get(sku, 0) + 1
+        self.total_scanned += 1
+        if tag_label == 'N':
+            self.errors[sku] = self.errors.get(sku, 0) + 1
+            self.total_errors += 1
+
+    def summary(self):
+        return {'total_ordered': self.total_ordered, 'total_scanned': self.total_scanned,
+                'diff': self.total_scanned - self.total_ordered, 'tag_errors': self.total_errors}
+
+    def line(self, sku):
+        ordered = self.ordered.get(sku, 0)
+        scanned = self.scanned.get(sku, 0)
+        errors = self.errors.get(sku, 0)
+        # Giống MAX(tag_label): 'Y' nếu có ít nhất một scan đúng tem
+        tag_label = 'Y' if scanned > errors else ('N' if scanned else '')
+        return {'sku': sku, 'ordered': ordered, 'scanned': scanned, 'diff': scanned - ordered,
+                'tag_error': errors, 'tag_label': tag_label}
+
+    def comparison(self):
+        return [self.line(sku) for sku in self.ordered.keys() | self.scanned.keys()]
+
+
+_counters = {}
+_buffer = []       # (phiên bản scanreset lúc nhận, tuple theo thứ tự cột của scan_import.INSERT_SQL), chưa ghi
+_lock = threading.Condition()
+_flush_lock = threading.Lock()  # Một lần ghi hoặc một lần nạp bộ đếm tại một thời điểm
+_flusher = None
+_flusher_pid = None
+stats = {'hits': 0, 'seeds': 0, 'accepted': 0, 'rejected': 0, 'duplicates': 0, 'queue_full': 0, 'flushed': 0,
+         'flush_failures': 0, 'dead_letters': 0, 'dropped': 0}
+
+
+def _stamp_keys(jobno):
+    return [versions.outbound_key(jobno), versions.scanfile_key(jobno), versions.scanreset_key(jobno)]
+
+
+def _seed(cursor, jobno):
+    """Nạp bộ đếm từ Database (cộng cả scan còn trong hàng đợi của worker này)"""
+    stamp = versions.get(cursor, _stamp_keys(jobno))
+    cursor.execute("SELECT sku, SUM(carton) as ordered_qty FROM outbound WHERE jobno = %s GROUP BY sku", (jobno,))
+    ordered = {row['sku']: float(row['ordered_qty']) for row in cursor.fetchall()}
+    cursor.execute("""
+        SELECT sku, COUNT(sscc) as scanned_qty, SUM(CASE WHEN tag_label = 'N' THEN 1 ELSE 0 END) as error_labels
+        FROM scanfile WHERE jobno = %s GROUP BY sku
+    """, (jobno,))
+    scanned = {}
+    errors = {}
+    for row in cursor.fetchall():
+        scanned[row['sku']] = int(row['scanned_qty'])
+        if row['error_labels']:
+            errors[row['sku']] = int(row['error_labels'])
+    cursor.execute("SELECT DISTINCT sscc FROM scanfile WHERE jobno = %s AND sscc IS NOT NULL AND sscc != ''", (jobno,))
+    ssccs = {row['sscc'] for row in cursor.fetchall()}
+    counters = JobCounters(jobno, stamp, ordered, scanned, errors, ssccs)
+    reset = stamp[versions.scanreset_key(jobno)]
+    with _lock:
+        for accepted_at, row in _buffer:
+            if row[0] == jobno and accepted_at == reset:
+                counters.add(row[2], row[14], row[15])
+    return counters
+
+
+def get_counters(cursor, jobno):
+    """Bộ đếm của Job No; chỉ GROUP BY lại khi phiên bản outbound/scanfile đã đổi"""
+    stamp = versions.get(cursor, _stamp_keys(jobno))
+    with _lock:
+        counters = _counters.get(jobno)
+        if counters is not None and counters.stamp == stamp:
+            stats['hits'] += 1
+            return counters
+
+    with _flush_lock:
+        counters = _seed(cursor, jobno)
+    with _lock:
+        stats['seeds'] += 1
+        _counters.pop(jobno, None)
+        _counters[jobno] = counters
+        while len(_counters) > MAX_COUNTERS:
+            _counters.pop(next(iter(_counters)))
+    return counters
+
+
+def _scan_row(jobno, scan, tag_label, time_scan):
+    """(tuple theo thứ tự cột của scan_import.INSERT_SQL, None) hoặc (None, lý do từ chối)"""
+    values = {f: str(scan.get(f) or '').strip() for f in SCAN_FIELDS}
+    sscc = str(scan.get('sscc') or '').strip()
+    if not sscc:
+        return None, "thiếu SSCC"
+    too_long = [f for f, v in dict(values, sscc=sscc).items() if f in FIELD_LENGTHS and len(v) > FIELD_LENGTHS[f]]
+    if too_long:
+        return None, f"quá dài: {', '.join(too_long)}"
+    try:
+        qty = float(values['qty']) if values['qty'] else 1.0
+    except ValueError:
+        qty = math.nan
+    if not math.isfinite(qty):
+        return None, "qty không phải số"
+    return (jobno, values['release_key'], sscc, values['master_delivery'], qty, values['master_ctl'],
+            values['master_st_company'], values['master_add1'], values['master_add2'], values['master_add3'],
+            values['master_add4'], values['ship_to'], values['st_zip'], values['barcode'], values['sku'],
+            tag_label(values['sku']), f"{jobno}_{values['master_delivery'][:3]}", '', '', time_scan, ''), None
+
+
+def ingest(cursor, jobno, scans, all_jobs=False):
+    """Nhận các scan của một Job No: cập nhật bộ đếm ngay, đưa vào hàng đợi ghi.
+
+    SSCC đã scan cho Job No (hoặc cho mọi Job No nếu all_jobs) bị bỏ qua.
+    Trả về (số scan nhận, [{'index', 'reason'}] scan không hợp lệ, vị trí scan trùng SSCC, bộ đếm).
+    Báo QueueFull (không nhận scan nào) khi hàng đợi ghi đã đầy.
+    """
+    jobno = jobno.strip()
+    counters = get_counters(cursor, jobno)
+    skus = {str(s.get('sku') or '').strip() for s in scans}
+    remarks = scan_import.load_remarks(cursor, skus)
+
+    time_scan = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    rows = []
+    rejected = []
+    for i, scan in enumerate(scans):
+        row, reason = _scan_row(jobno, scan, lambda sku: 'Y' if remarks.get(sku, '') == sku else 'N', time_scan)
+        if row is None:
+            rejected.append({'index': i, 'reason': reason})
+        else:
+            rows.append((i, row))
+    other_jobs = scan_import.existing_ssccs(cursor, jobno, [row[2] for _, row in rows], all_jobs=True) if all_jobs else set()
+
+    _ensure_flusher()
+    accepted = []
+    duplicates = []
+    with _lock:
+        if len(_buffer) + len(rows) > MAX_QUEUE:
+            stats['queue_full'] += 1
+            raise QueueFull(f"Hàng đợi ghi scan đã đầy ({len(_buffer)} scan chưa ghi), thử lại sau")
+        for i, row in rows:
+            if row[2] in counters.ssccs or row[2] in other_jobs:
+                duplicates.append(i)
+                continue
+            counters.add(row[2], row[14], row[15])
+            accepted.append(row)
+        reset = counters.stamp[versions.scanreset_key(jobno)]
+        _buffer.extend((reset, row) for row in accepted)
+        stats['accepted'] += len(accepted)
+        stats['rejected'] += len(rejected)
+        stats['duplicates'] += len(duplicates)
+        if len(_buffer) >= FLUSH_SIZE:
+            _lock.notify()
+    return len(accepted), rejected, duplicates, counters
+
+
+# Lỗi của chính dòng dữ liệu: quá dài, sai kiểu, NULL không hợp lệ, trùng khóa, sai khóa ngoại
+DATA_ERRNOS = {1048, 1062, 1264, 1265, 1292, 1366, 1406, 1452}
+
+
+def _is_data_error(e):
+    """True nếu Database từ chối chính dòng dữ liệu (ghi lại cũng lỗi): chuyển vào dead letter.
+
+    Lỗi khác (mất kết nối, lock wait timeout 1205, deadlock 1213, thiếu bảng/cột...) là lỗi
+    tạm thời hoặc lỗi schema: flush() giữ nguyên hàng đợi và thử lại.
+    """
+    return (isinstance(e, (mysql.connector.DataError, mysql.connector.IntegrityError))
+            or getattr(e, 'errno', None) in DATA_ERRNOS)
+
+
+def _write(cursor, rows):
+    """INSERT theo lô; lô bị lỗi dữ liệu thì ghi lại từng dòng. Trả về [(dòng, lỗi)] không ghi được"""
+    cursor.execute("SAVEPOINT scan_flush")
+    try:
+        insert_batches(cursor, scan_import.INSERT_SQL, rows)
+        return []
+    except mysql.connector.Error as e:
+        if not _is_data_error(e):
+            raise
+        try:
+            cursor.execute("ROLLBACK TO SAVEPOINT scan_flush")
+        except mysql.connector.Error:
+            # Transaction đã bị rollback toàn bộ (savepoint không còn): để flush() thử lại cả lô
+            raise e
+    failed = []
+    for row in rows:
+        try:
+            # Lỗi dữ liệu chỉ rollback câu lệnh của dòng đó, các dòng đã ghi vẫn giữ
+            cursor.execute(scan_import.INSERT_SQL, row)
+        except mysql.connector.Error as e:
+            if not _is_data_error(e):
+                raise
+            failed.append((row, str(e)))
+    return failed
+
+
+def _dead_letter(cursor, failed):
+    """Lưu scan không ghi được vào scan_dead_letter để kiểm tra, thay vì thử lại mãi"""
+    for row, error in failed:
+        try:
+            cursor.execute("INSERT INTO scan_dead_letter (jobno, sscc, payload, error) VALUES (%s, %s, %s, %s)",
+                           (row[0][:100], row[2][:100], json.dumps(row, default=str), error[:255]))
+        except mysql.connector.Error as e:
+            if not _is_data_error(e):
+                raise
+            print(f"❌ Không lưu được scan lỗi {row[2]!r}: {e}")
+
+
+def flush():
+    """Ghi toàn bộ scan trong hàng đợi vào scanfile (một transaction); trả về số dòng đã ghi.
+
+    Dòng bị Database từ chối hoặc SSCC đã được worker khác ghi được chuyển vào
+    scan_dead_letter; dòng của Job No đã bị xóa sau khi nhận scan bị bỏ.
+    """
+    with _flush_lock:
+        with _lock:
+            entries = _buffer[:]
+        if not entries:
+            return 0
+        conn = get_dedicated_connection()  # Không dùng chung transaction với request đang gọi
+        if not conn:
+            raise RuntimeError("Lỗi kết nối Database")
+        try:
+            cursor = conn.cursor(dictionary=True)
+            # Khóa dòng phiên bản của các Job No trước khi ghi: các lần ghi cùng Job No từ
+            # mọi worker và thao tác xóa Job No chạy lần lượt, nên kiểm tra dưới đây là chính xác
+            jobnos = list(dict.fromkeys(row[0] for _, row in entries))
+            keys = [versions.scanfile_key(j) for j in jobnos]
+            resets = [versions.scanreset_key(j) for j in jobnos]
+            versions.ensure(cursor, keys + resets)
+            before = versions.get(cursor, keys + resets, for_update=True)
+
+            live = [row for accepted_at, row in entries if accepted_at == before[versions.scanreset_key(row[0])]]
+            dropped = {row[0] for accepted_at, row in entries if accepted_at != before[versions.scanreset_key(row[0])]}
+            rows = []
+            failed = []
+            for jobno in jobnos:
+                job_rows = [row for row in live if row[0] == jobno]
+                written = scan_import.existing_ssccs(cursor, jobno, [row[2] for row in job_rows])
+                for row in job_rows:
+                    if row[2] in written:
+                        failed.append((row, "SSCC đã được ghi cho Job No (scan từ worker khác)"))
+                    else:
+                        rows.append(row)
+            failed += _write(cursor, rows)
+            _dead_letter(cursor, failed)
+            versions.bump(cursor, keys)
+            conn.commit()
+            cursor.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        stale_jobs = {row[0] for row, _ in failed} | dropped
+        written = len(live) - len(failed)
+        with _lock:
+            del _buffer[:len(entries)]
+            stats['flushed'] += written
+            stats['dead_letters'] += len(failed)
+            stats['dropped'] += len(entries) - len(live)
+            # Dòng vừa ghi đã có trong bộ đếm: giữ bộ đếm nếu không ai khác ghi xen vào
+            # (Job No có dòng lỗi / bị bỏ thì để bộ đếm nạp lại từ Database)
+            for jobno, key in zip(jobnos, keys):
+                counters = _counters.get(jobno)
+                if jobno not in stale_jobs and counters is not None and counters.stamp.get(key) == before[key]:
+                    counters.stamp = dict(counters.stamp, **{key: before[key] + 1})
+    return written
+
+
+def _run_flusher():
+    while True:
+        with _lock:
+            if len(_buffer) < FLUSH_SIZE:
+                _lock.wait(FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception:
+            stats['flush_failures'] += 1
+            traceback.print_exc()
+            time.sleep(FLUSH_INTERVAL)
+
+
+def _ensure_flusher():
+    # Tạo thread ghi sau khi gunicorn fork worker
+    global _flusher, _flusher_pid
+    with _lock:
+        if _flusher is None or _flusher_pid != os.getpid():
+            _flusher = threading.Thread(target=_run_flusher, name='scan-flush', daemon=True)
+            _flusher_pid = os.getpid()
+            _flusher.start()
+
+
+@atexit.register
+def _flush_at_exit():
+    # Worker dừng (gunicorn restart): ghi nốt scan còn trong hàng đợi
+    if _flusher_pid == os.getpid():
+        try:
+            flush()
+        except Exception:
+            traceback.print_exc()
+
+
+def forget(jobno):
+    """Bỏ bộ đếm của Job No trong worker này (worker khác nạp lại nhờ khóa scanreset)"""
+    with _lock:
+        _counters.pop(jobno.strip(), None)
+
+
+def get_stats():
+    with _lock:
+        return dict(stats, queued=len(_buffer), jobs=len(_counters))
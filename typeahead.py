@@ -0,0 +1,113 @@
+"""Gợi ý nhập liệu (typeahead) cho ô PO, Container, SKU.
+
+Mỗi loại có một chỉ mục tiền tố trong bộ nhớ: danh sách khóa viết thường đã sắp xếp,
+tra bằng bisect (O(log n) + số kết quả). Chỉ mục được nạp lần đầu khi cần, cập nhật
+thêm khi worker này ghi dữ liệu (add) và nạp lại toàn bộ sau REFRESH_TTL giây để nhận
+thay đổi từ worker khác hoặc bản ghi đã xóa.
+"""
+import bisect
+import threading
+import time
+
+REFRESH_TTL = 300  # Số giây trước khi nạp lại toàn bộ chỉ mục
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# kind -> (câu SQL lấy giá trị, danh sách rỗng trả về theo thứ tự giảm dần)
+SOURCES = {
+    'po': ("SELECT DISTINCT parentpo FROM bbrreport WHERE parentpo IS NOT NULL AND parentpo != ''", False),
+    'sku': ("""SELECT DISTINCT item FROM bbrreport WHERE item IS NOT NULL AND item != ''
+               UNION SELECT sku FROM masterdata WHERE sku IS NOT NULL AND sku != ''""", False),
+    'inbound_container': ("SELECT DISTINCT contxe FROM inbound WHERE contxe IS NOT NULL AND contxe != ''", True),
+    'outbound_container': ("SELECT DISTINCT container FROM outbound WHERE container IS NOT NULL AND container != ''", True),
+}
+
+
+class PrefixIndex:
+    """Danh sách giá trị đã sắp xếp theo khóa viết thường, tìm theo tiền tố bằng bisect"""
+
+    def __init__(self, values=()):
+        pairs = sorted({(str(v).strip().lower(), str(v).strip()) for v in values if v is not None and str(v).strip()})
+        self.keys = [k for k, _ in pairs]
+        self.values = [v for _, v in pairs]
+        self.loaded_at = time.monotonic()
+
+    def add(self, value):
+        value = str(value).strip()
+        if not value:
+            return
+        key = value.lower()
+        i = bisect.bisect_left(self.keys, key)
+        # Cùng khóa (khác hoa thường) vẫn giữ; bỏ qua nếu trùng hoàn toàn
+        while i < len(self.keys) and self.keys[i] == key:
+            if self.values[i] == value:
+                return
+            i += 1
+        self.keys.insert(i, key)
+        self.values.insert(i, value)
+
+    def search(self, prefix, limit, descending=False):
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return self.values[:-limit - 1:-1] if descending else self.values[:limit]
+        start = bisect.bisect_left(self.keys, prefix)
+        # '\uffff' lớn hơn mọi ký tự thường gặp: [prefix, prefix + '\uffff') là khoảng khớp tiền tố
+        end = min(bisect.bisect_left(self.keys, prefix + '\uffff', start), start + limit)
+        return self.values[start:end]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def _load(conn, kind):
+    cursor = conn.cursor()
+    cursor.execute(SOURCES[kind][0])
+    rows = cursor.fetchall()
+    cursor.close()
+    return PrefixIndex(r[0] for r in rows)
+
+
+def get_index(connect, kind):
+    """Chỉ mục của kind; connect() chỉ được gọi khi cần nạp từ Database"""
+    with _lock:
+        index = _indexes.get(kind)
+    if index is None or time.monotonic() - index.loaded_at > REFRESH_TTL:
+        conn = connect()
+        if not conn:
+            return index or PrefixIndex()
+        try:
+            index = _load(conn, kind)
+        finally:
+            conn.close()
+        with _lock:
+            _indexes[kind] = index
+    return index
+
+
+def search(connect, kind, prefix, limit=DEFAULT_LIMIT):
+    """Tối đa limit giá trị bắt đầu bằng prefix (không phân biệt hoa thường)"""
+    limit = max(1, min(int(limit or DEFAULT_LIMIT), MAX_LIMIT))
+    index = get_index(connect, kind)
+    with _lock:
+        return index.search(prefix or '', limit, descending=SOURCES[kind][1])
+
+
+def add(kind, values):
+    """Thêm giá trị mới vào chỉ mục đã nạp (gọi sau khi ghi BBR/Inbound/Outbound)"""
+    with _lock:
+        index = _indexes.get(kind)
+        if index is None:
+            return
+        for value in values:
+            if value is not None:
+                index.add(value)
+
+
+def get_stats():
+    with _lock:
+        return {kind: {'size': len(index), 'age': round(time.monotonic() - index.loaded_at, 1)}
+                for kind, index in _indexes.items()}
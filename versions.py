@@ -0,0 +1,54 @@
+"""Số phiên bản dữ liệu (bảng data_version) để kiểm tra cache còn hợp lệ.
+
+Mỗi khóa (ví dụ 'outbound:<jobno>') có một số tăng dần, được tăng trong cùng transaction
+với thao tác ghi. Cache lưu kèm các số phiên bản lúc tạo; khi đọc chỉ cần một truy vấn
+nhỏ để so sánh, nên đúng cả khi worker khác ghi dữ liệu.
+"""
+from db import select_in
+
+
+def outbound_key(jobno):
+    return f"outbound:{jobno}"
+
+
+def scanfile_key(jobno):
+    return f"scanfile:{jobno}"
+
+
+def scanreset_key(jobno):
+    # Chỉ tăng khi dữ liệu scan của Job No bị xóa / thay thế (không tăng khi thêm scan)
+    return f"scanreset:{jobno}"
+
+
+def table_key(table):
+    # Tăng khi thêm/sửa/xóa dòng của bảng (cache COUNT của pagination.py)
+    return f"table:{table}"
+
+
+def ensure(cursor, names):
+    """Tạo dòng phiên bản 0 cho khóa chưa có, để get(..., for_update=True) khóa được dòng đó"""
+    names = list(dict.fromkeys(n for n in names if n))
+    if names:
+        cursor.executemany("INSERT IGNORE INTO data_version (name, version) VALUES (%s, 0)", [(n,) for n in names])
+
+
+def bump(cursor, names):
+    """Tăng phiên bản các khóa (gọi trước conn.commit() của thao tác ghi)"""
+    names = list(dict.fromkeys(n for n in names if n))
+    if not names:
+        return
+    cursor.executemany("""
+        INSERT INTO data_version (name, version) VALUES (%s, 1)
+        ON DUPLICATE KEY UPDATE version = version + 1
+    """, [(n,) for n in names])
+
+
+def get(cursor, names, for_update=False):
+    """{khóa: phiên bản} cho các khóa; khóa chưa từng ghi có phiên bản 0.
+
+    for_update=True khóa các dòng phiên bản đến hết transaction (đọc rồi bump an toàn).
+    """
+    sql = "SELECT name, version FROM data_version WHERE name IN ({placeholders})"
+    rows = select_in(cursor, sql + (" FOR UPDATE" if for_update else ""), names)
+    found = {(r['name'] if isinstance(r, dict) else r[0]): (r['version'] if isinstance(r, dict) else r[1]) for r in rows}
+    return {n: found.get(n, 0) for n in names}
@@ -0,0 +1,85 @@
+"""Worker chạy báo cáo định kỳ, tách khỏi các gunicorn worker phục vụ request.
+
+Cách dùng:
+    python worker.py                        # Chạy scheduler (service worker trên Render)
+    python worker.py run outsource_email    # Chạy ngay một báo cáo (bỏ qua nếu kỳ đã gửi)
+    python worker.py run outsource_email --force   # Gửi lại kỳ hiện tại
+
+Lịch chạy lưu trong job store SQLite cục bộ (WORKER_JOBSTORE_URL), nên lần chạy bị lỡ
+trong lúc worker khởi động lại vẫn được chạy bù (trong MISFIRE_GRACE giây). Nếu có nhiều
+worker, chỉ tiến trình giữ khóa reports.LOCK_NAME chạy báo cáo; các tiến trình khác chờ
+và tự lấy khóa khi tiến trình đang giữ dừng.
+"""
+import argparse
+import os
+import signal
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
+
+import reports  # noqa: E402
+
+JOBSTORE_URL = os.getenv("WORKER_JOBSTORE_URL") or \
+    "sqlite:///" + os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worker_jobs.sqlite')
+MISFIRE_GRACE = int(os.getenv("WORKER_MISFIRE_GRACE") or 6 * 3600)
+HEARTBEAT = int(os.getenv("WORKER_HEARTBEAT") or 300)  # Số giây giữa hai lần kiểm tra khóa
+
+
+def heartbeat():
+    # Giữ kết nối của khóa không bị MySQL đóng vì idle; worker dự phòng lấy khóa khi có thể
+    reports.runner.ensure()
+
+
+def serve():
+    from apscheduler.jobstores.memory import MemoryJobStore
+    from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+    from apscheduler.schedulers.blocking import BlockingScheduler
+
+    scheduler = BlockingScheduler(
+        timezone=reports.TIMEZONE,
+        jobstores={'default': SQLAlchemyJobStore(url=JOBSTORE_URL), 'local': MemoryJobStore()},
+        job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': MISFIRE_GRACE},
+    )
+    for name, report in reports.REPORTS.items():
+        # Tham chiếu dạng chuỗi để job store lưu được job
+        scheduler.add_job('reports:run', 'cron', args=[name], id=name, replace_existing=True, **report.cron)
+    scheduler.add_job(heartbeat, 'interval', seconds=HEARTBEAT, id='heartbeat', jobstore='local')
+
+    if reports.runner.ensure():
+        print("🔒 Đã giữ khóa chạy báo cáo.")
+    else:
+        print("⏳ Worker khác đang giữ khóa, chạy ở chế độ dự phòng.")
+
+    signal.signal(signal.SIGTERM, lambda *_: scheduler.shutdown(wait=False))
+    print(f"⏰ Đã khởi động worker báo cáo: {', '.join(reports.REPORTS)}")
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        reports.mailer.close()
+        reports.runner.release()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Worker báo cáo định kỳ WMS")
+    sub = parser.add_subparsers(dest='command')
+    run = sub.add_parser('run', help="Chạy ngay một báo cáo")
+    run.add_argument('report', choices=list(reports.REPORTS))
+    run.add_argument('--force', action='store_true', help="Gửi lại kể cả khi kỳ này đã gửi")
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        try:
+            return 0 if reports.run(args.report, force=args.force) != 'error' else 1
+        finally:
+            reports.mailer.close()
+            reports.runner.release()
+    return serve()
+
+
+if __name__ == "__main__":
+    sys.exit(main())